@@ -0,0 +1,123 @@
+import time
+from typing import Any, AsyncIterator, Callable, Dict
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+from config import settings
+from utils.conversation_memory import count_tokens
+from utils.llm_governor import governor
+from utils.llm_usage import usage_config
+from utils.logger import logger
+from utils.prompts import Initial_phase, chat_with_context, summarize_conversation, ambiguity_questions, tech_recommendations, document_gate
+from utils.prompts_response import ProjectDefinition, Chat_with_context, ImageBatchSummary, DocumentGate
+from agents.llm_backend import get_chat_model
+
+
+CHAIN_BUILDERS: Dict[str, Callable[[Any], Runnable]] = {
+    "analyze_input": lambda llm: ChatPromptTemplate.from_template(Initial_phase) | llm.with_structured_output(ProjectDefinition),
+    "analyze_input_stream": lambda llm: ChatPromptTemplate.from_template(Initial_phase) | llm.bind_tools([ProjectDefinition], tool_choice="ProjectDefinition"),
+    "identify_ambiguities": lambda llm: ChatPromptTemplate.from_template(ambiguity_questions) | llm | StrOutputParser(),
+    "tech_recommendations": lambda llm: ChatPromptTemplate.from_template(tech_recommendations) | llm | StrOutputParser(),
+    "chat_with_doc": lambda llm: ChatPromptTemplate.from_template(chat_with_context) | llm.with_structured_output(Chat_with_context),
+    "chat_with_doc_stream": lambda llm: ChatPromptTemplate.from_template(chat_with_context) | llm | StrOutputParser(),
+    "summarize_conversation": lambda llm: ChatPromptTemplate.from_template(summarize_conversation) | llm | StrOutputParser(),
+    "summarize_images": lambda llm: llm.with_structured_output(ImageBatchSummary),
+    #runs on the cheap DOCUMENT_GATE_MODEL instead of the shared analysis model
+    "document_gate": lambda llm: ChatPromptTemplate.from_template(document_gate) | get_chat_model(model=settings.DOCUMENT_GATE_MODEL, temperature=0).with_structured_output(DocumentGate),
+}
+
+
+class ChainRegistry:
+    """
+    Compiles every prompt, structured output schema and runnable once and hands out the shared instances.
+
+    Building a chain parses the prompt template and derives the JSON schema of the pydantic response
+    model, which used to happen on every request. The registry keeps per chain stats so the saving can
+    be checked: `build_ms` is the one off cost each request used to pay, `avg_latency_ms` the full
+    invocation time and `avg_overhead_ms` the time spent in the registry itself (lookup + bookkeeping).
+
+    Args:
+    llm: chat model the chains are bound to
+    builders: Dict[str, callable(llm) -> Runnable]
+    """
+    def __init__(self, llm, builders:Dict[str, Callable[[Any], Runnable]]=None):
+        self.llm = llm
+        self.builders = builders or CHAIN_BUILDERS
+        self._chains: Dict[str, Runnable] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def build(self) -> Dict[str, float]:
+        """Build every registered chain, called once at startup. Returns build time per chain in ms"""
+        for name in self.builders:
+            self._build(name)
+        build_times = {name: stats["build_ms"] for name, stats in self._stats.items()}
+        logger.info(f"chain registry built {len(self._chains)} chains in {sum(build_times.values()):.2f} ms: {build_times}")
+        return build_times
+
+    def _build(self, name:str) -> Runnable:
+        if name not in self.builders:
+            raise KeyError(f"chain not registered: {name}")
+        start = time.perf_counter()
+        chain = self.builders[name](self.llm)
+        self._chains[name] = chain
+        self._stats[name] = {
+            "build_ms": (time.perf_counter() - start) * 1000,
+            "invocations": 0,
+            "total_latency_ms": 0.0,
+            "total_overhead_ms": 0.0,
+        }
+        return chain
+
+    def get(self, name:str) -> Runnable:
+        """Shared chain instance, built on first use if build() was not called"""
+        chain = self._chains.get(name)
+        if chain is None:
+            chain = self._build(name)
+        return chain
+
+    def _record(self, name:str, started:float, overhead:float):
+        stats = self._stats[name]
+        stats["invocations"] += 1
+        stats["total_latency_ms"] += (time.perf_counter() - started) * 1000
+        stats["total_overhead_ms"] += overhead * 1000
+
+    @staticmethod
+    def estimate_tokens(inputs:Any) -> int:
+        return count_tokens(str(inputs)) + settings.LLM_EXPECTED_COMPLETION_TOKENS
+
+    async def ainvoke(self, name:str, inputs:Any, estimated_tokens:int=None, **kwargs) -> Any:
+        """Invoke a chain through the LLM governor, estimated_tokens defaults to the size of the inputs"""
+        started = time.perf_counter()
+        chain = self.get(name)
+        kwargs.setdefault("config", usage_config(name))
+        overhead = time.perf_counter() - started
+        try:
+            return await governor.run(lambda: chain.ainvoke(inputs, **kwargs), estimated_tokens=estimated_tokens or self.estimate_tokens(inputs))
+        finally:
+            self._record(name, started, overhead)
+
+    async def astream(self, name:str, inputs:Any, estimated_tokens:int=None, **kwargs) -> AsyncIterator[Any]:
+        """Stream a chain while holding a governor slot, chunks already sent can't be retried"""
+        started = time.perf_counter()
+        chain = self.get(name)
+        kwargs.setdefault("config", usage_config(name))
+        overhead = time.perf_counter() - started
+        try:
+            async with governor.limit(estimated_tokens or self.estimate_tokens(inputs)):
+                async for chunk in chain.astream(inputs, **kwargs):
+                    yield chunk
+        finally:
+            self._record(name, started, overhead)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for name, stats in self._stats.items():
+            invocations = stats["invocations"]
+            report[name] = {
+                "build_ms": round(stats["build_ms"], 3),
+                "invocations": invocations,
+                "avg_latency_ms": round(stats["total_latency_ms"] / invocations, 3) if invocations else None,
+                "avg_overhead_ms": round(stats["total_overhead_ms"] / invocations, 4) if invocations else None,
+                "saved_build_ms": round(stats["build_ms"] * invocations, 3),
+            }
+        return report
@@ -0,0 +1,126 @@
+import re
+from typing import Dict, Optional
+from config import settings
+from agents.chains import ChainRegistry
+from utils.logger import logger
+from utils.prompts_response import DocumentGate
+
+# Distinct markers found in the excerpt, each one counts once no matter how often it repeats
+NON_TECHNICAL_MARKERS = {
+    "invoice": ["invoice", "bill to", "amount due", "total due", "balance due", "payment terms", "due date", "subtotal", "remit to", "purchase order", "receipt"],
+    "resume": ["curriculum vitae", "resume", "work experience", "professional experience", "employment history", "education", "certifications", "references available", "linkedin.com", "career objective", "professional summary"],
+}
+TECHNICAL_MARKERS = [
+    "requirement", "requirements", "shall", "must support", "scope of work", "deliverables", "architecture", "integration",
+    "api", "rfp", "rfi", "request for proposal", "proposal", "milestone", "timeline", "we need", "we want", "want to build",
+    "platform", "end users", "deployment", "acceptance criteria", "functional", "non-functional", "workflow", "database",
+]
+
+#distinct marker counts needed for the heuristic to decide without a model call
+MIN_CONFIDENT_MARKERS = 4
+CONFIDENCE_RATIO = 2
+
+
+def _pattern(markers) -> re.Pattern:
+    return re.compile(r"\b(" + "|".join(re.escape(marker) for marker in sorted(markers, key=len, reverse=True)) + r")\b")
+
+
+NON_TECHNICAL_PATTERNS = {document_type: _pattern(markers) for document_type, markers in NON_TECHNICAL_MARKERS.items()}
+TECHNICAL_PATTERN = _pattern(TECHNICAL_MARKERS)
+
+
+def sample_excerpt(text:str, max_chars:int=None) -> str:
+    """
+    head, middle and tail of a document, so a cover page or an appendix alone doesn't decide the classification
+
+    Args:
+    text: str, extracted document text
+    max_chars: int, size of the excerpt, defaults to DOCUMENT_GATE_SAMPLE_CHARS
+
+    Returns:
+    str: the excerpt, the whole text when it is short enough
+    """
+    max_chars = max_chars or settings.DOCUMENT_GATE_SAMPLE_CHARS
+    if len(text) <= max_chars:
+        return text
+    part = max_chars // 3
+    middle = (len(text) - part) // 2
+    return "\n...\n".join([text[:part], text[middle:middle + part], text[-part:]])
+
+
+def heuristic_classify(excerpt:str) -> Optional[DocumentGate]:
+    """
+    keyword classifier for the obvious cases
+
+    Returns:
+    DocumentGate when the markers clearly point one way, None when the model has to decide
+    """
+    lowered = excerpt.lower()
+    technical = set(TECHNICAL_PATTERN.findall(lowered))
+    non_technical: Dict[str, set] = {document_type: set(pattern.findall(lowered)) for document_type, pattern in NON_TECHNICAL_PATTERNS.items()}
+    document_type, markers = max(non_technical.items(), key=lambda item: len(item[1]))
+    title = _first_line(excerpt)
+
+    if len(markers) >= MIN_CONFIDENT_MARKERS and len(markers) >= CONFIDENCE_RATIO * len(technical):
+        return DocumentGate(
+            is_technical_document=False,
+            document_type=document_type,
+            document_analysis=f"The document reads as {'an' if document_type[0] in 'aeiou' else 'a'} {document_type} ({', '.join(sorted(markers))}), not a proposal for a system or product to be built, so no technical analysis was done.",
+            title=title or document_type.title(),
+        )
+    if len(technical) >= MIN_CONFIDENT_MARKERS and len(technical) >= CONFIDENCE_RATIO * max(len(markers), 1):
+        return DocumentGate(
+            is_technical_document=True,
+            document_type="technical",
+            document_analysis=f"Technical markers found: {', '.join(sorted(technical))}",
+            title=title,
+        )
+    return None
+
+
+def _first_line(text:str) -> str:
+    line = next((line.strip() for line in text.splitlines() if line.strip()), "")
+    return " ".join(line.split()[:7])
+
+
+async def classify_document(text:str, chains:ChainRegistry) -> DocumentGate:
+    """
+    Cheap first stage in front of the full ProjectDefinition pass.
+
+    DOCUMENT_GATE_MODE:
+    - "heuristic": keyword classifier only, unclear documents go on to the full analysis
+    - "llm": always ask DOCUMENT_GATE_MODEL about the excerpt
+    - "hybrid": keyword classifier first, DOCUMENT_GATE_MODEL only for unclear documents
+    - "off": every document goes on to the full analysis
+
+    The gate fails open: when the gate model errors, the document is treated as technical so the
+    full analysis still makes the final call.
+
+    Args:
+    text: str, extracted document text
+    chains: ChainRegistry holding the "document_gate" chain
+
+    Returns:
+    DocumentGate
+    """
+    mode = settings.DOCUMENT_GATE_MODE
+    passthrough = DocumentGate(is_technical_document=True, document_type="unknown", document_analysis="not classified", title=_first_line(text))
+    if mode == "off":
+        return passthrough
+
+    excerpt = sample_excerpt(text)
+    if mode in ("heuristic", "hybrid"):
+        gate = heuristic_classify(excerpt)
+        if gate is not None:
+            logger.info(f"document gate (heuristic): technical={gate.is_technical_document} type={gate.document_type}")
+            return gate
+        if mode == "heuristic":
+            return passthrough
+
+    try:
+        gate = await chains.ainvoke("document_gate", {"excerpt": excerpt})
+    except Exception as e:
+        logger.error(f"document gate model failed, continuing with the full analysis: {str(e)}")
+        return passthrough
+    logger.info(f"document gate (model): technical={gate.is_technical_document} type={gate.document_type}")
+    return gate
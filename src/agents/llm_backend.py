@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+from config import settings
+from utils.conversation_memory import count_tokens
+from utils.logger import logger
+
+_WORDS = (
+    "system service api gateway database cache queue worker pipeline deployment cluster storage "
+    "latency throughput schema endpoint integration authentication monitoring scaling requirement "
+    "milestone backend frontend analytics model dashboard workflow release security compliance"
+).split()
+
+
+class StubLLMError(Exception):
+    """Injected failure of the stub backend, status_code mirrors the provider error it stands in for"""
+    def __init__(self, message:str, status_code:int=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline, deterministic chat model for load tests and benchmarks.
+
+    The same prompt always produces the same answer, token counts and latency sample (seeded by
+    `seed` + prompt hash). Latency is drawn from `latency_distribution` around `latency_ms` with
+    `latency_jitter_ms` spread, and is spread across chunks when streaming. `error_rate` of the calls
+    fail with StubLLMError, `rate_limit_share` of those with a 429 like the provider rate limit; the
+    failures follow their own seeded sequence so retries of the same prompt can succeed.
+    Tool binding is supported, so `with_structured_output` returns schema valid instances of any
+    pydantic model (ProjectDefinition, Chat_with_context, ...).
+    """
+    model_name: str = "stub"
+    latency_ms: float = 800.0
+    latency_jitter_ms: float = 200.0
+    latency_distribution: str = "normal"
+    completion_tokens: int = 200
+    error_rate: float = 0.0
+    rate_limit_share: float = 0.5
+    seed: int = 0
+    #errors come from a per instance sequence instead of the prompt seeded rng, so a retried call can succeed
+    _error_rng: random.Random = PrivateAttr(default=None)
+
+    def model_post_init(self, __context:Any):
+        self._error_rng = random.Random(f"{self.seed}:errors")
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "seed": self.seed}
+
+    def bind_tools(self, tools:Sequence[Any], tool_choice:Optional[Any]=None, **kwargs:Any):
+        formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
+        return super().bind(tools=formatted_tools, tool_choice=tool_choice, **kwargs)
+
+    def _rng(self, messages:List[BaseMessage]) -> random.Random:
+        digest = hashlib.sha256(json.dumps([str(message.content) for message in messages]).encode()).hexdigest()
+        return random.Random(f"{self.seed}:{digest}")
+
+    def _latency(self, rng:random.Random) -> float:
+        if self.latency_distribution == "fixed":
+            latency = self.latency_ms
+        elif self.latency_distribution == "uniform":
+            latency = rng.uniform(self.latency_ms - self.latency_jitter_ms, self.latency_ms + self.latency_jitter_ms)
+        elif self.latency_distribution == "lognormal":
+            #long tail with the given mean, jitter is used as the standard deviation
+            sigma = math.sqrt(math.log(1 + (self.latency_jitter_ms / max(self.latency_ms, 1)) ** 2))
+            latency = rng.lognormvariate(math.log(max(self.latency_ms, 1)) - sigma ** 2 / 2, sigma)
+        else:
+            latency = rng.gauss(self.latency_ms, self.latency_jitter_ms)
+        return max(latency, 0.0) / 1000
+
+    def _maybe_fail(self):
+        if self.error_rate and self._error_rng.random() < self.error_rate:
+            if self._error_rng.random() < self.rate_limit_share:
+                raise StubLLMError("stub backend injected rate limit", status_code=429)
+            raise StubLLMError("stub backend injected server error", status_code=500)
+
+    def _text(self, rng:random.Random, tokens:int) -> str:
+        return " ".join(rng.choice(_WORDS) for _ in range(max(tokens, 1)))
+
+    def _fake_value(self, schema:Dict, rng:random.Random, defs:Dict, name:str="", position:int=0) -> Any:
+        if "$ref" in schema:
+            return self._fake_value(defs[schema["$ref"].split("/")[-1]], rng, defs, name, position)
+        if "anyOf" in schema:
+            options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+            return self._fake_value(options[0], rng, defs, name, position) if options else None
+        value_type = schema.get("type", "string")
+        if value_type == "object":
+            return {key: self._fake_value(value, rng, defs, key, position) for key, value in schema.get("properties", {}).items()}
+        if value_type == "array":
+            return [self._fake_value(schema.get("items", {}), rng, defs, name, index) for index in range(3)]
+        if value_type == "boolean":
+            return True
+        if value_type == "integer":
+            #indexes point back at numbered inputs (image_index ...), so count from 1
+            return position + 1 if "index" in name else rng.randint(1, 10)
+        if value_type == "number":
+            return round(rng.uniform(0, 1), 3)
+        return self._text(rng, max(self.completion_tokens // 10, 3))
+
+    def _tool_call(self, rng:random.Random, tools:List[Dict]) -> Dict:
+        function = tools[0]["function"]
+        parameters = function.get("parameters", {})
+        args = self._fake_value(parameters, rng, parameters.get("$defs", {}))
+        return {"name": function["name"], "args": args, "id": f"call_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}"}
+
+    def _response(self, messages:List[BaseMessage], rng:random.Random, **kwargs:Any) -> AIMessage:
+        prompt_tokens = sum(count_tokens(str(message.content)) for message in messages)
+        tools = kwargs.get("tools")
+        if tools:
+            tool_call = self._tool_call(rng, tools)
+            completion_tokens = count_tokens(json.dumps(tool_call["args"]))
+            message = AIMessage(content="", tool_calls=[tool_call])
+        else:
+            message = AIMessage(content=self._text(rng, self.completion_tokens))
+            completion_tokens = self.completion_tokens
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        message.response_metadata = {"model_name": self.model_name, "finish_reason": "stop"}
+        return message
+
+    def _generate(self, messages:List[BaseMessage], stop:Optional[List[str]]=None, run_manager:Optional[CallbackManagerForLLMRun]=None, **kwargs:Any) -> ChatResult:
+        rng = self._rng(messages)
+        time.sleep(self._latency(rng))
+        self._maybe_fail()
+        return ChatResult(generations=[ChatGeneration(message=self._response(messages, rng, **kwargs))])
+
+    async def _agenerate(self, messages:List[BaseMessage], stop:Optional[List[str]]=None, run_manager:Optional[AsyncCallbackManagerForLLMRun]=None, **kwargs:Any) -> ChatResult:
+        rng = self._rng(messages)
+        await asyncio.sleep(self._latency(rng))
+        self._maybe_fail()
+        return ChatResult(generations=[ChatGeneration(message=self._response(messages, rng, **kwargs))])
+
+    def _chunks(self, message:AIMessage) -> List[AIMessageChunk]:
+        """Split a response into stream chunks, usage is reported on the last chunk like the OpenAI stream"""
+        if message.tool_calls:
+            tool_call = message.tool_calls[0]
+            arguments = json.dumps(tool_call["args"])
+            pieces = [arguments[index:index + 16] for index in range(0, len(arguments), 16)]
+            chunks = [
+                AIMessageChunk(content="", tool_call_chunks=[{"name": tool_call["name"] if index == 0 else None, "args": piece, "id": tool_call["id"] if index == 0 else None, "index": 0}])
+                for index, piece in enumerate(pieces)
+            ]
+        else:
+            words = message.content.split(" ")
+            chunks = [AIMessageChunk(content=word if index == 0 else f" {word}") for index, word in enumerate(words)]
+        chunks.append(AIMessageChunk(content="", usage_metadata=message.usage_metadata, response_metadata=message.response_metadata))
+        return chunks
+
+    def _stream(self, messages:List[BaseMessage], stop:Optional[List[str]]=None, run_manager:Optional[CallbackManagerForLLMRun]=None, **kwargs:Any) -> Iterator[ChatGenerationChunk]:
+        rng = self._rng(messages)
+        latency = self._latency(rng)
+        self._maybe_fail()
+        chunks = self._chunks(self._response(messages, rng, **kwargs))
+        for chunk in chunks:
+            time.sleep(latency / len(chunks))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages:List[BaseMessage], stop:Optional[List[str]]=None, run_manager:Optional[AsyncCallbackManagerForLLMRun]=None, **kwargs:Any) -> AsyncIterator[ChatGenerationChunk]:
+        rng = self._rng(messages)
+        latency = self._latency(rng)
+        self._maybe_fail()
+        chunks = self._chunks(self._response(messages, rng, **kwargs))
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            yield ChatGenerationChunk(message=chunk)
+
+
+def get_chat_model(model:str=None, temperature:float=1, api_key:str=None) -> BaseChatModel:
+    """
+    Chat model of the configured LLM_BACKEND
+
+    Args:
+    model: str, model name, defaults to LLM_MODEL
+    temperature: float,
+    api_key: str, provider key, defaults to OPENAI_CHATGPT
+
+    Returns:
+    BaseChatModel: ChatOpenAI for "openai", StubChatModel for "stub"
+    """
+    model = model or settings.LLM_MODEL
+    if settings.LLM_BACKEND == "stub":
+        logger.info(f"using stub LLM backend for model: {model}")
+        return StubChatModel(
+            model_name=model,
+            latency_ms=settings.LLM_STUB_LATENCY_MS,
+            latency_jitter_ms=settings.LLM_STUB_LATENCY_JITTER_MS,
+            latency_distribution=settings.LLM_STUB_LATENCY_DISTRIBUTION,
+            completion_tokens=settings.LLM_STUB_COMPLETION_TOKENS,
+            error_rate=settings.LLM_STUB_ERROR_RATE,
+            seed=settings.LLM_STUB_SEED,
+        )
+    if settings.LLM_BACKEND != "openai":
+        raise ValueError(f"unsupported LLM_BACKEND: {settings.LLM_BACKEND}")
+    #retries are handled by utils.llm_governor so they are coordinated with the shared rate budgets
+    #stream_usage makes streamed calls report token usage like regular ones
+    return ChatOpenAI(temperature=temperature, api_key=api_key or settings.OPENAI_CHATGPT, model=model, max_retries=0, stream_usage=True)
@@ -0,0 +1,416 @@
+import asyncio
+import hashlib
+import io
+import json
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+import docx
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer,Image, Table, TableStyle, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle, StyleSheet1
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from config import settings
+from utils.document_save import get_s3_client, document_exists_s3, get_document_s3, open_document_s3, upload_document_s3
+from utils.prompts_response import ProjectDefinition
+from utils.logger import logger
+
+#bump when the report layout changes, so stored reports of the old layout are not served anymore
+REPORT_TEMPLATE_VERSION = "1"
+REQUIREMENT_SECTIONS = ("project_definition", "technology_stack", "risk_analysis")
+
+
+@lru_cache(maxsize=1)
+def report_styles() -> StyleSheet1:
+    """Report stylesheet, built once per process"""
+    styles = getSampleStyleSheet()
+
+    # Safe style modifications
+    def safe_add_style(name, base_style=None, **kwargs):
+        if name in styles:
+            for key, value in kwargs.items():
+                setattr(styles[name], key, value)
+        else:
+            styles.add(ParagraphStyle(name, parent=base_style, **kwargs))
+
+    safe_add_style('TitleCentered', base_style=styles['Title'],
+                alignment=1, textColor=colors.darkblue, fontName='Helvetica-Bold')
+    safe_add_style('SectionHeader', base_style=styles['Heading2'],
+                fontSize=14, spaceAfter=12, textColor=colors.darkblue)
+    styles['BodyText'].fontSize = 10
+    styles['BodyText'].leading = 14
+    return styles
+
+
+@lru_cache(maxsize=1)
+def logo_bytes() -> Optional[bytes]:
+    """Header logo, read from disk once per process"""
+    try:
+        with open(settings.REPORT_LOGO_PATH, "rb") as logo_file:
+            return logo_file.read()
+    except OSError as e:
+        logger.error(f"report logo not available at {settings.REPORT_LOGO_PATH}: {str(e)}")
+        return None
+
+
+def analysis_hash(report:Dict) -> str:
+    """Content hash of the report data, identical analyses share one stored report"""
+    payload = json.dumps(report, sort_keys=True, default=str)
+    return hashlib.sha256(f"{REPORT_TEMPLATE_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+def report_key(report_hash:str, export_format:str="pdf") -> str:
+    return f"reports/{report_hash}.{export_format}"
+
+
+def render_report(report:Dict) -> bytes:
+    """
+    Create professional PDF document with formatted content. Pure function so it can run in a worker process
+
+    Args:
+    report: dict, {"requirements": dict, "tech_stack": dict, "ambiguities": dict}
+
+    Returns:
+    bytes: the PDF
+    """
+    styles = report_styles()
+    requirements = report.get("requirements")
+    tech_stack = report.get("tech_stack")
+    ambiguities = report.get("ambiguities")
+    buffer = io.BytesIO()
+
+    # Create document template
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        leftMargin=0.5*inch,
+        rightMargin=0.5*inch,
+        topMargin=0.3*inch,
+        bottomMargin=0.5*inch
+    )
+
+    flow = []
+
+    # Header Section
+    logo = logo_bytes()
+    if logo:
+        header_table = Table([
+            [Image(io.BytesIO(logo), width=2*inch, height=0.75*inch),
+            Paragraph("Technical Proposal<br/>Project Scoping Document", styles['TitleCentered']),
+            Paragraph("Confidential", styles['BodyText'])]
+        ], colWidths=[2*inch, 4*inch, 1.5*inch])
+        header_table.setStyle(TableStyle([
+            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('LINEBELOW', (0,0), (-1,-1), 1, colors.lightgrey)
+        ]))
+        flow.append(header_table)
+    else:
+        flow.append(Paragraph("Company Name", styles['TitleCentered']))
+
+    flow.append(Spacer(1, 0.25*inch))
+
+    # Project Overview
+    flow.append(Paragraph("Project Overview", styles['SectionHeader']))
+    overview_data = [
+        ["Client Name:", "Acme Corporation"],
+        ["Date Prepared:", datetime.today().strftime('%Y-%m-%d')]
+    ]
+    overview_table = Table(overview_data, colWidths=[1.5*inch, 4*inch])
+    overview_table.setStyle(TableStyle([
+        ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
+        ('BACKGROUND', (0,0), (-1,0), colors.lightblue)
+    ]))
+    flow.append(overview_table)
+
+    # Project Definition Section
+    flow.append(PageBreak())
+    flow.append(Paragraph("Project Definition", styles['SectionHeader']))
+
+    def format_dict(data, indent=0):
+        """Recursively format dictionary data for PDF"""
+        formatted = []
+        for key, value in data.items():
+            if value is None:
+                continue
+            key_str = f"<b>{key.replace('_', ' ').title()}:</b>"
+            if isinstance(value, dict):
+                formatted.append(Paragraph(key_str, styles['BodyText']))
+                formatted += format_dict(value, indent+1)
+            elif isinstance(value, list):
+                formatted.append(Paragraph(key_str, styles['BodyText']))
+                for item in value:
+                    formatted.append(Paragraph(f"• {item}", styles['BodyText']))
+            else:
+                text = f"{key_str} {value}"
+                formatted.append(Paragraph(text, styles['BodyText']))
+        return formatted
+
+    # Add formatted requirements, nested sections of the old agent output or a flat ProjectDefinition
+    if isinstance(requirements, dict) and requirements:
+        if any(section in requirements for section in REQUIREMENT_SECTIONS):
+            for section in REQUIREMENT_SECTIONS:
+                flow += format_dict(requirements.get(section, {}))
+        else:
+            flow += format_dict(requirements)
+    else:
+        flow.append(Paragraph("No requirements data available", styles['BodyText']))
+
+    def wrapped_text(content, width, style):
+        return Paragraph(f"<para fontSize={style.fontSize} leading={style.leading}>\
+                        {content}</para>", style)
+
+    # System Design Section
+    flow.append(PageBreak())
+    flow.append(Paragraph("System Design", styles['SectionHeader']))
+
+    # Technology Stack Section
+    flow.append(Spacer(1, 0.25*inch))
+    flow.append(Paragraph("Technology Stack", styles['SectionHeader']))
+
+    if isinstance(tech_stack, dict):
+        primary_stack = tech_stack.get('primary_stack', {})
+        tech_data = [
+            ["<b>Type</b>", "<b>Technologies</b>", "<b>Details</b>"]
+        ]
+
+        # Primary Cloud Stack
+        tech_data.append([
+            "Primary (Cloud)",
+            wrapped_text("<br/>• " + "<br/>• ".join(primary_stack.get('cloud', [])), 2*inch, styles['BodyText']),
+            wrapped_text(primary_stack.get('Optimized technologies to complete this project with cost efficiency', ""), 2.5*inch, styles['BodyText']),
+            wrapped_text(primary_stack.get('Developers required to complete this project', ""), 2.5*inch, styles['BodyText'])
+        ])
+
+        # Primary On-Prem Stack
+        tech_data.append([
+            "Primary (On-Prem)",
+            wrapped_text("<br/>• " + "<br/>• ".join(primary_stack.get('on_prem', [])), 2*inch, styles['BodyText']),
+            ""
+        ])
+
+        # Alternatives
+        alternatives = [
+            f"{alt['tech'][0]} ({alt['cost_savings']})"
+            for alt in tech_stack.get('alternatives', [])
+        ]
+        tech_data.append([
+            "Alternatives",
+            wrapped_text("<br/>• " + "<br/>• ".join(alternatives), 2*inch, styles['BodyText']),
+            ""
+        ])
+
+        tech_table = Table(tech_data, colWidths=[1.5*inch, 2*inch, 2.5*inch])
+        tech_table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.lightblue),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.lightgrey),
+            ('VALIGN', (0,0), (-1,-1), 'TOP'),
+            ('WORDWRAP', (0,0), (-1,-1)),
+            ('LEADING', (0,0), (-1,-1), 14),
+            ('FONTSIZE', (0,0), (-1,-1), 10)
+        ]))
+        flow.append(tech_table)
+        flow.append(Spacer(1, 0.25*inch))
+
+    # Ambiguities Section
+    flow.append(PageBreak())
+    flow.append(Paragraph("Open Questions", styles['SectionHeader']))
+    if isinstance(ambiguities, dict) and 'questions' in ambiguities:
+        for i, question in enumerate(ambiguities['questions'], 1):
+            flow.append(Paragraph(f"{i}. {question}", styles['BodyText']))
+
+    # Footer with Page Numbers
+    def add_page_numbers(canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica', 8)
+        canvas.drawCentredString(4.25*inch, 0.5*inch, f"Page {doc.page}")
+        canvas.restoreState()
+
+    doc.build(flow, onFirstPage=add_page_numbers, onLaterPages=add_page_numbers)
+    return buffer.getvalue()
+
+
+def report_sections(report:Dict) -> List[Tuple[str, Any]]:
+    """(heading, value) pairs of the analysis, shared by the text based export formats"""
+    sections = []
+    requirements = report.get("requirements")
+    if isinstance(requirements, dict):
+        for key, value in requirements.items():
+            if value is None or key in ("title", "is_technical_document"):
+                continue
+            sections.append((key.replace("_", " ").title(), value))
+    tech_stack = report.get("tech_stack")
+    if isinstance(tech_stack, dict) and tech_stack:
+        sections.append(("Technology Stack", tech_stack))
+    ambiguities = report.get("ambiguities")
+    if isinstance(ambiguities, dict) and ambiguities.get("questions"):
+        sections.append(("Open Questions", ambiguities["questions"]))
+    return sections
+
+
+def report_title(report:Dict) -> str:
+    requirements = report.get("requirements")
+    return (requirements.get("title") if isinstance(requirements, dict) else None) or "Project Scoping Document"
+
+
+def render_markdown(report:Dict) -> bytes:
+    """Same markdown the UI shows for a ProjectDefinition, followed by the later pipeline stages"""
+    requirements = report.get("requirements")
+    lines = [f"# {report_title(report)}\n"]
+    try:
+        md, _ = ProjectDefinition.model_validate(requirements).to_markdown()
+        lines.append(md)
+        sections = [(heading, value) for heading, value in report_sections(report) if heading in ("Technology Stack", "Open Questions")]
+    except Exception:
+        sections = report_sections(report)
+
+    def add(value, depth):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                lines.append(f"{'  ' * depth}- **{str(key).replace('_', ' ')}**:")
+                add(item, depth + 1)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, (dict, list)):
+                    add(item, depth)
+                else:
+                    lines.append(f"{'  ' * depth}- {item}")
+        else:
+            lines.append(f"{'  ' * depth}{value}" if depth else f"{value}\n")
+
+    for heading, value in sections:
+        lines.append(f"\n## {heading}")
+        add(value, 0)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def render_json(report:Dict) -> bytes:
+    return json.dumps(report, indent=2, default=str).encode("utf-8")
+
+
+def render_docx(report:Dict) -> bytes:
+    document = docx.Document()
+    document.add_heading(report_title(report), 0)
+
+    def add(value, level):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                document.add_heading(str(key).replace("_", " ").title(), level=min(level, 9))
+                add(item, level + 1)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, (dict, list)):
+                    add(item, level)
+                else:
+                    document.add_paragraph(str(item), style="List Bullet")
+        else:
+            document.add_paragraph(str(value))
+
+    for heading, value in report_sections(report):
+        document.add_heading(heading, level=1)
+        add(value, 2)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    renderer: Callable[[Dict], bytes]
+    #heavy renderers run in the process pool, the cheap ones inline
+    in_process_pool: bool
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "pdf": ExportFormat("application/pdf", render_report, True),
+    "docx": ExportFormat("application/vnd.openxmlformats-officedocument.wordprocessingml.document", render_docx, True),
+    "md": ExportFormat("text/markdown; charset=utf-8", render_markdown, False),
+    "json": ExportFormat("application/json", render_json, False),
+}
+
+
+class ReportRenderer:
+    """
+    Renders analysis exports (pdf, docx, md, json) on demand and keeps every rendering in object storage
+    under reports/{analysis hash}.{format}, so each format of an analysis is rendered once. PDF and DOCX
+    are rendered in a process pool, off the event loop. Concurrent requests for the same rendering share
+    one render. The pool is created on first use and shut down from the app lifespan.
+    """
+    def __init__(self, max_workers:int=None):
+        self.max_workers = max_workers or settings.REPORT_RENDER_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def render(self, report:Dict, export_format:str="pdf") -> bytes:
+        export = EXPORT_FORMATS[export_format]
+        if not export.in_process_pool:
+            return export.renderer(report)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, export.renderer, report)
+
+    async def fetch(self, report_hash:str, export_format:str="pdf") -> Optional[bytes]:
+        """Stored rendering, None when it wasn't rendered yet"""
+        s3 = get_s3_client()
+        return await asyncio.to_thread(get_document_s3, s3, report_key(report_hash, export_format), settings.S3_BUCKET_NAME)
+
+    async def exists(self, report_hash:str, export_format:str="pdf") -> bool:
+        """Whether the rendering is stored, without downloading it"""
+        s3 = get_s3_client()
+        return await asyncio.to_thread(document_exists_s3, s3, report_key(report_hash, export_format), settings.S3_BUCKET_NAME)
+
+    async def open(self, report_hash:str, export_format:str="pdf"):
+        """Stored rendering as a streaming body, None when it wasn't rendered yet"""
+        s3 = get_s3_client()
+        return await asyncio.to_thread(open_document_s3, s3, report_key(report_hash, export_format), settings.S3_BUCKET_NAME)
+
+    async def ensure(self, report:Dict, report_hash:str=None, export_format:str="pdf") -> Optional[bytes]:
+        """
+        Renders and uploads the analysis when it isn't stored yet, a stored rendering is not downloaded
+
+        Args:
+        report: dict, report data (see render_report)
+        report_hash: str, analysis_hash(report) when already known
+        export_format: str, one of EXPORT_FORMATS
+
+        Returns:
+        bytes: the document rendered by this call, None when it was stored already (see open)
+        """
+        report_hash = report_hash or analysis_hash(report)
+        key = (report_hash, export_format)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        async with lock:
+            if await self.exists(report_hash, export_format):
+                return None
+            content = await self.render(report, export_format)
+            s3 = get_s3_client()
+            await asyncio.to_thread(upload_document_s3, s3, io.BytesIO(content), report_key(report_hash, export_format), EXPORT_FORMATS[export_format].media_type, settings.S3_BUCKET_NAME)
+            logger.info(f"stored report {report_key(report_hash, export_format)} ({len(content)} bytes)")
+            return content
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def iter_content(content, chunk_size:int=64 * 1024) -> AsyncIterator[bytes]:
+    """Chunks of rendered bytes or of a stored object's streaming body, the body is read off the event loop"""
+    if isinstance(content, (bytes, bytearray)):
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+        return
+    try:
+        while chunk := await asyncio.to_thread(content.read, chunk_size):
+            yield chunk
+    finally:
+        content.close()
+
+
+report_renderer = ReportRenderer()
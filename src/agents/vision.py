@@ -0,0 +1,110 @@
+import asyncio
+import math
+from typing import Dict, List, Tuple
+from PIL import Image as PILImage
+from langchain.schema import HumanMessage, SystemMessage
+from config import settings
+from agents.workflow import ProjectScopingAgent, chains
+from utils.logger import logger
+from utils.prompts import summarize_images
+
+#tokens reserved for the summary of each image in the response
+RESPONSE_TOKENS_PER_IMAGE = 400
+#cost of an image whose size can't be read, a 1024x1024 high detail image
+DEFAULT_IMAGE_TOKENS = 765
+
+
+def estimate_image_tokens(image_path:str) -> int:
+    """
+    Input tokens of a high detail image using the OpenAI tiling rule:
+    fit in 2048x2048, scale the shortest side down to 768, then 170 tokens per 512px tile plus 85.
+    """
+    try:
+        with PILImage.open(image_path) as image:
+            width, height = image.size
+    except Exception:
+        return DEFAULT_IMAGE_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 170 * tiles + 85
+
+
+class BatchImageSummarizer:
+    """
+    Summarizes the images of one document with as few vision requests as possible.
+
+    Image blocks produced by ExtractText ({"type": "image", "data": path, "content": None}) are packed
+    into batches that stay under `max_images` and `token_budget`, each batch is sent as a single
+    multimodal request with one system prompt, and the per image summaries in the structured response
+    are written back to the "content" of their block. Images missing from a batch response fall back
+    to a single image request.
+
+    Args:
+    max_images: int, max images per request
+    token_budget: int, max estimated image + response tokens per request
+    """
+    def __init__(self, max_images:int=None, token_budget:int=None):
+        self.max_images = max_images or settings.VISION_BATCH_MAX_IMAGES
+        self.token_budget = token_budget or settings.VISION_BATCH_TOKEN_BUDGET
+
+    def _batches(self, blocks:List[Dict]) -> List[Tuple[List[Dict], int]]:
+        """Greedy packing in document order, returns (blocks, estimated tokens) per request"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for block in blocks:
+            tokens = estimate_image_tokens(block["data"]) + RESPONSE_TOKENS_PER_IMAGE
+            if current and (len(current) >= self.max_images or current_tokens + tokens > self.token_budget):
+                batches.append((current, current_tokens))
+                current = []
+                current_tokens = 0
+            current.append(block)
+            current_tokens += tokens
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    async def _summarize_batch(self, batch:List[Dict], estimated_tokens:int):
+        if len(batch) == 1:
+            batch[0]["content"] = await ProjectScopingAgent.summarize_image(batch[0]["data"])
+            return
+
+        content = [{"type": "text", "text": f"There are {len(batch)} images, summarize each one separately."}]
+        for index, block in enumerate(batch, start=1):
+            content.append({"type": "text", "text": f"Image {index}:"})
+            content.append({"type": "image_url", "image_url": {"url": ProjectScopingAgent.image_url(block["data"])}})
+        message = [SystemMessage(content=summarize_images), HumanMessage(content=content)]
+
+        try:
+            response = await chains.ainvoke("summarize_images", message, estimated_tokens=estimated_tokens)
+            summaries = {image.image_index: image.summary for image in response.images}
+        except Exception as e:
+            logger.error(f"batched image summary failed for {len(batch)} images, falling back to single requests: {str(e)}")
+            summaries = {}
+
+        for index, block in enumerate(batch, start=1):
+            if summaries.get(index):
+                block["content"] = summaries[index]
+            else:
+                block["content"] = await ProjectScopingAgent.summarize_image(block["data"])
+
+    async def summarize(self, content:List[Dict]) -> List[Dict]:
+        """
+        Fill in the summary of every image block of a document that doesn't have one yet
+
+        Args:
+        content: List[dict], extracted blocks of a single document
+
+        Returns:
+        List[dict]: the same blocks with image "content" filled in
+        """
+        blocks = [block for block in content if block.get("type") == "image" and not block.get("content")]
+        if not blocks:
+            return content
+        batches = self._batches(blocks)
+        logger.info(f"summarizing {len(blocks)} images in {len(batches)} vision requests")
+        await asyncio.gather(*(self._summarize_batch(batch, tokens) for batch, tokens in batches))
+        return content
@@ -1,23 +1,25 @@
 import json
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer,Image, Table, TableStyle, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from datetime import datetime
 from config import settings
 import base64
+import mimetypes
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
 from typing import List
 from utils.logger import logger
 import asyncio
-from utils.prompts import Initial_phase, chat_with_context
-from utils.prompts_response import ProjectDefinition, Chat_with_context
+from utils.conversation_memory import ConversationMemory
+from agents.chains import ChainRegistry
+from agents.llm_backend import get_chat_model
+from utils.llm_governor import governor
+from utils.llm_usage import usage_config
+from utils.partial_output import IncrementalFieldParser
+from agents.document_gate import classify_document
+from agents.report import render_report
+from utils.prompts_response import ProjectDefinition
 
-llm = ChatOpenAI(temperature=1, api_key=settings.OPENAI_CHATGPT, model="gpt-4o-mini")
+llm = get_chat_model()
+chains = ChainRegistry(llm)
 # llm_vision = ChatOpenAI(temperature=1, api_key=settings.OPENAI_CHATGPT, model="gpt-4-vision-preview")
 
 class ProjectScopingAgent:
@@ -33,13 +35,31 @@ class ProjectScopingAgent:
     #     Analyse the data provided and create a comprehensive SUmmary of the project so that the downstream prompts can understand the application/problem they are trying to build/solve, techinical requirements provided, Constraints mentioned in the data, technologies expected to use, required time lines 
     # """)
         
-    async def analyze_input(self, parsed_data: dict) -> dict:
-        """Process parsed data to extract key requirements"""
+    async def analyze_input(self, parsed_data: dict, on_field=None) -> dict:
+        """
+        Process parsed data to extract key requirements
+
+        Args:
+        parsed_data: dict, {"document": extracted text}
+        on_field: optional callable(field, value), when given the ProjectDefinition is streamed and every
+                  field is handed over as soon as the model finished writing it
+
+        Returns:
+        tuple: (markdown, title)
+        """
         try:
             input_str = parsed_data["document"]
             logger.info(f"input_str: {input_str}")
             logger.info(f"type: {type(input_str)}")
-            prompt = ChatPromptTemplate.from_template(Initial_phase)
+
+            gate = await classify_document(input_str, chains)
+            if not gate.is_technical_document:
+                response = self._non_technical_definition(gate)
+                self.requirements = response.model_dump()
+                if on_field is not None:
+                    for field in ("title", "is_technical_document", "document_analysis"):
+                        on_field(field, getattr(response, field))
+                return response.to_markdown()
             # prompt = ChatPromptTemplate.from_template("""
             # Analyze the project document and provide a comprehensive technical breakdown and the Teams and roles responsible for the project completion. 
             # Follow this structure STRICTLY:
@@ -110,10 +130,13 @@ class ProjectScopingAgent:
             # """)
             
             
-            chain = prompt | llm.with_structured_output(ProjectDefinition)
-            response= await chain.ainvoke({"document": input_str})
+            if on_field is None:
+                response= await chains.ainvoke("analyze_input", {"document": input_str})
+            else:
+                response = await self._stream_project_definition(input_str, on_field)
             # response = await self._safe_json_parse(response)
-            print(f"response: {response}")
+            logger.debug(f"analyze_input response: {response}")
+            self.requirements = response.model_dump()
             return response.to_markdown()
             # print(f"type: {type(response)}")
             # self.requirements.append(response)
@@ -123,51 +146,44 @@ class ProjectScopingAgent:
             logger.error(f"Error in analyze_input: {e}")
             raise
 
+    @staticmethod
+    def _non_technical_definition(gate) -> ProjectDefinition:
+        """ProjectDefinition for a document rejected by the pre-classification gate, no full analysis was run"""
+        return ProjectDefinition(
+            title=gate.title,
+            is_technical_document=False,
+            document_analysis=gate.document_analysis,
+            **{field: None for field in ProjectDefinition.model_fields if field not in ("title", "is_technical_document", "document_analysis")},
+        )
+
+    @staticmethod
+    async def _stream_project_definition(input_str:str, on_field) -> ProjectDefinition:
+        """Stream the ProjectDefinition tool call arguments and parse them field by field"""
+        parser = IncrementalFieldParser(on_field)
+        async for chunk in chains.astream("analyze_input_stream", {"document": input_str}):
+            for tool_chunk in getattr(chunk, "tool_call_chunks", None) or []:
+                parser.feed(tool_chunk.get("args") or "")
+        if not parser.buffer.strip():
+            #the model answered without streaming a tool call, ask again without streaming
+            logger.warning("no ProjectDefinition arguments were streamed, falling back to analyze_input")
+            response = await chains.ainvoke("analyze_input", {"document": input_str})
+            for field, value in response.model_dump().items():
+                on_field(field, value)
+            return response
+        return ProjectDefinition.model_validate(parser.finish())
+
     async def identify_ambiguities(self):
         """Detect vague requirements needing clarification"""
-        prompt = ChatPromptTemplate.from_template("""
-        Identify ambiguities in these requirements and technicial challeges: {input}
-        Generate follow-up questions to resolve them.
-        Format: {{"questions": ["question1", "question2"]}}
-        """)
-        
-        chain = prompt | llm | StrOutputParser()
-        response = chain.invoke({"input": json.dumps(self.requirements)}) 
-        print("RAW Ambiguity response:", response)
-        self.ambiguities = self._safe_json_parse(response)
+        response = await chains.ainvoke("identify_ambiguities", {"input": json.dumps(self.requirements)})
+        logger.debug(f"raw ambiguity response: {response}")
+        self.ambiguities = await self._safe_json_parse(response)
         return self.ambiguities
 
     async def generate_tech_recommendations(self): 
         """Suggest technology stacks with cost analysis"""
-        prompt = ChatPromptTemplate.from_template("""
-        Based on requirements: {input}
-        Suggest:
-        1. Primary tech stack (cloud + on-prem options)
-        2. Alternatives with cost comparisons
-        
-        
-        Format: {{
-            "primary_stack": {{
-                "cloud": ["tech1", "tech2"],
-                "on_prem": ["tech3", "tech4"],
-                "Optimized technologies to complete this project with cost efficiency": ["devops", "software technologies","Data science","AI"],
-                "Developers required to complete this project": []
-                                                  
-            }},
-            "alternatives": [
-                {{
-                    "type": "cloud",
-                    "tech": ["alt_tech1"],
-                    "cost_savings": ""
-                }}
-            ]
-        }}
-        """)
-        
-        chain = prompt | llm | StrOutputParser()
-        response = chain.invoke({"input": json.dumps(self.requirements)})
-        print("generate_tech_recommendations:", response)
-        self.tech_stack = self._safe_json_parse(response)
+        response = await chains.ainvoke("tech_recommendations", {"input": json.dumps(self.requirements)})
+        logger.debug(f"generate_tech_recommendations response: {response}")
+        self.tech_stack = await self._safe_json_parse(response)
         return self.tech_stack
     
     async def _safe_json_parse(self, json_str: str) -> dict:
@@ -179,199 +195,28 @@ class ProjectScopingAgent:
             cleaned = json_str.replace('```json', '').replace('```', '').strip()
             return json.loads(cleaned)
         except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON: {json_str}")
-            print(f"Error: {e}")
+            logger.error(f"Failed to parse JSON: {e}")
+            logger.debug(f"unparsable LLM response: {json_str}")
             return {"error": "Invalid JSON response from LLM"}
         
+    def report_data(self) -> dict:
+        """Everything the PDF report is rendered from, see agents.report.render_report"""
+        return {"requirements": self.requirements, "tech_stack": self.tech_stack, "ambiguities": self.ambiguities}
+
     def generate_pdf_report(self, filename: str):
         """Create professional PDF document with formatted content"""
-        # Custom Styles
-        styles = getSampleStyleSheet()
-        
-        # Safe style modifications
-        def safe_add_style(name, base_style=None, **kwargs):
-            if name in styles:
-                for key, value in kwargs.items():
-                    setattr(styles[name], key, value)
-            else:
-                styles.add(ParagraphStyle(name, parent=base_style, **kwargs))
-        
-        safe_add_style('TitleCentered', base_style=styles['Title'],
-                    alignment=1, textColor=colors.darkblue, fontName='Helvetica-Bold')
-        safe_add_style('SectionHeader', base_style=styles['Heading2'],
-                    fontSize=14, spaceAfter=12, textColor=colors.darkblue)
-        styles['BodyText'].fontSize = 10
-        styles['BodyText'].leading = 14
-
-        # Create document template
-        doc = SimpleDocTemplate(
-            filename,
-            pagesize=letter,
-            leftMargin=0.5*inch,
-            rightMargin=0.5*inch,
-            topMargin=0.3*inch,
-            bottomMargin=0.5*inch
-        )
-        
-        flow = []
-        
-        # Header Section
-        try:
-            logo = Image("bird_2.jpg", width=2*inch, height=0.75*inch)
-            header_table = Table([
-                [logo, 
-                Paragraph("Technical Proposal<br/>Project Scoping Document", styles['TitleCentered']),
-                Paragraph("Confidential", styles['BodyText'])]
-            ], colWidths=[2*inch, 4*inch, 1.5*inch])
-            header_table.setStyle(TableStyle([
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('LINEBELOW', (0,0), (-1,-1), 1, colors.lightgrey)
-            ]))
-            flow.append(header_table)
-        except:
-            flow.append(Paragraph("Company Name", styles['TitleCentered']))
-        
-        flow.append(Spacer(1, 0.25*inch))
-        
-        # Project Overview
-        flow.append(Paragraph("Project Overview", styles['SectionHeader']))
-        overview_data = [
-            ["Client Name:", "Acme Corporation"],
-            ["Date Prepared:", datetime.today().strftime('%Y-%m-%d')]
-        ]
-        overview_table = Table(overview_data, colWidths=[1.5*inch, 4*inch])
-        overview_table.setStyle(TableStyle([
-            ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
-            ('BACKGROUND', (0,0), (-1,0), colors.lightblue)
-        ]))
-        flow.append(overview_table)
-        
-        # Project Definition Section
-        flow.append(PageBreak())
-        flow.append(Paragraph("Project Definition", styles['SectionHeader']))
-        
-        def format_dict(data, indent=0):
-            """Recursively format dictionary data for PDF"""
-            formatted = []
-            for key, value in data.items():
-                key_str = f"<b>{key.replace('_', ' ').title()}:</b>"
-                if isinstance(value, dict):
-                    formatted.append(Paragraph(key_str, styles['BodyText']))
-                    formatted += format_dict(value, indent+1)
-                elif isinstance(value, list):
-                    formatted.append(Paragraph(key_str, styles['BodyText']))
-                    for item in value:
-                        formatted.append(Paragraph(f"• {item}", styles['BodyText']))
-                else:
-                    text = f"{key_str} {value}"
-                    formatted.append(Paragraph(text, styles['BodyText']))
-            return formatted
-        
-        # Add formatted requirements
-        if isinstance(self.requirements, dict):
-            flow += format_dict(self.requirements.get('project_definition', {}))
-            flow += format_dict(self.requirements.get('technology_stack', {}))
-            flow += format_dict(self.requirements.get('risk_analysis', {}))
-        else:
-            flow.append(Paragraph("No requirements data available", styles['BodyText']))
-        
-        # System Design Section
-        def wrapped_text(content, width, style):
-            return Paragraph(f"<para fontSize={style.fontSize} leading={style.leading}>\
-                            {content}</para>", style)
-
-        # System Design Section
-        flow.append(PageBreak())
-        flow.append(Paragraph("System Design", styles['SectionHeader']))
-
-        # Technology Stack Section
-        flow.append(Spacer(1, 0.25*inch))
-        flow.append(Paragraph("Technology Stack", styles['SectionHeader']))
-        
-        if isinstance(self.tech_stack, dict):
-            # Prepare table data with dynamic content
-            tech_data = [
-                ["<b>Type</b>", "<b>Technologies</b>", "<b>Details</b>"]
-            ]
-            
-            # Primary Cloud Stack
-            tech_data.append([
-                "Primary (Cloud)",
-                wrapped_text("<br/>• " + "<br/>• ".join(
-                    self.tech_stack.get('primary_stack', {}).get('cloud', [])
-                ), 2*inch, styles['BodyText']),
-                wrapped_text(
-                    self.tech_stack.get('primary_stack', {}).get('Optimized technologies to complete this project with cost efficiency', ""), 
-                    2.5*inch, styles['BodyText']
-                ),
-                wrapped_text(
-                    self.tech_stack.get('primary_stack', {}).get('Developers required to complete this project', ""), 
-                    2.5*inch, styles['BodyText']
-                )
-            ])
-            
-            # Primary On-Prem Stack
-            tech_data.append([
-                "Primary (On-Prem)",
-                wrapped_text("<br/>• " + "<br/>• ".join(
-                    self.tech_stack.get('primary_stack', {}).get('on_prem', [])
-                ), 2*inch, styles['BodyText']),
-                ""
-            ])
-            
-            # Alternatives
-            alternatives = [
-                f"{alt['tech'][0]} ({alt['cost_savings']})" 
-                for alt in self.tech_stack.get('alternatives', [])
-            ]
-            tech_data.append([
-                "Alternatives",
-                wrapped_text("<br/>• " + "<br/>• ".join(alternatives), 2*inch, styles['BodyText']),
-                ""
-            ])
-            
-            # Create table with dynamic sizing
-            tech_table = Table(tech_data, colWidths=[1.5*inch, 2*inch, 2.5*inch])
-            tech_table.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.lightblue),
-                ('GRID', (0,0), (-1,-1), 0.5, colors.lightgrey),
-                ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                ('WORDWRAP', (0,0), (-1,-1)),
-                ('LEADING', (0,0), (-1,-1), 14),
-                ('FONTSIZE', (0,0), (-1,-1), 10)
-            ]))
-            
-            # Auto-size rows
-                # **Dynamically Adjust Table Size**
-            max_width = doc.width  # Get max width available in document
-            max_height = doc.height  # Get max height available
+        with open(filename, "wb") as report_file:
+            report_file.write(render_report(self.report_data()))
 
-            # **Calculate Required Width & Height**
-            table_width, table_height = tech_table.wrapOn(None, max_width, max_height)
-
-            # **Ensure the Table Fits the Page**
-            table_width = min(table_width, max_width)
-            table_height = min(table_height, max_height)
-                        
-            flow.append(tech_table)
-            flow.append(Spacer(1, 0.25*inch))
-        
-        # Ambiguities Section
-        flow.append(PageBreak())
-        flow.append(Paragraph("Open Questions", styles['SectionHeader']))
-        if isinstance(self.ambiguities, dict) and 'questions' in self.ambiguities:
-            for i, question in enumerate(self.ambiguities['questions'], 1):
-                flow.append(Paragraph(f"{i}. {question}", styles['BodyText']))
-        
-        # Footer with Page Numbers
-        def add_page_numbers(canvas, doc):
-            canvas.saveState()
-            canvas.setFont('Helvetica', 8)
-            canvas.drawCentredString(4.25*inch, 0.5*inch, f"Page {doc.page}")
-            canvas.restoreState()
-        
-        doc.build(flow, onFirstPage=add_page_numbers, onLaterPages=add_page_numbers)
+    @staticmethod
+    def image_url(image_path: str) -> str:
+        """URL of the image for a vision request, local files are inlined as base64 data URLs"""
+        if image_path.startswith(("http://", "https://")):
+            return image_path
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        with open(image_path, "rb") as image_file:
+            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        return f"data:{mime_type};base64,{base64_image}"
 
     @staticmethod
     async def summarize_image(image_path: str, max_tokens=1000):
@@ -383,14 +228,7 @@ class ProjectScopingAgent:
             max_tokens (int): Maximum length of the response.
         """
         # Encode image if it's a local file
-        if image_path.startswith(("http://", "https://")):
-            # For URLs
-            image_url = image_path
-        else:
-            # For local files
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-            image_url = f"data:image/jpeg;base64,{base64_image}"
+        image_url = ProjectScopingAgent.image_url(image_path)
 
         message = [
         SystemMessage(content="""
@@ -406,18 +244,45 @@ class ProjectScopingAgent:
     ]
 
         # Send request to GPT-4 Vision
-        response = llm.invoke(message)
+        # 765 input tokens is a 1024x1024 high detail image
+        response = await governor.run(lambda: llm.ainvoke(message, config=usage_config("summarize_image")), estimated_tokens=765 + max_tokens)
         logger.info(f"response from summarize_image: {response}")
             
         return response.content
     
     @staticmethod
-    async def chat_with_doc(context:List[dict]):
-        prompt = ChatPromptTemplate.from_template(chat_with_context)
-        user_latest_chat = context[-1]['content']
-        chain = prompt | llm.with_structured_output(Chat_with_context)
-        logger.info(f"chat_context: {context}")
+    async def summarize_conversation(summary:str, messages:List[dict], max_tokens:int) -> str:
+        """Fold older chat messages into the rolling conversation summary"""
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        return await chains.ainvoke("summarize_conversation", {"summary": summary or "None", "messages": transcript, "max_tokens": max_tokens})
+
+    @staticmethod
+    async def chat_with_doc(context:List[dict], memory:ConversationMemory=None):
+        memory = memory or ConversationMemory()
+        chat_inputs = await memory.prepare(context, summarizer=ProjectScopingAgent.summarize_conversation)
+        logger.info(f"chat_context: {chat_inputs['chat_context']}")
         logger.info(f"type of context: {type(context)}")
-        logger.info(f"type of context[0]: {chain}")
-        response = await chain.ainvoke({"chat_context": context[:-1], "user_chat": user_latest_chat})
-        return {"message": response.to_markdown()}
\ No newline at end of file
+        response = await chains.ainvoke("chat_with_doc", chat_inputs)
+        return {"message": response.to_markdown()}
+
+    @staticmethod
+    async def stream_chat_with_doc(context:List[dict], memory:ConversationMemory=None):
+        """
+        Stream the answer to the latest user message as the model produces it.
+
+        Uses the same prompt as chat_with_doc but skips the structured output binding,
+        since Chat_with_context only wraps a single text field and structured output
+        can only be parsed once the whole response has arrived.
+
+        Args:
+        context: List[dict], chat messages with the latest user message last
+        memory: ConversationMemory, stored summary state of the chat
+
+        Yields:
+        str: text chunks of the answer in generation order
+        """
+        memory = memory or ConversationMemory()
+        chat_inputs = await memory.prepare(context, summarizer=ProjectScopingAgent.summarize_conversation)
+        async for token in chains.astream("chat_with_doc_stream", chat_inputs):
+            if token:
+                yield token
\ No newline at end of file
@@ -12,6 +12,19 @@ class Settings:
     POSTGRES_PORT = os.getenv("POSTGRES_PORT")
     POSTGRES_HOSTNAME = os.getenv("POSTGRES_HOSTNAME")
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    ASYNC_DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("ASYNC_DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+    REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 2))
+    READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+    MIGRATION_DATABASE_URL = os.getenv("MIGRATION_DATABASE_URL", DATABASE_URL)
+    MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", 10000))
     ALGORITHM=os.getenv("ALGORITHM")
     SECRET_KEY_J=os.getenv("SECRET_KEY_J")
     TOKEN_EXPIRED_TIME_IN_DAYS=os.getenv("TOKEN_EXPIRED_TIME_IN_DAYS")
@@ -32,6 +45,57 @@ class Settings:
     REDIS_PORT = os.getenv("REDIS_PORT")
     # REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
     REDIS_SSL = os.getenv("REDIS_SSL")
+    CHAT_MEMORY_TOKEN_BUDGET = int(os.getenv("CHAT_MEMORY_TOKEN_BUDGET", 4000))
+    CHAT_MEMORY_SUMMARY_TOKENS = int(os.getenv("CHAT_MEMORY_SUMMARY_TOKENS", 800))
+    VISION_BATCH_MAX_IMAGES = int(os.getenv("VISION_BATCH_MAX_IMAGES", 6))
+    VISION_BATCH_TOKEN_BUDGET = int(os.getenv("VISION_BATCH_TOKEN_BUDGET", 8000))
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+    LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 800))
+    LLM_STUB_LATENCY_JITTER_MS = float(os.getenv("LLM_STUB_LATENCY_JITTER_MS", 200))
+    LLM_STUB_LATENCY_DISTRIBUTION = os.getenv("LLM_STUB_LATENCY_DISTRIBUTION", "normal")
+    LLM_STUB_COMPLETION_TOKENS = int(os.getenv("LLM_STUB_COMPLETION_TOKENS", 200))
+    LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", 0))
+    LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", 0))
+    LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+    LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 200000))
+    LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", 1000))
+    LLM_INITIAL_CONCURRENCY = float(os.getenv("LLM_INITIAL_CONCURRENCY", 4))
+    LLM_MIN_CONCURRENCY = float(os.getenv("LLM_MIN_CONCURRENCY", 1))
+    LLM_MAX_CONCURRENCY = float(os.getenv("LLM_MAX_CONCURRENCY", 32))
+    LLM_TARGET_LATENCY_MS = float(os.getenv("LLM_TARGET_LATENCY_MS", 30000))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+    LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+    LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20))
+    LLM_USAGE_BATCH_SIZE = int(os.getenv("LLM_USAGE_BATCH_SIZE", 100))
+    LLM_USAGE_FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", 5))
+    LLM_USAGE_MAX_RETRIES = int(os.getenv("LLM_USAGE_MAX_RETRIES", 5))
+    DOCUMENT_GATE_MODE = os.getenv("DOCUMENT_GATE_MODE", "hybrid")
+    DOCUMENT_GATE_MODEL = os.getenv("DOCUMENT_GATE_MODEL", "gpt-4o-mini")
+    DOCUMENT_GATE_SAMPLE_CHARS = int(os.getenv("DOCUMENT_GATE_SAMPLE_CHARS", 6000))
+    REPORT_RENDER_WORKERS = int(os.getenv("REPORT_RENDER_WORKERS", 2))
+    REPORT_LOGO_PATH = os.getenv("REPORT_LOGO_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bird_2.jpg"))
+    CHAT_LIST_PAGE_SIZE = int(os.getenv("CHAT_LIST_PAGE_SIZE", 50))
+    CHAT_LIST_MAX_PAGE_SIZE = int(os.getenv("CHAT_LIST_MAX_PAGE_SIZE", 200))
+    CHAT_PERSISTENCE_MODE = os.getenv("CHAT_PERSISTENCE_MODE", "sync")
+    CHAT_WRITE_BEHIND_FLUSH_MS = float(os.getenv("CHAT_WRITE_BEHIND_FLUSH_MS", 200))
+    CHAT_WRITE_BEHIND_MAX_BATCH = int(os.getenv("CHAT_WRITE_BEHIND_MAX_BATCH", 500))
+    CHAT_WRITE_BEHIND_MAX_RETRIES = int(os.getenv("CHAT_WRITE_BEHIND_MAX_RETRIES", 5))
+    CHAT_MESSAGE_COMPRESSION = os.getenv("CHAT_MESSAGE_COMPRESSION", "none")
+    CHAT_MESSAGE_COMPRESS_MIN_BYTES = int(os.getenv("CHAT_MESSAGE_COMPRESS_MIN_BYTES", 4096))
+    CHAT_MESSAGE_ZSTD_LEVEL = int(os.getenv("CHAT_MESSAGE_ZSTD_LEVEL", 3))
+    CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", 60))
+    CHAT_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("CHAT_CACHE_LOCAL_TTL_SECONDS", 2))
+    CHAT_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_LOCAL_MAX_ENTRIES", 2048))
+    USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 900))
+    USER_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("USER_CACHE_LOCAL_TTL_SECONDS", 60))
+    USER_CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("USER_CACHE_LOCAL_MAX_ENTRIES", 10000))
+    SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+    SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", 100))
+    SEARCH_DOCUMENT_CHUNK_CHARS = int(os.getenv("SEARCH_DOCUMENT_CHUNK_CHARS", 4000))
+    CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", 30))
+    CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv("CHAT_ARCHIVE_BATCH_SIZE", 500))
+    ADMIN_EMAILS = [email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()]
 
 
 
@@ -1,99 +1,179 @@
+import asyncio
+from typing import List, NamedTuple, Optional
 import models
-from models import get_db
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from p_model_type import Registration_login
-from sqlalchemy import and_
+from sqlalchemy import and_, select, insert
 from utils.token_generation import hash_passwords
 from fastapi import HTTPException, status
+from utils.search import index_analysis, index_document_text
+from utils.user_cache import user_cache, profile_key, user_key, profile_of
+from utils.db_router import read_router
 
 class UserCreationError(Exception):
     pass
 
-async def create_user(user_data:dict,provider:str, db:Session):
+class LoginRecord(NamedTuple):
+    email_address: str
+    user_id: str
+    first_name: str
+    last_name: str
+    verified_email: bool
+    provider: str
+    hashed_password: str
+    id: int
+
+async def _find_user(email_address:str, provider:str, db:AsyncSession) -> Optional[dict]:
+    query = select(models.User).where(and_(models.User.email_address == email_address, models.User.provider == provider))
+    user = (await db.execute(query)).scalars().first()
+    return profile_of(user) if user else None
+
+async def create_user(user_data:dict,provider:str, db:AsyncSession):
     # {'id': '106124317363210854486', 'email': '@gmail.com', 'verified_email': True, 'name': 'full name', 'given_name': 'first name', 'family_name': 'last name', 'picture': 'https://lh3.googleusercontent.com/a/ACg8ocKaB3SgzhN1nS059s7D1re6z0eTnG6wtUDl5A695G-8Akhvq5GD'}
     # {'email': '123@123.com', 'given_name': '123', 'family_name': '456', 'name': '123 456', 'password': 'string', 'id': None, 'verified_email': False, 'picture': None, 'provider': 'Local'}
     if not user_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Required details not provided")
     try:
-        query = db.query(models.User).filter(and_(models.User.email_address == user_data["email"], models.User.provider == provider))
-        user_details = query.first()
+        #returning users are answered from the user cache, only new users reach the database
+        profile = await user_cache.get_or_load(
+            profile_key(user_data["email"], provider),
+            lambda: _find_user(user_data["email"], provider, db),
+            aliases=lambda profile: [user_key(profile["user_id"])],
+        )
+        user_details = models.User(**profile) if profile else None
         if user_details and user_details.provider == "Local":
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Record already Exists, try logging into the account")
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"unable to connect to DB {e}")
     
     if not user_details:
-        user_details = models.User(
-            oauth_id = user_data["id"], 
-            email_address = user_data["email"],
-            first_name = user_data["given_name"],
-            last_name = user_data["family_name"],
-            verified_email = user_data["verified_email"],
-            full_name = user_data["name"],
-            picture = user_data["picture"],
-            provider = provider
-        )
-        try: 
-            db.add(user_details)
-            db.commit()
-            db.refresh(user_details)
-            
+        #bcrypt is slow on purpose, keep it off the event loop
+        h_pass = await asyncio.to_thread(hash_passwords, password=user_data["password"]) if provider == "Local" else None
+        try:
+            #RETURNING hands back the generated user_id and created_at, the user and its password are one transaction
+            user_details = (await db.scalars(insert(models.User).values(
+                oauth_id = user_data["id"], 
+                email_address = user_data["email"],
+                first_name = user_data["given_name"],
+                last_name = user_data["family_name"],
+                verified_email = user_data["verified_email"],
+                full_name = user_data["name"],
+                picture = user_data["picture"],
+                provider = provider
+            ).returning(models.User))).one()
+            if h_pass is not None:
+                await db.execute(insert(models.LoginDetails).values(user_id=user_details.user_id, hashed_password=h_pass))
+            await db.commit()
         except SQLAlchemyError as e:
-            db.rollback() 
+            await db.rollback() 
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,detail=f"unable to create details: {str(e.args), str(e.code)}")
-
-        if user_details.provider == "Local":
-            h_pass = hash_passwords(password=user_data["password"]) 
-            password_details = models.LoginDetails(
-                user_id = user_details.user_id,
-                hashed_password = h_pass
-            )
-            try:
-                db.add(password_details)
-                db.commit()
-            except SQLAlchemyError as e:
-                db.rollback() 
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to create details: {str(e)}")
+        await user_cache.invalidate(user_id=user_details.user_id, email_address=user_details.email_address, provider=provider)
+        await user_cache.set([profile_key(user_details.email_address, provider), user_key(user_details.user_id)], profile_of(user_details))
         return user_details
     return user_details
 
-def get_user_details(email_address:str, db:Session): 
+async def get_user_details(email_address:str, db:AsyncSession) -> LoginRecord:
     try:
-        query = db.query(models.User.email_address,
-                        models.User.user_id,
-                        models.User.first_name,
-                        models.User.last_name,
-                        models.User.verified_email,
-                        models.User.provider,
-                        models.LoginDetails.hashed_password,
-                        models.LoginDetails.id
-                        ).join(
-                            models.LoginDetails,
-                            models.User.user_id == models.LoginDetails.user_id) 
-        record = query.filter(and_(
-            models.User.provider=="Local", models.User.verified_email == "False", models.User.email_address == email_address
-        )).first()
+        profile = await user_cache.get_or_load(
+            profile_key(email_address, "Local"),
+            lambda: _find_user(email_address, "Local", db),
+            aliases=lambda profile: [user_key(profile["user_id"])],
+        )
+        login = None
+        if profile and not profile["verified_email"]:
+            #the password hash is never cached, every login reads the current one from login_details
+            query = select(models.LoginDetails.hashed_password, models.LoginDetails.id).where(models.LoginDetails.user_id == profile["user_id"])
+            login = (await db.execute(query)).first()
     except SQLAlchemyError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something wrong with our service, please try again later")
-    if not record:
+    if not login:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Details not found, please register your account")
-    return record
+    return LoginRecord(
+        email_address=profile["email_address"], user_id=profile["user_id"], first_name=profile["first_name"], last_name=profile["last_name"],
+        verified_email=profile["verified_email"], provider=profile["provider"], hashed_password=login.hashed_password, id=login.id,
+    )
 
 
-async def user_documents(doc_data:dict, db:Session) -> dict:
+async def user_documents(doc_data:dict, db:AsyncSession) -> dict:
     if not doc_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No document data found with valid user_id found")
-    document_details = models.UserDocuments(
-        user_id = doc_data["user_id"],
-        document_path = doc_data["document_path"]
-    )
+    return (await register_documents([doc_data], db))[0]
+
+
+async def register_documents(docs:List[dict], db:AsyncSession) -> List[dict]:
+    """
+    registers the documents of an upload in one INSERT ... RETURNING and one commit
+
+    Args:
+    docs: [{user_id, document_path}]
+    db: AsyncSession
+
+    Returns:
+    List[dict]: [{document_id, document_path, user_id}] in the order of docs
+    """
+    if not docs:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No document data found with valid user_id found")
+    document = models.UserDocuments
     try:
-        db.add(document_details)
-        db.commit()
-        db.refresh(document_details)
-        return {"document_id":document_details.document_id,"document_path":document_details.document_path,"user_id":document_details.user_id}
+        rows = (await db.execute(
+            insert(document).returning(document.document_id, document.document_path, document.user_id, sort_by_parameter_order=True),
+            [{"user_id": doc["user_id"], "document_path": doc["document_path"]} for doc in docs],
+        )).all()
+        await db.commit()
     except SQLAlchemyError as e:
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to create document data {str(e)}")
+    for user_id in {doc["user_id"] for doc in docs}:
+        await read_router.record_write(user_id)
+    return [dict(row._mapping) for row in rows]
+
+
+async def save_document_text(user_id:str, document_id:str, title:str, text:str, db:AsyncSession):
+    """adds the extracted text of a document to the search index"""
+    await save_document_texts([{"user_id": user_id, "document_id": document_id, "title": title, "text": text}], db)
+
+
+async def save_document_texts(documents:List[dict], db:AsyncSession):
+    """adds the extracted texts of the documents of an upload to the search index in one transaction, documents: [{user_id, document_id, title, text}]"""
+    try:
+        for document in documents:
+            await index_document_text(document["user_id"], document["document_id"], document["title"], document["text"], db)
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to index document text {str(e)}")
     
 
+
+
+async def save_document_analysis(analysis_data:dict, db:AsyncSession) -> dict:
+    document_analysis = models.DocumentAnalysis(
+        document_id = analysis_data["document_id"],
+        user_id = analysis_data["user_id"],
+        title = analysis_data.get("title"),
+        analysis = analysis_data["analysis"],
+        analysis_hash = analysis_data["analysis_hash"]
+    )
+    try:
+        db.add(document_analysis)
+        await db.flush()
+        await index_analysis(document_analysis.user_id, document_analysis.document_id, document_analysis.analysis_id, document_analysis.title, document_analysis.analysis, db)
+        await db.commit()
+        await read_router.record_write(document_analysis.user_id)
+        return {"analysis_id": document_analysis.analysis_id, "analysis_hash": document_analysis.analysis_hash}
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"unable to save document analysis {str(e)}")
+
+
+async def get_document_analysis(analysis_id:str, user_id:str, db:AsyncSession):
+    try:
+        record = (await db.execute(
+            select(models.DocumentAnalysis).where(and_(models.DocumentAnalysis.analysis_id == analysis_id, models.DocumentAnalysis.user_id == user_id))
+        )).scalars().first()
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something wrong with our service, please try again later")
+    if not record:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analysis not found")
+    return record
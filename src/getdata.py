@@ -9,7 +9,7 @@ from typing import List, Dict
 import fitz 
 from pptx import Presentation
 import camelot
-from agents.workflow import ProjectScopingAgent
+from agents.vision import BatchImageSummarizer
 from contextlib import asynccontextmanager
 from io import BytesIO
 import pdfplumber
@@ -75,7 +75,7 @@ class ExtractText:
                                     image_path = os.path.join("uploads_images", f"{self.document_id}_{self.user_id}_image_{image_count}.png")
                                     with open(image_path, "wb") as f:
                                         f.write(image_bytes)
-                                    content.append({"type": "image", "data": image_path, "content": await ProjectScopingAgent.summarize_image(image_path)})
+                                    content.append({"type": "image", "data": image_path, "content": None})
 
                         # Check for floating images (anchored)
                         anchor = elem.find('.//' + qn('wp:anchor'))
@@ -90,7 +90,7 @@ class ExtractText:
                                     image_path = os.path.join("uploads_images", f"{self.document_id}_{self.user_id}_image_{image_count}.png")
                                     with open(image_path, "wb") as f:
                                         f.write(image_bytes)
-                                    content.append({"type": "image", "data": image_path, "content": await ProjectScopingAgent.summarize_image(image_path)})
+                                    content.append({"type": "image", "data": image_path, "content": None})
 
             # Process tables
             elif isinstance(block, docx.table.Table):
@@ -100,6 +100,8 @@ class ExtractText:
                     table_data.append(row_data)
                 content.append({"type": "table", "data": table_data})
 
+        #all images of the document are summarized together in batched vision requests
+        await BatchImageSummarizer().summarize(content)
         return content
 
 
@@ -159,7 +161,7 @@ class ExtractText:
                     image_path = os.path.join("uploads_images", f"{self.document_id}_{self.user_id}_pdf_image_{page_num+1}_{img_index+1}.{image_ext}")
                     with open(image_path, "wb") as f:
                         f.write(image_bytes)
-                    content.append({"type": "image", "data": image_path, "content": await ProjectScopingAgent.summarize_image(image_path)})
+                    content.append({"type": "image", "data": image_path, "content": None})
         logger.info(f"content from extracted pdf inside process_pdf_with_structure: {content[:10]}")
 
         # Process tables with Camelot using a temporary file
@@ -179,6 +181,7 @@ class ExtractText:
             os.remove(temp_file.name)  # Clean up the temporary file
             logger.info("Extraction process is complete")
             logger.info(f"content from extracted pdf: {content[:10]}")
+        await BatchImageSummarizer().summarize(content)
         return content
     
     async def process_excel(self) -> List[Dict]:
@@ -220,7 +223,7 @@ class ExtractText:
                     image_path = os.path.join("uploads_images", f"{self.document_id}_{self.user_id}_pptx_image_{slide_num+1}_{image_count+1}.{image_ext}")
                     with open(image_path, "wb") as f:
                         f.write(image_bytes)
-                    content.append({"type": "image", "data": image_path, "content": await ProjectScopingAgent.summarize_image(image_path)})
+                    content.append({"type": "image", "data": image_path, "content": None})
                     image_count += 1
 
                 # Extract tables
@@ -232,6 +235,7 @@ class ExtractText:
                         table_data.append(row_data)
                     content.append({"type": "table", "data": table_data})
 
+        await BatchImageSummarizer().summarize(content)
         return content
 
     
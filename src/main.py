@@ -1,8 +1,6 @@
 from fastapi import FastAPI, Depends, Request
 import uvicorn
 from dotenv import load_dotenv
-import models
-from models import engine
 from fastapi.middleware.cors import CORSMiddleware
 from routers import authentication, services, third_party_integrations
 from utils.logger import setup_logger
@@ -14,8 +12,6 @@ logger = setup_logger()
 
 load_dotenv()
 
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(lifespan=lifespan)
 # app = FastAPI()
 
@@ -0,0 +1,90 @@
+"""users, login, documents and the chat tables as the app first created them"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id VARCHAR NOT NULL,
+        oauth_id VARCHAR,
+        email_address VARCHAR NOT NULL,
+        full_name VARCHAR NOT NULL,
+        first_name VARCHAR NOT NULL,
+        last_name VARCHAR NOT NULL,
+        verified_email BOOLEAN NOT NULL,
+        picture VARCHAR,
+        provider VARCHAR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (user_id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email_address ON users (email_address)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_oauth_id ON users (oauth_id)",
+    "CREATE INDEX IF NOT EXISTS ix_users_user_id ON users (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS login_details (
+        id SERIAL NOT NULL,
+        user_id VARCHAR NOT NULL,
+        hashed_password VARCHAR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_login_details_id ON login_details (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_login_details_user_id ON login_details (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS user_documents (
+        document_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        document_path VARCHAR NOT NULL,
+        active_tag BOOLEAN NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (document_id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_user_documents_document_id ON user_documents (document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_user_documents_user_id ON user_documents (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_history (
+        chat_history_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        document_id VARCHAR NOT NULL,
+        active_tag BOOLEAN NOT NULL,
+        title VARCHAR,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        modified_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        message VARCHAR NOT NULL,
+        PRIMARY KEY (chat_history_id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id),
+        FOREIGN KEY(document_id) REFERENCES user_documents (document_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_chat_history_id ON chat_history (chat_history_id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_document_id ON chat_history (document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_user_id ON chat_history (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS selected_chat (
+        selected_chat_id VARCHAR NOT NULL,
+        chat_history_id VARCHAR NOT NULL,
+        document_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        title VARCHAR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        modified_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        message VARCHAR NOT NULL,
+        PRIMARY KEY (selected_chat_id),
+        FOREIGN KEY(chat_history_id) REFERENCES chat_history (chat_history_id),
+        FOREIGN KEY(document_id) REFERENCES user_documents (document_id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_selected_chat_chat_history_id ON selected_chat (chat_history_id)",
+    "CREATE INDEX IF NOT EXISTS ix_selected_chat_document_id ON selected_chat (document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_selected_chat_selected_chat_id ON selected_chat (selected_chat_id)",
+    "CREATE INDEX IF NOT EXISTS ix_selected_chat_user_id ON selected_chat (user_id)",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
@@ -0,0 +1,12 @@
+"""rolling conversation summary of a chat, see utils.conversation_memory"""
+from migrations import execute_all
+
+STATEMENTS = [
+    "ALTER TABLE selected_chat ADD COLUMN IF NOT EXISTS summary VARCHAR",
+    #constant default, no table rewrite since Postgres 11
+    "ALTER TABLE selected_chat ADD COLUMN IF NOT EXISTS summarized_count INTEGER DEFAULT 0 NOT NULL",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
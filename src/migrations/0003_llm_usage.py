@@ -0,0 +1,30 @@
+"""per call LLM token, latency and cost records, see utils.llm_usage"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        usage_id BIGSERIAL NOT NULL,
+        user_id VARCHAR,
+        document_id VARCHAR,
+        task_id VARCHAR,
+        stage VARCHAR NOT NULL,
+        model VARCHAR,
+        status VARCHAR NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        cached_tokens INTEGER NOT NULL,
+        cache_status VARCHAR NOT NULL,
+        latency_ms INTEGER NOT NULL,
+        cost_usd FLOAT NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (usage_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_llm_usage_document ON llm_usage (document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_llm_usage_user_created ON llm_usage (user_id, created_at)",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
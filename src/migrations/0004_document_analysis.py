@@ -0,0 +1,27 @@
+"""stored ProjectDefinition results, served by the report and export endpoints"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS document_analysis (
+        analysis_id VARCHAR NOT NULL,
+        document_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        title VARCHAR,
+        analysis JSON NOT NULL,
+        analysis_hash VARCHAR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (analysis_id),
+        FOREIGN KEY(document_id) REFERENCES user_documents (document_id),
+        FOREIGN KEY(user_id) REFERENCES users (user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_analysis_analysis_hash ON document_analysis (analysis_hash)",
+    "CREATE INDEX IF NOT EXISTS ix_document_analysis_analysis_id ON document_analysis (analysis_id)",
+    "CREATE INDEX IF NOT EXISTS ix_document_analysis_document_id ON document_analysis (document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_document_analysis_user_id ON document_analysis (user_id)",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
@@ -0,0 +1,27 @@
+"""
+append-only chat_messages, the transcript columns of chat_history and selected_chat become nullable
+
+Existing transcripts are copied over by python -m scripts.backfill_chat_messages.
+"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        chat_history_id VARCHAR NOT NULL,
+        seq INTEGER NOT NULL,
+        role VARCHAR NOT NULL,
+        content VARCHAR NOT NULL,
+        timestamp VARCHAR,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (chat_history_id, seq),
+        FOREIGN KEY(chat_history_id) REFERENCES chat_history (chat_history_id)
+    )
+    """,
+    "ALTER TABLE chat_history ALTER COLUMN message DROP NOT NULL",
+    "ALTER TABLE selected_chat ALTER COLUMN message DROP NOT NULL",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
@@ -0,0 +1,12 @@
+"""covering partial index for the keyset-paginated chat list, built without blocking chat writes"""
+from migrations import create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(connection):
+    create_index_concurrently(
+        connection,
+        "ix_chat_history_user_modified_active",
+        "ON chat_history (user_id, modified_at DESC, chat_history_id DESC) INCLUDE (document_id, title) WHERE active_tag",
+    )
@@ -0,0 +1,31 @@
+"""
+legacy transcripts as JSONB, compressed message storage in chat_messages
+
+The type change rewrites chat_history and selected_chat under an ACCESS EXCLUSIVE lock. Rows that
+don't hold valid JSON become NULL instead of failing the migration, their messages are in
+chat_messages after the backfill. Compressing existing messages and giving the space back are done by
+python -m scripts.migrate_chat_jsonb.
+"""
+from sqlalchemy import text
+
+TRY_JSONB = """
+CREATE OR REPLACE FUNCTION pg_temp.try_jsonb(value text) RETURNS jsonb AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+
+def upgrade(connection):
+    connection.execute(text(TRY_JSONB))
+    for table in ("chat_history", "selected_chat"):
+        data_type = connection.execute(
+            text("SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = 'message'"), {"table": table}
+        ).scalar()
+        if data_type != "jsonb":
+            connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN message TYPE JSONB USING pg_temp.try_jsonb(message)"))
+    connection.execute(text("ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS content_zstd BYTEA"))
+    connection.execute(text("ALTER TABLE chat_messages ALTER COLUMN content DROP NOT NULL"))
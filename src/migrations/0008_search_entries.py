@@ -0,0 +1,27 @@
+"""full-text search entries with a generated, weighted tsvector, see utils.search"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS search_entries (
+        search_id BIGSERIAL NOT NULL,
+        user_id VARCHAR NOT NULL,
+        source VARCHAR NOT NULL,
+        source_id VARCHAR NOT NULL,
+        part INTEGER NOT NULL,
+        document_id VARCHAR,
+        title VARCHAR,
+        body TEXT,
+        tsv TSVECTOR GENERATED ALWAYS AS (setweight(to_tsvector('english', coalesce(title, '')), 'A') || setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (search_id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_search_entries_source ON search_entries (source, source_id, part)",
+    "CREATE INDEX IF NOT EXISTS ix_search_entries_tsv ON search_entries USING gin (tsv)",
+    "CREATE INDEX IF NOT EXISTS ix_search_entries_user ON search_entries (user_id)",
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
@@ -0,0 +1,54 @@
+"""archive tables for deleted chats, filled by python -m scripts.archive_chats"""
+from migrations import execute_all
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS chat_history_archive (
+        chat_history_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        document_id VARCHAR NOT NULL,
+        active_tag BOOLEAN NOT NULL,
+        title VARCHAR,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        modified_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        message JSONB,
+        archived_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (chat_history_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_chat_history_archive_user_id ON chat_history_archive (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS selected_chat_archive (
+        selected_chat_id VARCHAR NOT NULL,
+        chat_history_id VARCHAR NOT NULL,
+        document_id VARCHAR NOT NULL,
+        user_id VARCHAR NOT NULL,
+        title VARCHAR NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        modified_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        message JSONB,
+        summary VARCHAR,
+        summarized_count INTEGER NOT NULL,
+        archived_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (selected_chat_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_selected_chat_archive_chat_history_id ON selected_chat_archive (chat_history_id)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_messages_archive (
+        chat_history_id VARCHAR NOT NULL,
+        seq INTEGER NOT NULL,
+        role VARCHAR NOT NULL,
+        content VARCHAR,
+        content_zstd BYTEA,
+        timestamp VARCHAR,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        archived_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (chat_history_id, seq)
+    )
+    """,
+]
+
+
+def upgrade(connection):
+    execute_all(connection, STATEMENTS)
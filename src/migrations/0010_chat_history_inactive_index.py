@@ -0,0 +1,8 @@
+"""partial index of deleted chats for the archival batches, built without blocking chat writes"""
+from migrations import create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(connection):
+    create_index_concurrently(connection, "ix_chat_history_inactive_modified", "ON chat_history (modified_at) WHERE NOT active_tag")
@@ -0,0 +1,169 @@
+"""
+Versioned schema migrations.
+
+Every module NNNN_name.py of this package is one migration, NNNN is its version and upgrade(connection)
+applies it. Applied versions are recorded in schema_migrations. Run from src/ before the workers of a
+release start, the app itself doesn't create or alter tables:
+
+    python -m migrations upgrade [--to VERSION]
+    python -m migrations status
+
+- Pending migrations run in version order, each in one transaction together with its
+  schema_migrations row. A migration with TRANSACTIONAL = False runs in autocommit, which
+  CREATE INDEX CONCURRENTLY needs. It is recorded once it finished, so it must be safe to run again
+  after an interruption.
+- Every statement waits at most MIGRATION_LOCK_TIMEOUT_MS for its table lock. A DDL statement queued
+  behind a long transaction would block all reads and writes of the table meanwhile, it fails instead
+  and upgrade can be run again.
+- Concurrent upgrades (two deploys) are serialized by an advisory lock.
+- Statements use IF NOT EXISTS, so databases created by the create_all the app used to run at startup
+  are brought up to date whichever release created them.
+
+Connections go to MIGRATION_DATABASE_URL, which has to reach Postgres directly when the app runs
+behind a transaction pooler (session advisory locks don't work through one).
+"""
+import importlib
+import pkgutil
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from config import settings
+from utils.logger import logger
+
+#pg_advisory_lock key of upgrade, any constant not used by another lock
+ADVISORY_LOCK_KEY = 7_401_223
+
+SCHEMA_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL
+)
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    module: str
+
+
+def migrations() -> List[Migration]:
+    """migration modules of the package in version order"""
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        version, _, name = module.name.partition("_")
+        if version.isdigit():
+            found.append(Migration(int(version), name, f"{__name__}.{module.name}"))
+    found.sort()
+    versions = [migration.version for migration in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"duplicate migration versions: {versions}")
+    return found
+
+
+def head() -> int:
+    """version the code expects the database to be at"""
+    return migrations()[-1].version
+
+
+def execute_all(connection, statements:List[str]):
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def create_index_concurrently(connection, name:str, definition:str):
+    """
+    builds an index without blocking writes to the table, needs TRANSACTIONAL = False
+
+    An interrupted CONCURRENTLY build leaves an invalid index behind that IF NOT EXISTS would keep,
+    it is dropped and built again.
+
+    Args:
+    connection: autocommit connection
+    name: str, index name
+    definition: str, everything after the index name, e.g. "ON chat_history (user_id)"
+    """
+    valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}).scalar()
+    if valid:
+        return
+    if valid is False:
+        logger.warning(f"dropping invalid index {name} left by an interrupted build")
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY {name} {definition}"))
+
+
+def _engine():
+    return create_engine(settings.MIGRATION_DATABASE_URL, poolclass=NullPool)
+
+
+def _applied(connection) -> Dict[int, object]:
+    connection.execute(text(SCHEMA_MIGRATIONS))
+    return dict(connection.execute(text("SELECT version, applied_at FROM schema_migrations")).all())
+
+
+def _set_lock_timeout(connection, local:bool):
+    connection.execute(text(f"SET {'LOCAL ' if local else ''}lock_timeout = {int(settings.MIGRATION_LOCK_TIMEOUT_MS)}"))
+
+
+def upgrade(target:Optional[int]=None) -> List[int]:
+    """
+    applies the pending migrations up to target
+
+    Args:
+    target: int, last version to apply, all of them when None
+
+    Returns:
+    List[int]: versions applied by this call
+    """
+    engine = _engine()
+    done = []
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+            lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            try:
+                applied = _applied(lock)
+                for migration in migrations():
+                    if migration.version in applied or (target is not None and migration.version > target):
+                        continue
+                    module = importlib.import_module(migration.module)
+                    logger.info(f"applying migration {migration.version} {migration.name}")
+                    if getattr(module, "TRANSACTIONAL", True):
+                        with engine.begin() as connection:
+                            _set_lock_timeout(connection, local=True)
+                            module.upgrade(connection)
+                            connection.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"), migration._asdict())
+                    else:
+                        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                            _set_lock_timeout(connection, local=False)
+                            module.upgrade(connection)
+                            connection.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"), migration._asdict())
+                    done.append(migration.version)
+            finally:
+                lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    finally:
+        engine.dispose()
+    return done
+
+
+def status() -> List[Dict]:
+    """every migration with the time it was applied, None when pending"""
+    engine = _engine()
+    try:
+        with engine.begin() as connection:
+            applied = _applied(connection)
+    finally:
+        engine.dispose()
+    return [{"version": migration.version, "name": migration.name, "applied_at": applied.get(migration.version)} for migration in migrations()]
+
+
+async def check_schema(async_engine):
+    """logs at startup when the database is behind the code, one query and no DDL"""
+    try:
+        async with async_engine.connect() as connection:
+            current = (await connection.execute(text("SELECT max(version) FROM schema_migrations"))).scalar()
+    except Exception as e:
+        logger.error(f"unable to read schema_migrations, run python -m migrations upgrade: {str(e)}")
+        return
+    if current is None or current < head():
+        logger.error(f"database schema is at version {current}, the code needs {head()}, run python -m migrations upgrade")
@@ -0,0 +1,17 @@
+import argparse
+from migrations import upgrade, status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="versioned schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=None, help="last version to apply")
+    commands.add_parser("status", help="list migrations and when they were applied")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade(target=args.to)
+        print(f"applied {applied}" if applied else "database is up to date")
+    else:
+        for migration in status():
+            print(f"{migration['version']:04d} {migration['name']:<32} {migration['applied_at'] or 'pending'}")
@@ -1,15 +1,33 @@
-from sqlalchemy import Column, String, Integer, create_engine, ForeignKey, Boolean
+from sqlalchemy import Column, String, Text, Integer, BigInteger, Float, Index, JSON, LargeBinary, Computed, create_engine, ForeignKey, Boolean
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from config import settings
+from utils.db_pool import engine_options, instrument
 import uuid
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
 
 Base = declarative_base()
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(settings.DATABASE_URL, **engine_options())
+instrument(engine, "sync")
 sessionlocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+#route handlers use the async engine so a slow query doesn't block the event loop,
+#the sync engine is left for scripts and code that runs in threads
+async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, **engine_options(is_async=True))
+instrument(async_engine.sync_engine, "async")
+async_sessionlocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+#read replicas, sessions of read-only endpoints are routed to them by utils.db_router
+replica_engines = [create_async_engine(url, **engine_options(is_async=True)) for url in settings.ASYNC_DATABASE_REPLICA_URLS]
+for index, replica_engine in enumerate(replica_engines):
+    instrument(replica_engine.sync_engine, f"replica{index}")
+
+#text search configuration of search_entries.tsv, queries must use the same one
+SEARCH_CONFIG = "english"
+
 def get_db():
     db = sessionlocal()
     try:
@@ -17,6 +35,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with async_sessionlocal() as db:
+        yield db
+
 class User(Base):
     __tablename__= "users"
     user_id = Column(String, primary_key=True, nullable=False, index=True,default=lambda: str(uuid.uuid4()))
@@ -54,7 +76,20 @@ class ChatHistory(Base):
     title = Column(String, nullable=True)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
     modified_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
-    message = Column(String, nullable=False)
+    #legacy transcript of the whole conversation, messages are stored in chat_messages
+    message = Column(JSONB, nullable=True)
+
+    __table_args__ = (
+        #chat list pages: newest first per user, active chats only, listing columns included
+        Index(
+            "ix_chat_history_user_modified_active",
+            "user_id", text("modified_at DESC"), text("chat_history_id DESC"),
+            postgresql_where=text("active_tag"),
+            postgresql_include=["document_id", "title"],
+        ),
+        #archival batches: deleted chats, oldest first
+        Index("ix_chat_history_inactive_modified", "modified_at", postgresql_where=text("NOT active_tag")),
+    )
     
 
 class SelectedChat(Base):
@@ -66,5 +101,118 @@ class SelectedChat(Base):
     title = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
     modified_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
-    message = Column(String, nullable=False)
-    
+    #context the user selected for the last /chat-with-doc turn with its question and answer, not the whole conversation
+    message = Column(JSONB, nullable=True)
+    summary = Column(String, nullable=True)
+    summarized_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
+
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    chat_history_id = Column(String, ForeignKey(ChatHistory.chat_history_id), primary_key=True, nullable=False)
+    seq = Column(Integer, primary_key=True, nullable=False)
+    role = Column(String, nullable=False)
+    #large contents are stored zstd compressed in content_zstd when CHAT_MESSAGE_COMPRESSION=zstd, content is NULL then
+    content = Column(String, nullable=True)
+    content_zstd = Column(LargeBinary, nullable=True)
+    timestamp = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+#deleted chats moved out of the hot tables by scripts.archive_chats, same columns plus archived_at, no foreign keys
+class ChatHistoryArchive(Base):
+    __tablename__ = "chat_history_archive"
+    chat_history_id = Column(String, primary_key=True, nullable=False)
+    user_id = Column(String, nullable=False, index=True)
+    document_id = Column(String, nullable=False)
+    active_tag = Column(Boolean, nullable=False)
+    title = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    modified_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    message = Column(JSONB, nullable=True)
+    archived_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class SelectedChatArchive(Base):
+    __tablename__ = "selected_chat_archive"
+    selected_chat_id = Column(String, primary_key=True, nullable=False)
+    chat_history_id = Column(String, nullable=False, index=True)
+    document_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    modified_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    message = Column(JSONB, nullable=True)
+    summary = Column(String, nullable=True)
+    summarized_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class ChatMessageArchive(Base):
+    __tablename__ = "chat_messages_archive"
+    chat_history_id = Column(String, primary_key=True, nullable=False)
+    seq = Column(Integer, primary_key=True, nullable=False)
+    role = Column(String, nullable=False)
+    content = Column(String, nullable=True)
+    content_zstd = Column(LargeBinary, nullable=True)
+    timestamp = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    archived_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class DocumentAnalysis(Base):
+    __tablename__ = "document_analysis"
+    analysis_id = Column(String, primary_key=True, nullable=False, index=True, default=lambda: str(uuid.uuid4()))
+    document_id = Column(String, ForeignKey(UserDocuments.document_id), nullable=False, index=True)
+    user_id = Column(String, ForeignKey(User.user_id), nullable=False, index=True)
+    title = Column(String, nullable=True)
+    analysis = Column(JSON, nullable=False)
+    analysis_hash = Column(String, nullable=False, index=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+    usage_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=True)
+    document_id = Column(String, nullable=True)
+    task_id = Column(String, nullable=True)
+    stage = Column(String, nullable=False)
+    model = Column(String, nullable=True)
+    status = Column(String, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    cache_status = Column(String, nullable=False)
+    latency_ms = Column(Integer, nullable=False)
+    cost_usd = Column(Float, nullable=False, default=0)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+    __table_args__ = (
+        Index("ix_llm_usage_user_created", "user_id", "created_at"),
+        Index("ix_llm_usage_document", "document_id"),
+    )
+
+
+class SearchEntry(Base):
+    __tablename__ = "search_entries"
+    search_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=False)
+    #chat_title, chat_message, document or analysis, see utils.search
+    source = Column(String, nullable=False)
+    source_id = Column(String, nullable=False)
+    part = Column(Integer, nullable=False, default=0)
+    document_id = Column(String, nullable=True)
+    title = Column(String, nullable=True)
+    body = Column(Text, nullable=True)
+    tsv = Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(body, '')), 'B')",
+        persisted=True,
+    ))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+
+    __table_args__ = (
+        Index("ux_search_entries_source", "source", "source_id", "part", unique=True),
+        Index("ix_search_entries_tsv", "tsv", postgresql_using="gin"),
+        Index("ix_search_entries_user", "user_id"),
+    )
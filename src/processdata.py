@@ -1,12 +1,12 @@
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
 from rich.console import Console
 from rich.markdown import Markdown
+from agents.llm_backend import get_chat_model
 
 class AccessLLM:
     def __init__(self, api_key:str=None):
         self.api_key = api_key
-        self.client = ChatOpenAI(temperature=1, api_key=self.api_key, model="gpt-4o-mini")
+        self.client = get_chat_model(api_key=self.api_key)
         self.last_prompt = None
         self.last_response = None
 
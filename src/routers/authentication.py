@@ -1,7 +1,8 @@
 from oauth import flow, auth_callback, JiraOAuth
 from fastapi import Depends, HTTPException, Request, APIRouter, status, Header
-from sqlalchemy.orm import Session
-from models import get_db
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_async_db
 from database_scripts import create_user,UserCreationError, get_user_details
 from utils.token_generation import create_token, verify_password, TokenDecoder, validate_app_user, validate_token_incoming_requests, token_validator
 from p_model_type import Registration_login_password, login_details
@@ -32,7 +33,7 @@ async def login():
     return RedirectResponse(url=auth_url)
 
 @router.get("/auth/callback", status_code=status.HTTP_200_OK)
-async def callback(request: Request, db:Session=Depends(get_db)):
+async def callback(request: Request, db:AsyncSession=Depends(get_async_db)):
     # Extract the state from query parameters
     state = request.query_params.get("state")
     logger.info(f"State: {state}")
@@ -99,7 +100,7 @@ async def callback(request: Request, db:Session=Depends(get_db)):
     return HTMLResponse(content=html_content)
 
 @router.post("/registration", status_code=status.HTTP_201_CREATED)
-async def create_account(user_details:Registration_login_password, db:Session=Depends(get_db)):
+async def create_account(user_details:Registration_login_password, db:AsyncSession=Depends(get_async_db)):
     if not user_details:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Required details are not provided")
     try:
@@ -133,15 +134,16 @@ async def create_account(user_details:Registration_login_password, db:Session=De
     return {"access_token": token, "token_type": "bearer"} 
 
 @router.post("/login", status_code=status.HTTP_200_OK)
-def log_into_account(login_details:login_details, db:Session=Depends(get_db)):
+async def log_into_account(login_details:login_details, db:AsyncSession=Depends(get_async_db)):
     if not login_details:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Please provide the details to login")
     try:
-        user_details = get_user_details(email_address=login_details.email_address, db=db)
+        user_details = await get_user_details(email_address=login_details.email_address, db=db)
     except UserCreationError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Record doesn't exists, please register to Login")
 
-    checked_password = verify_password(password=login_details.password,hashed_password=user_details[6])
+    #bcrypt is slow on purpose, keep it off the event loop
+    checked_password = await asyncio.to_thread(verify_password, password=login_details.password, hashed_password=user_details[6])
     if checked_password:
         payload= {
             "id": user_details[1],
@@ -195,7 +197,7 @@ async def jira_login(request: Request, current_user: dict = Depends(token_valida
 @router.get("/auth/jira/callback")
 async def jira_callback(
     request: Request, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Handle Jira OAuth callback"""
     
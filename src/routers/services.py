@@ -1,20 +1,30 @@
 from fastapi import File, UploadFile, Form, Depends, APIRouter, HTTPException, status, Request, Security, BackgroundTasks
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 import os
 from utils.token_generation import token_validator
-from utils.chat_history import save_chat_history, delete_chat_history, get_user_chat_history_details,get_single_user_chat_history, save_chat_with_doc
+from utils.chat_history import save_chat_history, delete_chat_history, get_user_chat_history_details,get_single_user_chat_history
+from utils.chat_persistence import chat_persistence
+from utils.search import search
 from getdata import ExtractText
 from processdata import AccessLLM
 from config import settings
-from sqlalchemy.orm import Session
-from models import get_db
-from database_scripts import user_documents
-from agents.workflow import ProjectScopingAgent
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_async_db, async_sessionlocal, engine, async_engine, replica_engines
+from database_scripts import register_documents, save_document_analysis, get_document_analysis, save_document_texts
+from agents.workflow import ProjectScopingAgent, chains
+from agents.report import report_renderer, analysis_hash, iter_content, EXPORT_FORMATS
 from utils.logger import logger
+from utils.llm_governor import governor
+from utils.llm_context import set_llm_context
+from utils.llm_usage import get_usage_summary, USAGE_GROUP_COLUMNS
+from utils.db_pool import pool_stats
+from utils.db_router import read_router
+from utils.prompts_response import ProjectDefinition
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jira_logic.jira_components import get_jira_user_info
 from p_model_type import JiraTokenRequest, ChatHistoryDetails
 import asyncio
+import json
 import uuid
 from datetime import datetime
 from utils.document_save import get_s3_client,ensure_bucket_exists, upload_document_s3
@@ -29,8 +39,14 @@ security = HTTPBearer()
 # In-memory task storage (replace with database in production)
 task_status = {}
 
+async def get_read_db(current_token: dict = Depends(token_validator)):
+    """session for read-only endpoints, on a read replica unless the user wrote recently, see utils.db_router"""
+    async with read_router.session(current_token["regular_login_token"]["id"]) as db:
+        yield db
+
 async def process_document_task(file_path: str, user_id: str, document_id: str, task_id: str):
     try:
+        set_llm_context(user_id=user_id, document_id=document_id, task_id=task_id)
         # Initial steps remain the same until document extraction
         task_status[task_id] = {
             "status": "in_progress",
@@ -130,14 +146,86 @@ async def process_document_task(file_path: str, user_id: str, document_id: str,
         task_status[task_id]["message"] = str(e)
 
 
+async def store_analysis(agent: ProjectScopingAgent, document_id: str, user_id: str, title: str, db: AsyncSession) -> dict:
+    """Saves the structured analysis the report and exports are rendered from"""
+    report = agent.report_data()
+    return await save_document_analysis({
+        "document_id": document_id,
+        "user_id": user_id,
+        "title": title,
+        "analysis": report,
+        "analysis_hash": analysis_hash(report),
+    }, db=db)
+
+
+async def render_report_task(report: dict, report_hash: str):
+    try:
+        await report_renderer.ensure(report, report_hash)
+    except Exception as e:
+        logger.error(f"report rendering failed for {report_hash}: {str(e)}")
+
+
+async def analyze_document_task(raw_requirements: str, user_id: str, document_id: str, task_id: str):
+    """
+    Runs the requirements analysis in the background and publishes every ProjectDefinition field to
+    task_status[task_id]["partial_result"] as soon as the model completes it, so the UI can render
+    the title and statement while the rest is still being generated.
+    """
+    set_llm_context(user_id=user_id, document_id=document_id, task_id=task_id)
+    task_status[task_id] = {
+        "status": "in_progress",
+        "current_step": 2,
+        "step_progress": 0,
+        "message": "Analyzing requirements",
+        "document_id": document_id,
+        "partial_result": {},
+    }
+    total_fields = len(ProjectDefinition.model_fields)
+
+    def publish(field, value):
+        task_status[task_id]["partial_result"][field] = value
+        task_status[task_id]["step_progress"] = min(99, int(len(task_status[task_id]["partial_result"]) * 100 / total_fields))
+        logger.info(f"task {task_id} published {field}")
+
+    try:
+        agent = ProjectScopingAgent()
+        requirements, title = await agent.analyze_input({"document": raw_requirements}, on_field=publish)
+        async with async_sessionlocal() as db:
+            analysis = await store_analysis(agent, document_id=document_id, user_id=user_id, title=title, db=db)
+        task_status[task_id]["result"] = {"message": requirements, "document_id": document_id, "title": title, "analysis_id": analysis["analysis_id"]}
+
+        task_status[task_id]["current_step"] = 3
+        task_status[task_id]["step_progress"] = 0
+        task_status[task_id]["message"] = "Rendering report"
+        try:
+            await report_renderer.ensure(agent.report_data(), analysis["analysis_hash"])
+        except Exception as e:
+            #the analysis is done, /report renders the report again on download
+            logger.error(f"report rendering failed for task {task_id}: {str(e)}")
+        task_status[task_id]["result"]["report_url"] = f"/report/{analysis['analysis_id']}"
+        task_status[task_id]["step_progress"] = 100
+        task_status[task_id]["status"] = "completed"
+    except Exception as e:
+        logger.error(f"Error analyzing document {document_id}: {str(e)}")
+        task_status[task_id]["status"] = "error"
+        task_status[task_id]["message"] = str(e)
+
+
 @router.post("/upload/")
 async def upload_file(
     background_tasks: BackgroundTasks,
     current_token: dict = Depends(token_validator), 
     file: list[UploadFile] = File(...), 
-    db: Session = Depends(get_db)
+    background: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """
+    Uploads and analyzes documents. With background=true the analysis runs as a task and the response
+    only carries the task_id, partial results are then available from /task_status/{task_id}
+    """
+    set_llm_context(user_id=current_token["regular_login_token"]["id"])
     entire_doc_details = []
+    uploaded = []
     for content_document in file:
         file_content = b''
         try:
@@ -179,31 +267,43 @@ async def upload_file(
                     document_id = upload_document_s3(s3_client=s3, file_obj=file_obj, current_document_path=s3_file_path,content_type='application/pdf',bucket_name=settings.S3_BUCKET_NAME)
         except HTTPException as e:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"failed to upload document to s3 since there is no bucket")
-        
-
+        uploaded.append({"user_id": current_token["regular_login_token"]["id"], "document_path": s3_file_path, "filename": content_document.filename})
 
+    #every document of the upload is registered with one INSERT ... RETURNING
+    registered = await register_documents(docs=uploaded, db=db)
+    logger.info(f"registered {len(registered)} documents")
+    #the analysis is stored under the last document of the upload
+    document_id = registered[-1]["document_id"]
+    document_texts = []
+    for document, upload in zip(registered, uploaded):
         try:
-            user_doc = {
-                "user_id": current_token["regular_login_token"]["id"],
-                "document_path": s3_file_path
-            }
-            logger.info(f"user doc dict: {user_doc}")
-            response = await user_documents(doc_data=user_doc, db=db)
-            logger.info(f"completed the document upload")
-            document_data = await ExtractText(document_path=response["document_path"],user_id=response["user_id"],document_id=response["document_id"]).parse_document()
+            set_llm_context(document_id=document["document_id"])
+            document_data = await ExtractText(document_path=document["document_path"],user_id=document["user_id"],document_id=document["document_id"]).parse_document()
             entire_doc_details.append(document_data)
         except Exception as e:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error occured please try again {str(e)}")
+        document_text = "\n".join(str(item["data"]) if isinstance(item, dict) else str(item) for item in document_data)
+        document_texts.append({"user_id": document["user_id"], "document_id": document["document_id"], "title": upload["filename"], "text": document_text})
+    try:
+        await save_document_texts(documents=document_texts, db=db)
+    except HTTPException as e:
+        #search is secondary, the upload and analysis go on without it
+        logger.error(f"documents {[document['document_id'] for document in document_texts]} were not added to the search index: {e.detail}")
     logger.info(f"entire_doc_details: {entire_doc_details}")
         
     full_data = []
     for content_data in entire_doc_details:
-        for i in range(len(content_data)):
-            full_data.append(document_data[i]["data"]) 
-        raw_requirements =  "\n".join(
-                            str(item["data"]) if isinstance(item, dict) else str(item) for item in full_data
-                                    )
+        for item in content_data:
+            full_data.append(item["data"]) 
+    raw_requirements =  "\n".join(
+                        str(item["data"]) if isinstance(item, dict) else str(item) for item in full_data
+                                )
     # return {"message": raw_requirements, "document_id": response["document_id"], "title":" dummy title for now"}
+    if background:
+        task_id = str(uuid.uuid4())
+        task_status[task_id] = {"status": "in_progress", "current_step": 2, "step_progress": 0, "message": "Analyzing requirements", "document_id": document_id, "partial_result": {}}
+        background_tasks.add_task(analyze_document_task, raw_requirements, current_token["regular_login_token"]["id"], document_id, task_id)
+        return {"task_id": task_id, "document_id": document_id, "status": "in_progress"}
     # Agent for analyzing and providing the response in PDF
     agent = ProjectScopingAgent()
     
@@ -213,14 +313,47 @@ async def upload_file(
     }
     try:
         requirements, title = await agent.analyze_input(sample_data)
-        
-        
+        analysis = await store_analysis(agent, document_id=document_id, user_id=current_token["regular_login_token"]["id"], title=title, db=db)
+        background_tasks.add_task(render_report_task, agent.report_data(), analysis["analysis_hash"])
 
-        return {"message": requirements, "document_id": response["document_id"], "title":title}
+        return {"message": requirements, "document_id": document_id, "title":title, "analysis_id": analysis["analysis_id"]}
     except Exception as e:
         return {"Critical Error":{str(e)}}
     
 
+async def stream_export(analysis_id: str, export_format: str, user_id: str, db: AsyncSession) -> StreamingResponse:
+    """Streams a stored rendering of the analysis, rendering and storing it first when this format was never exported"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}")
+    record = await get_document_analysis(analysis_id=analysis_id, user_id=user_id, db=db)
+    try:
+        content = await report_renderer.open(record.analysis_hash, export_format)
+        if content is None:
+            #ensure gives None when another request stored the rendering in the meantime
+            content = await report_renderer.ensure(record.analysis, record.analysis_hash, export_format) or await report_renderer.open(record.analysis_hash, export_format)
+    except Exception as e:
+        logger.error(f"unable to export analysis {analysis_id} as {export_format}: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Export is not available right now, please try again later")
+    filename = "".join(c for c in (record.title or "project_scoping_report") if c.isalnum() or c in " -_").strip() or "project_scoping_report"
+    return StreamingResponse(
+        iter_content(content),
+        media_type=EXPORT_FORMATS[export_format].media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'},
+    )
+
+
+@router.get("/report/{analysis_id}")
+async def download_report(analysis_id: str, current_token: dict = Depends(token_validator), db: AsyncSession = Depends(get_read_db)):
+    """PDF report of an analysis, served from object storage and rendered on the first request if the background render didn't finish yet"""
+    return await stream_export(analysis_id, "pdf", current_token["regular_login_token"]["id"], db)
+
+
+@router.get("/analysis/{analysis_id}/export")
+async def export_analysis(analysis_id: str, format: str = "pdf", current_token: dict = Depends(token_validator), db: AsyncSession = Depends(get_read_db)):
+    """Export of a stored analysis as pdf, docx, md or json"""
+    return await stream_export(analysis_id, format.lower(), current_token["regular_login_token"]["id"], db)
+
+
 @router.get("/task_status/{task_id}")
 async def get_task_status(
     task_id: str,
@@ -250,11 +383,49 @@ async def get_task_status(
     logger.info(f"Returning status for task_id: {task_id}")
     return task_status[task_id]
 
+@router.get("/llm/chains")
+async def get_chain_stats(current_token: dict = Depends(token_validator)):
+    """Build cost and per invocation overhead of the prebuilt LLM chains, and the current governor state, only for ADMIN_EMAILS"""
+    if current_token["regular_login_token"].get("email") not in settings.ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to view the LLM chains")
+    return {"chains": chains.stats(), "governor": governor.stats()}
+
+@router.get("/db/pool")
+async def get_pool_stats(current_token: dict = Depends(token_validator)):
+    """Connection pool state of this worker: checkout waits, connections in use, overflow and timeouts, and read replica routing, only for ADMIN_EMAILS"""
+    if current_token["regular_login_token"].get("email") not in settings.ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to view the database pools")
+    engines = {"async": async_engine.sync_engine, "sync": engine}
+    engines.update({f"replica{index}": replica_engine.sync_engine for index, replica_engine in enumerate(replica_engines)})
+    return {**pool_stats(engines), "read_routing": read_router.stats()}
+
+@router.get("/usage/summary")
+async def llm_usage_summary(group_by:str = "stage", since:datetime = None, all_users:bool = False, current_user = Depends(token_validator), db:AsyncSession=Depends(get_read_db)):
+    """
+    LLM token, latency and cost rollup for capacity planning
+
+    Args:
+    group_by: str, one of user_id, document_id, task_id, stage, model
+    since: datetime, only count calls after this time
+    all_users: bool, rollup across every user, only for ADMIN_EMAILS
+
+    Returns:
+    Dict: usage rows per group
+    """
+    if group_by not in USAGE_GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {list(USAGE_GROUP_COLUMNS)}")
+    user_id = current_user["regular_login_token"]["id"]
+    if all_users:
+        if current_user["regular_login_token"].get("email") not in settings.ADMIN_EMAILS:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to view usage of other users")
+        user_id = None
+    return {"group_by": group_by, "usage": await get_usage_summary(db=db, group_by=group_by, user_id=user_id, since=since)}
+
 @router.post("/jira/get_user")
 async def get_user_details(
     request: Request,
     current_user: dict = Depends(token_validator),  # App authentication
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get Jira user details using stored token"""
     try:
@@ -269,7 +440,6 @@ async def get_user_details(
         # Validate Jira token
         jira_token = auth_header.split("Bearer ")[1]
         jira_payload = token_validator(request=jira_token)
-        print(f"jira_payload: {jira_payload}")
         
         # Use the access token stored in the Jira JWT
         user_info = await get_jira_user_info(jira_payload["jira_access_token"])
@@ -364,20 +534,21 @@ async def task_status_page(task_id: str, token: str = None):
     return HTMLResponse(content=html_content)
 
 @router.post('/chat')
-async def add_chat_history(request: ChatHistoryDetails,db:Session=Depends(get_db)):
+async def add_chat_history(request: ChatHistoryDetails,db:AsyncSession=Depends(get_async_db)):
     try:
         chat = request.model_dump()
         logger.info(f"got the details in api ,saving the chat history for user: {chat['user_id']}")
         save_chat = await save_chat_history(chat=chat, db=db)
-        print(f"save_chat: {save_chat}")
         return {"status":save_chat["status"], "chat_history_id":save_chat["chat_history_id"], "user_id":save_chat["user_id"],"message":save_chat["message"]}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"error occured while saving the chat history for user: {chat['user_id']}, error: {str(e)}")
         raise HTTPException(status_code=400, detail=f"details are missing: {str(e)}")
     
 
 @router.delete('/chat/{chat_id}')
-async def chat_delete(chat_id:str,db:Session=Depends(get_db),current_user:dict=Depends(token_validator)):
+async def chat_delete(chat_id:str,db:AsyncSession=Depends(get_async_db),current_user:dict=Depends(token_validator)):
     try:
         
         deleted_details = await delete_chat_history(user_id = current_user["regular_login_token"]["id"], chat_history_id=chat_id, db=db)
@@ -388,24 +559,39 @@ async def chat_delete(chat_id:str,db:Session=Depends(get_db),current_user:dict=D
         raise HTTPException(status_code=400, detail=f"Provided incorrect Details") 
         
 @router.get('/chat')
-async def get_user_chat_history(current_user = Depends(token_validator), db:Session=Depends(get_db)):
-    chat_records = await get_user_chat_history_details(user_id=current_user["regular_login_token"]["id"], db=db)
-    return {"user_details": chat_records}
+async def get_user_chat_history(limit:int = None, cursor:str = None, current_user = Depends(token_validator), db:AsyncSession=Depends(get_read_db)):
+    """Page of the user's chats, newest first. Pass next_cursor back as cursor for the next page"""
+    return await get_user_chat_history_details(user_id=current_user["regular_login_token"]["id"], db=db, limit=limit, cursor=cursor)
+
+@router.get('/search')
+async def search_user_content(q:str, limit:int = None, cursor:str = None, sources:str = None, current_user = Depends(token_validator), db:AsyncSession=Depends(get_read_db)):
+    """
+    Full-text search over the user's chats, documents and analyses, best match first.
+    sources is a comma separated subset of chat_title,chat_message,document,analysis. Pass next_cursor back as cursor for the next page
+    """
+    return await search(
+        user_id=current_user["regular_login_token"]["id"], query=q, db=db, limit=limit, cursor=cursor,
+        sources=[source.strip() for source in sources.split(",")] if sources else None,
+    )
 
 @router.get('/chat/{chat_history_id}')
-async def get_user_chat_history_by_id(chat_history_id:str,current_user = Depends(token_validator), db:Session=Depends(get_db)):
-    single_record = await get_single_user_chat_history(user_id=current_user["regular_login_token"]["id"], chat_history_id=chat_history_id, db=db)
+async def get_user_chat_history_by_id(chat_history_id:str, limit:int = None, before:str = None, fields:str = None, current_user = Depends(token_validator), db:AsyncSession=Depends(get_read_db)):
+    """
+    Single chat. With limit only the newest messages are returned, pass next_cursor back as before for older ones.
+    fields is a comma separated subset of role,content,timestamp, only those are read from the database
+    """
+    single_record = await get_single_user_chat_history(user_id=current_user["regular_login_token"]["id"], chat_history_id=chat_history_id, db=db, limit=limit, before=before, fields=[field.strip() for field in fields.split(",")] if fields else None)
     return {"user_details": single_record}
 
 @router.post('/chat-with-doc')
-async def conversation_with_doc(request:ChatHistoryDetails,current_user = Depends(token_validator), db:Session=Depends(get_db)):
+async def conversation_with_doc(request:ChatHistoryDetails,current_user = Depends(token_validator), db:AsyncSession=Depends(get_async_db)):
     """
     Selected context is used to chat with the LLM
 
     Args:
     request: ChatHistoryDetails,
     current_user: dict,
-    db: Session,
+    db: AsyncSession,
     sample received request
     {
         'chat_history_id': 'xxx', 
@@ -425,9 +611,13 @@ async def conversation_with_doc(request:ChatHistoryDetails,current_user = Depend
     try:
         if current_user["regular_login_token"]["id"] == request.user_id:
             chat_context = request.model_dump()
+            set_llm_context(user_id=request.user_id, document_id=request.document_id)
             #parse message for LLM and send it for query
-            print(f"chat_context: {chat_context['message']}")
-            LLM_response = await ProjectScopingAgent.chat_with_doc(context=chat_context["message"])
+            memory = await chat_persistence.load_memory(chat_history_id=chat_context["chat_history_id"], user_id=request.user_id, db=db)
+            LLM_response = await ProjectScopingAgent.chat_with_doc(context=chat_context["message"], memory=memory)
+            chat_context.update(memory.state())
+            chat_context["message"].append({"role": "assistant", "content": LLM_response["message"], "timestamp": datetime.now().isoformat()})
+            await chat_persistence.save_turn(chat_context, db=db)
             return {"message": f"{LLM_response['message']}"}
         else:
             raise HTTPException(status_code=400, detail=f"User ID mismatch")
@@ -436,8 +626,54 @@ async def conversation_with_doc(request:ChatHistoryDetails,current_user = Depend
     except Exception as e:
         logger.error(f"Error in chat-with-doc: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error")
-    finally:
-        chat_context["message"].append({"role": "assistant", "content": LLM_response, "timestamp": datetime.now().isoformat()})
-        await save_chat_with_doc(chat_context=chat_context, db=db)
 
-    
\ No newline at end of file
+    
+
+
+@router.post('/chat-with-doc/stream')
+async def conversation_with_doc_stream(request:ChatHistoryDetails,current_user = Depends(token_validator)):
+    """
+    Streaming variant of /chat-with-doc, sends the answer as Server-Sent Events while the LLM generates it
+
+    Args:
+    request: ChatHistoryDetails, same payload as /chat-with-doc
+    current_user: dict,
+
+    Returns:
+    StreamingResponse: text/event-stream with events
+        data: {"token": "xxx"}                      one per generated chunk
+        event: done  data: {"message": "xxx"}       full answer once generation is finished
+        event: error data: {"detail": "xxx"}        generation failed, stream is closed
+    The assembled answer is saved through chat_persistence once the done event was sent, a failed answer is not saved.
+    """
+    if current_user["regular_login_token"]["id"] != request.user_id:
+        raise HTTPException(status_code=400, detail=f"User ID mismatch")
+    chat_context = request.model_dump()
+    set_llm_context(user_id=request.user_id, document_id=request.document_id)
+
+    async def event_stream():
+        answer = []
+        #request scoped session is already closed once the response starts streaming, so the stream owns its own
+        db = async_sessionlocal()
+        try:
+            try:
+                memory = await chat_persistence.load_memory(chat_history_id=chat_context["chat_history_id"], user_id=chat_context["user_id"], db=db)
+                async for token in ProjectScopingAgent.stream_chat_with_doc(context=chat_context["message"], memory=memory):
+                    answer.append(token)
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+                yield f"event: done\ndata: {json.dumps({'message': ''.join(answer)})}\n\n"
+            except Exception as e:
+                logger.error(f"Error in chat-with-doc stream: {str(e)}")
+                yield f"event: error\ndata: {json.dumps({'detail': 'Internal server error'})}\n\n"
+                return
+            chat_context["message"].append({"role": "assistant", "content": "".join(answer), "timestamp": datetime.now().isoformat()})
+            chat_context.update(memory.state())
+            await chat_persistence.save_turn(chat_context, db=db)
+        finally:
+            await db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
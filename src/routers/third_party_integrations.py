@@ -1,8 +1,8 @@
 from fastapi import  Depends, APIRouter, HTTPException,Request,Header
 from fastapi.responses import FileResponse
 from utils.token_generation import token_validator, validate_token_incoming_requests
-from sqlalchemy.orm import Session
-from models import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import get_async_db
 from utils.integrations import Integrations
 from utils.logger import logger
 import os
@@ -10,7 +10,7 @@ import os
 router = APIRouter()
 
 @router.get("/jira/get_issues")
-async def get_jira_issues(current_user = Depends(token_validator), db:Session=Depends(get_db)):
+async def get_jira_issues(current_user = Depends(token_validator), db:AsyncSession=Depends(get_async_db)):
     
     
     if not current_user['jira_token']:
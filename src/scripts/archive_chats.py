@@ -0,0 +1,76 @@
+"""
+Moves deleted chats out of the hot tables into chat_history_archive, selected_chat_archive and
+chat_messages_archive.
+
+Run from src/ after python -m migrations upgrade, e.g. nightly from cron:
+    python -m scripts.archive_chats [--older-than-days 30] [--batch-size 500]
+
+Chats deleted (active_tag false) more than CHAT_ARCHIVE_AFTER_DAYS ago are moved in batches. Each batch
+is one transaction that copies the rows and deletes them from the hot tables, so a chat is either
+fully archived or untouched. Rows are locked with SKIP LOCKED, so two runs can overlap safely.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+import models
+from config import settings
+from utils.logger import logger
+
+#hot table -> archive table, in dependency order: rows referencing chat_history go first
+ARCHIVES = [
+    (models.ChatMessage, models.ChatMessageArchive),
+    (models.SelectedChat, models.SelectedChatArchive),
+    (models.ChatHistory, models.ChatHistoryArchive),
+]
+
+
+def archive_batch(cutoff:datetime, batch_size:int, db:Session) -> int:
+    """archives up to batch_size chats deleted before cutoff, callers commit"""
+    chat = models.ChatHistory
+    chat_ids = db.execute(
+        select(chat.chat_history_id)
+        .where(chat.active_tag == False, chat.modified_at < cutoff)
+        .order_by(chat.modified_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not chat_ids:
+        return 0
+    for table, archive in ARCHIVES:
+        columns = [column.name for column in table.__table__.columns]
+        rows = select(*[table.__table__.c[name] for name in columns]).where(table.chat_history_id.in_(chat_ids))
+        db.execute(insert(archive).from_select(columns, rows))
+        db.execute(delete(table).where(table.chat_history_id.in_(chat_ids)))
+    return len(chat_ids)
+
+
+def archive_chats(older_than_days:int=None, batch_size:int=None) -> int:
+    older_than_days = settings.CHAT_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        db = models.sessionlocal()
+        try:
+            archived = archive_batch(cutoff, batch_size, db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"chat archival stopped after {total} chats: {str(e)}")
+            raise
+        finally:
+            db.close()
+        if not archived:
+            break
+        total += archived
+        logger.info(f"archived {archived} chats, {total} so far")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="move deleted chats into the archive tables")
+    parser.add_argument("--older-than-days", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+    print(f"archived {archive_chats(older_than_days=args.older_than_days, batch_size=args.batch_size)} chats")
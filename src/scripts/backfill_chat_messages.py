@@ -0,0 +1,64 @@
+"""
+Moves the legacy JSON message blobs of chat_history into chat_messages.
+
+Only chat_history.message holds the whole conversation. selected_chat.message is the subset of
+messages the user selected as /chat-with-doc context and is left where it is.
+
+Run from src/ after python -m migrations upgrade:
+    python -m scripts.backfill_chat_messages [--batch-size 500]
+
+Safe to run more than once: chats that already have rows in chat_messages are skipped and
+conflicting rows are ignored.
+"""
+import argparse
+import json
+from sqlalchemy import select, exists
+from sqlalchemy.dialects.postgresql import insert
+import models
+from utils.chat_history import _message_row
+from utils.logger import logger
+
+def _parse(blob) -> list:
+    """legacy transcript as a list, JSONB columns are already parsed, text columns are not migrated yet"""
+    try:
+        messages = json.loads(blob) if isinstance(blob, str) else (blob or [])
+    except (TypeError, ValueError):
+        return []
+    return messages if isinstance(messages, list) else []
+
+
+def backfill(batch_size:int=500) -> int:
+    total = 0
+    last_id = ""
+    while True:
+        db = models.sessionlocal()
+        try:
+            chats = db.execute(
+                select(models.ChatHistory.chat_history_id, models.ChatHistory.message)
+                .where(models.ChatHistory.chat_history_id > last_id)
+                .where(~exists().where(models.ChatMessage.chat_history_id == models.ChatHistory.chat_history_id))
+                .order_by(models.ChatHistory.chat_history_id)
+                .limit(batch_size)
+            ).all()
+            if not chats:
+                break
+            rows = []
+            for chat in chats:
+                messages = _parse(chat.message)
+                rows += [_message_row(chat.chat_history_id, seq, message) for seq, message in enumerate(messages) if isinstance(message, dict)]
+            if rows:
+                db.execute(insert(models.ChatMessage).on_conflict_do_nothing(index_elements=["chat_history_id", "seq"]), rows)
+            db.commit()
+            total += len(rows)
+            last_id = chats[-1].chat_history_id
+            logger.info(f"backfilled {len(rows)} messages of {len(chats)} chats, up to {last_id}")
+        finally:
+            db.close()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="backfill chat_messages from the legacy message blobs")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    print(f"backfilled {backfill(batch_size=args.batch_size)} messages")
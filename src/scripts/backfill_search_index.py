@@ -0,0 +1,85 @@
+"""
+Adds the chats and analyses stored before search was deployed to search_entries.
+
+Run from src/ after python -m migrations upgrade and scripts.backfill_chat_messages:
+    python -m scripts.backfill_search_index [--batch-size 200]
+
+New writes are indexed by the write paths, this only covers older rows. Extracted document text was
+never stored, so documents uploaded before search are found through their analysis only.
+Safe to run more than once, entries are upserted on (source, source_id, part).
+"""
+import argparse
+import asyncio
+from sqlalchemy import select
+import models
+from utils.chat_history import MESSAGE_FIELDS, _message_columns, _message_from_row
+from utils.search import index_entries, chat_title_entry, chat_message_entries, index_analysis
+from utils.logger import logger
+
+
+async def backfill_chats(batch_size:int) -> int:
+    total = 0
+    last_id = ""
+    chat = models.ChatHistory
+    while True:
+        async with models.async_sessionlocal() as db:
+            chats = (await db.execute(
+                select(chat.chat_history_id, chat.user_id, chat.document_id, chat.title)
+                .where(chat.active_tag == True, chat.chat_history_id > last_id)
+                .order_by(chat.chat_history_id)
+                .limit(batch_size)
+            )).all()
+            if not chats:
+                break
+            entries = [chat_title_entry(row.user_id, row.document_id, row.chat_history_id, row.title) for row in chats if row.title]
+            owners = {row.chat_history_id: row for row in chats}
+            messages = (await db.execute(
+                select(models.ChatMessage.chat_history_id, models.ChatMessage.seq, *_message_columns(MESSAGE_FIELDS))
+                .where(models.ChatMessage.chat_history_id.in_(owners))
+            )).all()
+            for message in messages:
+                owner = owners[message.chat_history_id]
+                entries += chat_message_entries(owner.user_id, owner.document_id, owner.chat_history_id, message.seq, [_message_from_row(message, MESSAGE_FIELDS)])
+            await index_entries(entries, db)
+            await db.commit()
+            total += len(entries)
+            last_id = chats[-1].chat_history_id
+            logger.info(f"indexed {len(entries)} entries of {len(chats)} chats, up to {last_id}")
+    return total
+
+
+async def backfill_analyses(batch_size:int) -> int:
+    total = 0
+    last_id = ""
+    analysis = models.DocumentAnalysis
+    while True:
+        async with models.async_sessionlocal() as db:
+            rows = (await db.execute(
+                select(analysis.analysis_id, analysis.user_id, analysis.document_id, analysis.title, analysis.analysis)
+                .where(analysis.analysis_id > last_id)
+                .order_by(analysis.analysis_id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            for row in rows:
+                await index_analysis(row.user_id, row.document_id, row.analysis_id, row.title, row.analysis, db)
+            await db.commit()
+            total += len(rows)
+            last_id = rows[-1].analysis_id
+    return total
+
+
+async def backfill(batch_size:int):
+    try:
+        return await backfill_chats(batch_size), await backfill_analyses(batch_size)
+    finally:
+        await models.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="add stored chats and analyses to the search index")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    chats, analyses = asyncio.run(backfill(args.batch_size))
+    print(f"indexed {chats} chat entries and {analyses} analyses")
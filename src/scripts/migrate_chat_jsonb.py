@@ -0,0 +1,95 @@
+"""
+Compresses stored chat messages and gives the space freed by the JSONB conversion back.
+
+Run from src/ after python -m migrations upgrade (migration 0007 converts the transcripts to JSONB
+and adds content_zstd) and scripts.backfill_chat_messages:
+    python -m scripts.migrate_chat_jsonb [--compress] [--batch-size 500] [--vacuum]
+
+- --compress rewrites existing messages of at least CHAT_MESSAGE_COMPRESS_MIN_BYTES into content_zstd,
+  it needs CHAT_MESSAGE_COMPRESSION=zstd and the zstandard package.
+- --vacuum runs VACUUM FULL on the three tables so the freed space goes back to the OS. It takes an
+  ACCESS EXCLUSIVE lock, run it in a maintenance window.
+
+Storage of the three tables is printed before and after. Safe to run more than once.
+"""
+import argparse
+from sqlalchemy import text, select, update, func, tuple_
+import models
+from config import settings
+from utils.compression import compress_text
+from utils.logger import logger
+
+TABLES = ("chat_history", "selected_chat", "chat_messages")
+
+
+def storage_report() -> dict:
+    """total size of each table with its TOAST and indexes, and the bytes held by the transcript columns"""
+    with models.engine.connect() as connection:
+        report = {table: connection.execute(text("SELECT pg_total_relation_size(CAST(:table AS regclass))"), {"table": table}).scalar() for table in TABLES}
+        for table in ("chat_history", "selected_chat"):
+            report[f"{table}.message"] = connection.execute(text(f"SELECT coalesce(sum(pg_column_size(message)), 0) FROM {table}")).scalar()
+        report["chat_messages.content"] = connection.execute(text("SELECT coalesce(sum(pg_column_size(content)), 0) FROM chat_messages")).scalar()
+        if connection.execute(text("SELECT 1 FROM information_schema.columns WHERE table_name = 'chat_messages' AND column_name = 'content_zstd'")).scalar():
+            report["chat_messages.content_zstd"] = connection.execute(text("SELECT coalesce(sum(pg_column_size(content_zstd)), 0) FROM chat_messages")).scalar()
+    return report
+
+
+def _print_report(label:str, report:dict):
+    print(label)
+    for name, size in report.items():
+        print(f"  {name:<24} {size / 1024 / 1024:10.2f} MB")
+
+
+def compress_messages(batch_size:int=500) -> int:
+    """moves large plain text contents into content_zstd, batch by batch on the primary key"""
+    if compress_text("x" * 1_000_000) is None:
+        raise SystemExit("--compress needs CHAT_MESSAGE_COMPRESSION=zstd and the zstandard package")
+    message = models.ChatMessage
+    total = 0
+    last = ("", -1)
+    while True:
+        db = models.sessionlocal()
+        try:
+            rows = db.execute(
+                select(message.chat_history_id, message.seq, message.content)
+                .where(message.content.isnot(None), func.octet_length(message.content) >= settings.CHAT_MESSAGE_COMPRESS_MIN_BYTES)
+                .where(tuple_(message.chat_history_id, message.seq) > tuple_(*last))
+                .order_by(message.chat_history_id, message.seq)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for row in rows:
+                compressed = compress_text(row.content)
+                if compressed is not None:
+                    updates.append({"chat_history_id": row.chat_history_id, "seq": row.seq, "content": None, "content_zstd": compressed})
+            if updates:
+                db.execute(update(message), updates)
+            db.commit()
+            total += len(updates)
+            last = (rows[-1].chat_history_id, rows[-1].seq)
+            logger.info(f"compressed {len(updates)} of {len(rows)} messages, up to {last}")
+        finally:
+            db.close()
+    return total
+
+
+def vacuum():
+    with models.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in TABLES:
+            connection.execute(text(f"VACUUM FULL ANALYZE {table}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compress large chat messages and reclaim chat storage")
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+    _print_report("before", storage_report())
+    if args.compress:
+        print(f"compressed {compress_messages(batch_size=args.batch_size)} messages")
+    if args.vacuum:
+        vacuum()
+    _print_report("after", storage_report())
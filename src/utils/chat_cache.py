@@ -0,0 +1,139 @@
+"""
+Read-through cache for the chat list and single chat reads.
+
+Two tiers in front of Postgres:
+
+- in process: a TTLCache of CHAT_CACHE_LOCAL_TTL_SECONDS, answers repeated sidebar navigation without
+  leaving the worker. Writes made by this worker drop their entries right away, writes made by other
+  workers are seen after at most the local TTL.
+- Redis: entries live CHAT_CACHE_TTL_SECONDS under versioned keys. Every user has a version for the
+  chat list and every chat a version for its transcript. A write replaces the versions it touches with
+  a new random token, so older entries are never read again and simply expire, no key scans or
+  deletes. A read that raced with a write stores its result under the old version, where nobody looks.
+
+Without Redis (not configured or unreachable) only the in-process tier is used. CHAT_CACHE_TTL_SECONDS=0
+turns the cache off.
+"""
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Tuple
+from cachetools import TTLCache
+from config import settings
+from utils.logger import logger
+
+VERSION_PREFIX = "chat_cache:ver"
+
+
+def _encode(value:Any) -> str:
+    return json.dumps(value, default=lambda item: item.isoformat() if isinstance(item, datetime) else str(item), separators=(",", ":"))
+
+
+class ChatCache:
+    def __init__(self):
+        self.redis = None
+        self._local = TTLCache(maxsize=settings.CHAT_CACHE_LOCAL_MAX_ENTRIES, ttl=settings.CHAT_CACHE_LOCAL_TTL_SECONDS)
+        #bumped by every local invalidation, a load that started before it is not stored locally
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CHAT_CACHE_TTL_SECONDS > 0
+
+    def attach(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _list_version_key(user_id:str) -> str:
+        return f"{VERSION_PREFIX}:user:{user_id}"
+
+    @staticmethod
+    def _chat_version_key(chat_history_id:str) -> str:
+        return f"{VERSION_PREFIX}:chat:{chat_history_id}"
+
+    async def _versions(self, keys) -> list:
+        """current version tokens, created on first use, in one round trip"""
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, uuid.uuid4().hex, nx=True, ex=settings.CHAT_CACHE_TTL_SECONDS * 2)
+        for key in keys:
+            pipe.get(key)
+        return (await pipe.execute())[len(keys):]
+
+    async def get_or_load(self, kind:str, user_id:str, chat_history_id:Optional[str], params:Tuple, loader:Callable[[], Awaitable[Any]]) -> Any:
+        """
+        cached result of loader
+
+        Args:
+        kind: str, "list" (versioned per user) or "chat" (versioned per chat)
+        user_id: str, owner of the data, part of every key
+        chat_history_id: str, chat of a "chat" read
+        params: Tuple, request parameters that change the result (page size, cursor, fields)
+        loader: coroutine function reading the database, exceptions are not cached
+
+        Returns:
+        the cached value as JSON types (datetimes become ISO strings), or the loader result on a miss
+        """
+        if not self.enabled:
+            return await loader()
+        local_key = (kind, user_id, chat_history_id, params)
+        cached = self._local.get(local_key)
+        if cached is not None:
+            return json.loads(cached)
+
+        generation = self._generation
+        redis_key = None
+        if self.redis is not None:
+            try:
+                version_key = self._chat_version_key(chat_history_id) if kind == "chat" else self._list_version_key(user_id)
+                versions = await self._versions([version_key])
+                redis_key = f"chat_cache:{kind}:{user_id}:{chat_history_id or ''}:{':'.join(versions)}:{_encode(params)}"
+                cached = await self.redis.get(redis_key)
+                if cached is not None:
+                    self._store_local(local_key, cached, generation)
+                    return json.loads(cached)
+            except Exception as e:
+                logger.warning(f"chat cache unavailable, reading from the database: {str(e)}")
+                redis_key = None
+
+        value = await loader()
+        encoded = _encode(value)
+        self._store_local(local_key, encoded, generation)
+        if redis_key is not None:
+            try:
+                await self.redis.set(redis_key, encoded, ex=settings.CHAT_CACHE_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"unable to cache {kind} of user {user_id}: {str(e)}")
+        return value
+
+    def _store_local(self, key:Tuple, encoded:str, generation:int):
+        if generation == self._generation:
+            self._local[key] = encoded
+
+    async def invalidate(self, user_id:str, chat_history_id:str=None):
+        """
+        drops the chat list of the user and the transcript of the chat, call after the write is committed
+
+        Args:
+        user_id: str,
+        chat_history_id: str, chat that was written, None when only the list changed
+        """
+        if not self.enabled or not user_id:
+            return
+        self._generation += 1
+        for key in list(self._local.keys()):
+            kind, owner, chat_id, _ = key
+            if (kind == "list" and owner == user_id) or (chat_history_id and chat_id == chat_history_id):
+                self._local.pop(key, None)
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in [self._list_version_key(user_id)] + ([self._chat_version_key(chat_history_id)] if chat_history_id else []):
+                pipe.set(key, uuid.uuid4().hex, ex=settings.CHAT_CACHE_TTL_SECONDS * 2)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"unable to invalidate the chat cache of user {user_id}, entries expire in {settings.CHAT_CACHE_TTL_SECONDS}s: {str(e)}")
+
+
+chat_cache = ChatCache()
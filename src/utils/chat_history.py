@@ -1,15 +1,171 @@
 from __future__ import annotations
 
-from sqlalchemy.orm import Session
-from typing import Dict, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
 import models
 import json
-from sqlalchemy import text, and_
+from sqlalchemy import and_, func, select, update, tuple_, exists, true
+from sqlalchemy.dialects.postgresql import insert
 import uuid
 from fastapi import HTTPException
 from utils.logger import logger
+from utils.conversation_memory import ConversationMemory
+from utils.pagination import encode_cursor, decode_cursor
+from utils.compression import compress_text, decompress_text
+from utils.chat_cache import chat_cache
+from utils.db_router import read_router
+from utils.search import index_entries, chat_title_entry, chat_message_entries, remove_chat_entries
+from config import settings
+from datetime import datetime
 
-async def save_chat_history(chat:Dict, db:Session) -> Dict:
+MESSAGE_FIELDS = ("role", "content", "timestamp")
+
+
+def _content_text(content) -> str:
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def _message_row(chat_history_id:str, seq:int, message:Dict) -> Dict:
+    content = _content_text(message.get("content"))
+    compressed = compress_text(content)
+    return {
+        "chat_history_id": chat_history_id,
+        "seq": seq,
+        "role": message.get("role"),
+        "content": None if compressed else content,
+        "content_zstd": compressed,
+        "timestamp": message.get("timestamp"),
+    }
+
+
+def _message_columns(fields) -> list:
+    """chat_messages columns needed for the requested message fields, content needs both storage columns"""
+    columns = []
+    for field in fields:
+        columns.append(getattr(models.ChatMessage, field))
+        if field == "content":
+            columns.append(models.ChatMessage.content_zstd)
+    return columns
+
+
+def _message_from_row(row, fields) -> Dict:
+    message = {}
+    for field in fields:
+        if field == "content":
+            message["content"] = decompress_text(row.content_zstd) if row.content_zstd is not None else row.content
+        else:
+            message[field] = getattr(row, field)
+    return message
+
+
+def _legacy_messages(legacy_message) -> List[Dict]:
+    """legacy transcript, JSONB comes back parsed, text rows that were not migrated yet are parsed here"""
+    if not legacy_message:
+        return []
+    return json.loads(legacy_message) if isinstance(legacy_message, str) else legacy_message
+
+
+def _message_fields(fields) -> Tuple[str, ...]:
+    if not fields:
+        return MESSAGE_FIELDS
+    unknown = set(fields) - set(MESSAGE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown message fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in MESSAGE_FIELDS if field in fields)
+
+
+def _same_message(message:Dict, stored:Dict) -> bool:
+    return (
+        message.get("role") == stored.get("role")
+        and message.get("timestamp") == stored.get("timestamp")
+        and _content_text(message.get("content")) == stored.get("content")
+    )
+
+
+def unsaved_messages(messages:List[Dict], last_stored:Optional[Dict]) -> Optional[List[Dict]]:
+    """
+    messages of the conversation a client sent that come after the last stored message
+
+    The last stored message is looked up from the end of the list, everything after it is new.
+
+    Args:
+    messages: [{role:str, content:str, timestamp:str}], conversation as sent by the client
+    last_stored: Dict, last message in chat_messages, None when the chat has none
+
+    Returns:
+    List[Dict] or None: the new messages, None when the list doesn't contain the last stored message
+    and the positions of its messages are unknown
+    """
+    if last_stored is None:
+        return messages
+    for index in range(len(messages) - 1, -1, -1):
+        if _same_message(messages[index], last_stored):
+            return messages[index + 1:]
+    return None
+
+
+async def _last_stored_message(chat_history_id:str, db:AsyncSession) -> Tuple[int, Optional[Dict]]:
+    """seq of the next message and the last stored message, (0, None) for a chat without messages"""
+    row = (await db.execute(
+        select(models.ChatMessage.seq, *_message_columns(MESSAGE_FIELDS))
+        .where(models.ChatMessage.chat_history_id == chat_history_id)
+        .order_by(models.ChatMessage.seq.desc())
+        .limit(1)
+    )).first()
+    if row is None:
+        return 0, None
+    return row.seq + 1, _message_from_row(row, MESSAGE_FIELDS)
+
+
+async def append_chat_messages(chat_history_id:str, messages:List[Dict], db:AsyncSession, start_seq:int, user_id:str=None, document_id:str=None) -> int:
+    """
+    stores messages as the next turns of the conversation, callers commit
+
+    Rows written concurrently by another save for the same seq are skipped.
+
+    Args:
+    chat_history_id: str,
+    messages: [{role:str, content:str, timestamp:str}], only messages that are not stored yet
+    db: AsyncSession
+    start_seq: int, seq of the first message, one after the last stored message
+    user_id: str, owner of the chat, the appended messages are added to the search index when given
+    document_id: str,
+
+    Returns:
+    int: number of appended messages
+    """
+    if not messages:
+        return 0
+    rows = [_message_row(chat_history_id, start_seq + index, message) for index, message in enumerate(messages)]
+    await db.execute(insert(models.ChatMessage).on_conflict_do_nothing(index_elements=["chat_history_id", "seq"]), rows)
+    if user_id:
+        await index_entries(chat_message_entries(user_id, document_id, chat_history_id, start_seq, messages), db)
+    return len(rows)
+
+
+async def load_chat_messages(chat_history_id:str, db:AsyncSession, legacy_message=None) -> List[Dict]:
+    """
+    messages of a conversation in order, falls back to the legacy JSON blob for chats that were not backfilled
+
+    Args:
+    chat_history_id: str,
+    db: AsyncSession
+    legacy_message: list, ChatHistory.message of the chat when already loaded
+
+    Returns:
+    List[Dict]: [{role, content, timestamp}]
+    """
+    rows = (await db.execute(
+        select(*_message_columns(MESSAGE_FIELDS))
+        .where(models.ChatMessage.chat_history_id == chat_history_id)
+        .order_by(models.ChatMessage.seq)
+    )).all()
+    if rows:
+        return [_message_from_row(row, MESSAGE_FIELDS) for row in rows]
+    return _legacy_messages(legacy_message)
+
+
+async def save_chat_history(chat:Dict, db:AsyncSession) -> Dict:
     """
     Save or update chat history
 
@@ -25,30 +181,36 @@ async def save_chat_history(chat:Dict, db:Session) -> Dict:
     db:Database session
 
     Returns:
-    Dict: Saved chat history details
+    Dict: Saved chat history details, a 409 is raised when message doesn't continue the stored conversation
     """
 
 
     try:
-        #convert message object to json
-        message_json = json.dumps(chat["message"])
-
         if "chat_history_id" in chat and chat["chat_history_id"] and chat["chat_history_id"] != "":
-            #Get Existing record
-            logger.info(f"getting the chat details to save for existing user in chat history table: {chat['user_id']}")
-            chat_record = db.query(models.ChatHistory)\
-            .filter(models.ChatHistory.chat_history_id == chat["chat_history_id"])\
-            .first()
+            #update the existing record, RETURNING gives the owner and the new modified_at in the same round trip
+            logger.info(f"updating the chat details for user: {chat['user_id']}")
+            chat_record = (await db.execute(
+                update(models.ChatHistory)
+                .where(models.ChatHistory.chat_history_id == chat["chat_history_id"], models.ChatHistory.user_id == chat["user_id"], models.ChatHistory.active_tag)
+                .values(modified_at=func.now(), **({"title": chat["title"]} if "title" in chat else {}))
+                .returning(models.ChatHistory.chat_history_id, models.ChatHistory.user_id, models.ChatHistory.document_id, models.ChatHistory.title, models.ChatHistory.modified_at)
+                .execution_options(synchronize_session=False)
+            )).first()
             if not chat_record:
                 raise HTTPException(status_code=404, detail="Chat history not found")
-            logger.info(f"updating the chat details for user: {chat['user_id']}")
-            chat_record.message = message_json
+            next_seq, last_stored = await _last_stored_message(chat_record.chat_history_id, db)
+            new_messages = unsaved_messages(chat["message"], last_stored)
+            if new_messages is None:
+                #the client's list doesn't extend the stored conversation, nothing is appended at guessed positions
+                logger.warning(f"messages of chat {chat_record.chat_history_id} don't continue the stored conversation, not appended")
+                raise HTTPException(status_code=409, detail="Messages don't continue the stored conversation, reload the chat and send them again")
+            await append_chat_messages(chat_record.chat_history_id, new_messages, db, start_seq=next_seq, user_id=chat_record.user_id, document_id=chat_record.document_id)
             if "title" in chat:
-                chat_record.title = chat["title"]
-            chat_record.modified_at = text("now()")
-            db.commit()
+                await index_entries([chat_title_entry(chat_record.user_id, chat_record.document_id, chat_record.chat_history_id, chat["title"])], db)
+            await db.commit()
             logger.info(f"commit done: {chat['user_id']}")
-            db.refresh(chat_record)
+            await chat_cache.invalidate(chat_record.user_id, chat_record.chat_history_id)
+            await read_router.record_write(chat_record.user_id)
             logger.info(f"chat details saved for user: {chat['user_id']}")
             return {
                 "chat_history_id": chat_record.chat_history_id,
@@ -66,13 +228,16 @@ async def save_chat_history(chat:Dict, db:Session) -> Dict:
                 chat_history_id = chat_history_id,
                 user_id = chat["user_id"],
                 document_id = chat["document_id"],
-                message = message_json,
                 title = chat["title"],
             )
             logger.info(f"adding the chat details for new user in chat history table: {chat['user_id']}")
             db.add(new_chat)
-            db.commit()
-            db.refresh(new_chat)
+            await db.flush()
+            await append_chat_messages(chat_history_id, chat["message"], db, start_seq=0, user_id=chat["user_id"], document_id=chat["document_id"])
+            await index_entries([chat_title_entry(chat["user_id"], chat["document_id"], chat_history_id, chat["title"])], db)
+            await db.commit()
+            await chat_cache.invalidate(new_chat.user_id)
+            await read_router.record_write(new_chat.user_id)
             return {
                 "chat_history_id": new_chat.chat_history_id,
                 "user_id": new_chat.user_id,
@@ -81,12 +246,15 @@ async def save_chat_history(chat:Dict, db:Session) -> Dict:
                 "title": new_chat.title,
                 "status": "created"
             }
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
     
 
-async def delete_chat_history(user_id:str, chat_history_id:str, db:Session):
+async def delete_chat_history(user_id:str, chat_history_id:str, db:AsyncSession):
     """
     mark the chat history active tag to False
 
@@ -101,54 +269,190 @@ async def delete_chat_history(user_id:str, chat_history_id:str, db:Session):
     try:
         chat_history_id = chat_history_id.strip('"\'')
         logger.info(f"details received for deleting the chat history for user: {user_id}, chat_history_id: {chat_history_id}")
-        user_details = db.query(models.ChatHistory)\
-        .filter(and_(models.ChatHistory.user_id == user_id, models.ChatHistory.chat_history_id == chat_history_id, models.ChatHistory.active_tag == "True")).first()
+        user_details = (await db.execute(
+            update(models.ChatHistory)
+            .where(and_(models.ChatHistory.user_id == user_id, models.ChatHistory.chat_history_id == chat_history_id, models.ChatHistory.active_tag == True))
+            .values(active_tag=False, modified_at=func.now())
+            .returning(models.ChatHistory.chat_history_id, models.ChatHistory.user_id)
+            .execution_options(synchronize_session=False)
+        )).first()
         logger.info(f"user_details: {user_details}")
         if not user_details:
             raise HTTPException(status_code=404, detail="Chat history not found")
-        user_details.active_tag = False
-        user_details.modified_at = text("now()")
-        db.commit()
-        db.refresh(user_details)
+        await remove_chat_entries(chat_history_id, db)
+        await db.commit()
+        await chat_cache.invalidate(user_id, chat_history_id)
+        await read_router.record_write(user_id)
         return {
             "chat_history_id": user_details.chat_history_id,
             "user_id": user_details.user_id,
             "status":"deleted"
         }
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal server error")
     
-async def get_user_chat_history_details(user_id:str, db:Session):
+async def get_user_chat_history_details(user_id:str, db:AsyncSession, limit:int=None, cursor:str=None) -> Dict:
+    """
+    one page of the user's active chats, most recently modified first
+
+    Served from the chat cache when possible (see utils.chat_cache).
+    Keyset pagination on (modified_at, chat_history_id) served by ix_chat_history_user_modified_active,
+    only the listing columns are read so the message column is never loaded.
+
+    Args:
+    user_id: str,
+    db: AsyncSession
+    limit: int, page size, defaults to CHAT_LIST_PAGE_SIZE
+    cursor: str, next_cursor of the previous page
+
+    Returns:
+    Dict: {"user_details": [{document_id, chat_history_id, title, modified_at}], "next_cursor": str or None}
+    """
+    return await chat_cache.get_or_load("list", user_id, None, (limit, cursor), lambda: _list_user_chats(user_id, db, limit, cursor))
+
+
+async def _list_user_chats(user_id:str, db:AsyncSession, limit:int=None, cursor:str=None) -> Dict:
+    limit = min(max(limit or settings.CHAT_LIST_PAGE_SIZE, 1), settings.CHAT_LIST_MAX_PAGE_SIZE)
+    chat = models.ChatHistory
+    query = select(chat.document_id, chat.chat_history_id, chat.title, chat.modified_at)\
+        .where(chat.user_id == user_id, chat.active_tag == True)\
+        .order_by(chat.modified_at.desc(), chat.chat_history_id.desc())\
+        .limit(limit + 1)
+    if cursor:
+        modified_at, chat_history_id = decode_cursor(cursor, 2)
+        query = query.where(tuple_(chat.modified_at, chat.chat_history_id) < (datetime.fromisoformat(modified_at), chat_history_id))
     try:
-        user_chat_details = db.query(models.ChatHistory).filter(and_(models.ChatHistory.user_id == user_id, models.ChatHistory.active_tag == "True")).all()
-        if user_chat_details:
-            full_chat_history = []
-            for details in user_chat_details:
-                full_history = {}
-                full_history["document_id"] = details.document_id
-                full_history["chat_history_id"] = details.chat_history_id
-                full_history["title"] = details.title
-                full_history["modified_at"] = details.modified_at
-                full_chat_history.append(full_history)
-            return full_chat_history
-        else:
-            raise HTTPException(status_code=404, detail=f"Chat history not found")
+        rows = (await db.execute(query)).all()
+    except Exception as e:
+        logger.error(f"Error in listing the chat history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error")
+    if not rows and not cursor:
+        raise HTTPException(status_code=404, detail=f"Chat history not found")
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1].modified_at.isoformat(), page[-1].chat_history_id) if len(rows) > limit else None
+    return {
+        "user_details": [
+            {"document_id": row.document_id, "chat_history_id": row.chat_history_id, "title": row.title, "modified_at": row.modified_at}
+            for row in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+async def load_chat_messages_page(chat_history_id:str, db:AsyncSession, limit:int, before:int=None, fields=MESSAGE_FIELDS) -> Tuple[List[Dict], Optional[int]]:
+    """
+    latest `limit` messages before seq `before`, read backwards on the (chat_history_id, seq) primary key.
+    Only the columns of the requested fields are read.
+
+    Returns:
+    Tuple[List[Dict], Optional[int]]: messages oldest first with their seq, seq to pass as `before` for the
+    previous page (None when the first message was reached)
+    """
+    query = select(models.ChatMessage.seq, *_message_columns(fields))\
+        .where(models.ChatMessage.chat_history_id == chat_history_id)\
+        .order_by(models.ChatMessage.seq.desc())\
+        .limit(limit + 1)
+    if before is not None:
+        query = query.where(models.ChatMessage.seq < before)
+    rows = (await db.execute(query)).all()
+    page = list(reversed(rows[:limit]))
+    messages = [dict(_message_from_row(row, fields), seq=row.seq) for row in page]
+    return messages, (page[0].seq if len(rows) > limit else None)
+
+
+async def load_legacy_messages_page(chat_history_id:str, db:AsyncSession, limit:int, before:int=None, fields=MESSAGE_FIELDS) -> Tuple[List[Dict], Optional[int]]:
+    """
+    same page as load_chat_messages_page from the legacy JSONB transcript, sliced and projected in Postgres
+    so only the requested messages and fields leave the database
+    """
+    chat = models.ChatHistory
+    total = (await db.execute(select(func.jsonb_array_length(chat.message)).where(chat.chat_history_id == chat_history_id))).scalar() or 0
+    end = total if before is None else min(before, total)
+    start = max(end - limit, 0)
+    elements = func.jsonb_array_elements(chat.message).table_valued("value", with_ordinality="ordinality").render_derived()
+    rows = (await db.execute(
+        select(
+            (elements.c.ordinality - 1).label("seq"),
+            *[elements.c.value.op("->>")(field).label(field) for field in fields],
+        )
+        .select_from(chat)
+        .join(elements, true())
+        .where(chat.chat_history_id == chat_history_id, elements.c.ordinality > start, elements.c.ordinality <= end)
+        .order_by(elements.c.ordinality)
+    )).all()
+    messages = [dict({field: getattr(row, field) for field in fields}, seq=row.seq) for row in rows]
+    return messages, (start or None)
+
+
+async def get_single_user_chat_history(user_id:str, chat_history_id:str, db:AsyncSession, limit:int=None, before:str=None, fields:List[str]=None):
+    """
+    a single chat of the user
+
+    Without limit the whole conversation is returned as a JSON string in "message" (legacy shape).
+    With limit only the newest `limit` messages are returned in "messages", oldest first, and "next_cursor"
+    is passed back as `before` to load the page of older messages.
+
+    Args:
+    user_id: str,
+    chat_history_id: str,
+    db: AsyncSession
+    limit: int, page size
+    before: str, next_cursor of the previous page
+    fields: List[str], message fields to return (role, content, timestamp), all by default
+    """
+    params = (limit, before, tuple(fields) if fields else None)
+    return await chat_cache.get_or_load("chat", user_id, chat_history_id, params, lambda: _load_single_chat(user_id, chat_history_id, db, limit, before, fields))
+
+
+async def _load_single_chat(user_id:str, chat_history_id:str, db:AsyncSession, limit:int=None, before:str=None, fields:List[str]=None):
+    if limit is None:
+        return await _get_full_chat_history(user_id, chat_history_id, db)
+
+    limit = min(max(limit, 1), settings.CHAT_LIST_MAX_PAGE_SIZE)
+    fields = _message_fields(fields)
+    chat = models.ChatHistory
+    try:
+        details = (await db.execute(
+            select(chat.chat_history_id, chat.document_id, chat.title, chat.modified_at)
+            .where(chat.user_id == user_id, chat.active_tag == True, chat.chat_history_id == chat_history_id)
+        )).first()
+        if not details:
+            raise HTTPException(status_code=404, detail="Chat history not found")
+        before_seq = decode_cursor(before, 1)[0] if before else None
+        messages, next_seq = await load_chat_messages_page(chat_history_id, db, limit=limit, before=before_seq, fields=fields)
+        if not messages and not (await db.execute(select(exists().where(models.ChatMessage.chat_history_id == chat_history_id)))).scalar():
+            #chat that was not backfilled into chat_messages yet, page the legacy transcript
+            messages, next_seq = await load_legacy_messages_page(chat_history_id, db, limit=limit, before=before_seq, fields=fields)
     except HTTPException:
         raise
     except Exception as e:
+        logger.error(f"Error in loading the chat messages: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error")
+    return {
+        "chat_history_id": details.chat_history_id,
+        "document_id": details.document_id,
+        "title": details.title,
+        "modified_at": details.modified_at,
+        "messages": messages,
+        "next_cursor": encode_cursor(next_seq) if next_seq is not None else None,
+    }
+
 
-async def get_single_user_chat_history(user_id:str, chat_history_id:str, db:Session):
+async def _get_full_chat_history(user_id:str, chat_history_id:str, db:AsyncSession):
     try:
-        user_chat_details = db.query(models.ChatHistory).filter(and_(models.ChatHistory.user_id == user_id, models.ChatHistory.active_tag == "True", models.ChatHistory.chat_history_id == chat_history_id)).first()
+        user_chat_details = (await db.execute(
+            select(models.ChatHistory).where(and_(models.ChatHistory.user_id == user_id, models.ChatHistory.active_tag == True, models.ChatHistory.chat_history_id == chat_history_id))
+        )).scalars().first()
         if user_chat_details:
             full_history = {}
             full_history["chat_history_id"] = user_chat_details.chat_history_id
             full_history["document_id"] = user_chat_details.document_id
             full_history["title"] = user_chat_details.title
             full_history["modified_at"] = user_chat_details.modified_at
-            full_history["message"] = user_chat_details.message
+            full_history["message"] = json.dumps(await load_chat_messages(user_chat_details.chat_history_id, db, legacy_message=user_chat_details.message))
             return full_history
         else:
             raise HTTPException(status_code=404, detail="Chat history not found")
@@ -157,32 +461,26 @@ async def get_single_user_chat_history(user_id:str, chat_history_id:str, db:Sess
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error")
     
-async def save_chat_with_doc(chat_context:Dict, db:Session):
+async def get_chat_memory(chat_history_id:str, user_id:str, db:AsyncSession) -> ConversationMemory:
     """
-    saves the selected chat to continue the conversation
+    loads the stored conversation summary of the selected chat
 
-    Args: chat_context: Dict,
-    db: Session
-
-    Returns: Dict: saved chat details
+    Args: chat_history_id: str,
+    user_id: str, owner of the chat, the summary of another user's chat is never loaded
+    db: AsyncSession
 
+    Returns: ConversationMemory: memory with the stored summary, empty if the chat is new
     """
+    if not chat_history_id:
+        return ConversationMemory()
     try:
-        chat_details = db.query(models.SelectedChat).filter(models.SelectedChat.chat_history_id == chat_context["chat_history_id"]).first()
-        if chat_details:
-            chat_details.message = json.dumps(chat_context["message"])
-            chat_details.modified_at = text("now()")
-            chat_details.title = chat_context["title"]
-            db.commit()
-        else:
-            logger.info(f"Hitting in else block")
-            chat_context["message"] = json.dumps(chat_context["message"])
-            content = models.SelectedChat(**chat_context)
-            logger.info(f"content: {content}")
-            db.add(content)
-            db.commit()
+        memory_details = (await db.execute(
+            select(models.SelectedChat.summary, models.SelectedChat.summarized_count)
+            .where(models.SelectedChat.chat_history_id == chat_history_id, models.SelectedChat.user_id == user_id)
+        )).first()
     except Exception as e:
-        db.rollback()
-        logger.error(f"Error in saving the selected chat: {str(e)}")
-        
-    
+        logger.error(f"Error in loading the conversation summary: {str(e)}")
+        return ConversationMemory()
+    if not memory_details:
+        return ConversationMemory()
+    return ConversationMemory(summary=memory_details.summary, summarized_count=memory_details.summarized_count)
@@ -0,0 +1,255 @@
+"""
+Chat persistence: one transaction per /chat-with-doc turn across chat_history and selected_chat.
+
+A turn carries the context the user selected plus the new question and answer. It is stored in
+selected_chat with the conversation summary and never goes to chat_messages. The client saves the
+whole conversation through /chat, which appends to chat_messages.
+
+Modes (CHAT_PERSISTENCE_MODE):
+
+- "sync" (default): the turn is committed before the response finishes. Once the request returns the
+  turn is durable.
+- "write_behind": turns are buffered in process and written every CHAT_WRITE_BEHIND_FLUSH_MS, or as
+  soon as CHAT_WRITE_BEHIND_MAX_BATCH turns are waiting. All buffered turns of all users go out as bulk
+  statements in a single transaction.
+
+  Durability: a turn is acknowledged BEFORE it is written. Turns still in the buffer when the process
+  dies (crash, OOM kill, SIGKILL) are lost, at most one flush interval of turns per worker. A graceful
+  shutdown waits for a running flush and writes what is left in the buffer from the app lifespan. When
+  a batch fails, its turns are retried one by one in their own transactions. A turn that still fails
+  goes back into the buffer for the next flush, and is logged and dropped after
+  CHAT_WRITE_BEHIND_MAX_RETRIES failed flushes. Buffered turns are only visible to the worker that holds them. load_memory reads the pending summary of that worker, and
+  other workers see the turn after the flush.
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update, insert as core_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+from config import settings
+from utils.chat_cache import chat_cache
+from utils.db_router import read_router
+from utils.chat_history import get_chat_memory
+from utils.conversation_memory import ConversationMemory
+from utils.search import index_entries, chat_title_entry
+from utils.logger import logger
+
+
+def _merge(pending:Dict, turn:Dict) -> Dict:
+    """
+    later turn of the same chat wins, its selected context and the summary counted over it belong
+    together, keys only the pending turn has are kept
+    """
+    return dict(pending, **turn)
+
+
+async def write_turns(turns:List[Dict], db:AsyncSession):
+    """
+    writes the turns with bulk statements, callers commit
+
+    Args:
+    turns: [{chat_history_id, user_id, document_id, title, message: [{role, content, timestamp}], summary, summarized_count}],
+           at most one turn per chat_history_id, message is the selected context with the new question and answer
+    db: AsyncSession
+    """
+    if not turns:
+        return
+    now = datetime.now(timezone.utc)
+    chat_ids = [turn["chat_history_id"] for turn in turns]
+
+    chats = {row.chat_history_id: row for row in (await db.execute(
+        select(models.ChatHistory.chat_history_id, models.ChatHistory.user_id, models.ChatHistory.active_tag).where(models.ChatHistory.chat_history_id.in_(chat_ids))
+    )).all()}
+    #a chat id of another user, or of a deleted chat, is not written to
+    owners = {turn["chat_history_id"]: turn["user_id"] for turn in turns}
+    rejected = sorted(chat_id for chat_id, chat in chats.items() if not chat.active_tag or chat.user_id != owners[chat_id])
+    if rejected:
+        logger.warning(f"skipping turns of deleted or foreign chats: {', '.join(rejected)}")
+        turns = [turn for turn in turns if turn["chat_history_id"] not in rejected]
+        chat_ids = [turn["chat_history_id"] for turn in turns]
+        if not turns:
+            return
+    existing_chats = set(chats)
+    missing = [chat_id for chat_id in chat_ids if chat_id not in existing_chats]
+    if missing:
+        #a late turn of a deleted and archived chat must not bring it back
+        archived = set((await db.execute(select(models.ChatHistoryArchive.chat_history_id).where(models.ChatHistoryArchive.chat_history_id.in_(missing)))).scalars())
+        if archived:
+            logger.warning(f"skipping turns of archived chats: {', '.join(sorted(archived))}")
+            turns = [turn for turn in turns if turn["chat_history_id"] not in archived]
+            chat_ids = [turn["chat_history_id"] for turn in turns]
+            if not turns:
+                return
+    new_chats = [turn for turn in turns if turn["chat_history_id"] not in existing_chats]
+    if new_chats:
+        await db.execute(core_insert(models.ChatHistory), [
+            {"chat_history_id": turn["chat_history_id"], "user_id": turn["user_id"], "document_id": turn["document_id"], "title": turn.get("title"), "active_tag": True}
+            for turn in new_chats
+        ])
+    existing = [turn for turn in turns if turn["chat_history_id"] in existing_chats]
+    if existing:
+        await db.execute(update(models.ChatHistory), [
+            {"chat_history_id": turn["chat_history_id"], "modified_at": now, **({"title": turn["title"]} if turn.get("title") else {})}
+            for turn in existing
+        ])
+
+    selected = dict((await db.execute(
+        select(models.SelectedChat.chat_history_id, models.SelectedChat.selected_chat_id).where(models.SelectedChat.chat_history_id.in_(chat_ids))
+    )).all())
+    selected_updates = []
+    selected_inserts = []
+    for turn in turns:
+        values = {"modified_at": now, "title": turn.get("title") or "", "message": turn.get("message")}
+        if "summary" in turn:
+            values["summary"] = turn["summary"]
+            values["summarized_count"] = turn.get("summarized_count") or 0
+        if turn["chat_history_id"] in selected:
+            selected_updates.append({"selected_chat_id": selected[turn["chat_history_id"]], **values})
+        else:
+            selected_inserts.append({"chat_history_id": turn["chat_history_id"], "document_id": turn["document_id"], "user_id": turn["user_id"], **values})
+    if selected_updates:
+        await db.execute(update(models.SelectedChat), selected_updates)
+    if selected_inserts:
+        await db.execute(core_insert(models.SelectedChat), selected_inserts)
+
+    await index_entries([chat_title_entry(turn["user_id"], turn["document_id"], turn["chat_history_id"], turn["title"]) for turn in turns if turn.get("title")], db)
+
+
+class ChatPersistence:
+    """Saves chat turns synchronously or write-behind, see the module docstring for the durability of each mode"""
+    def __init__(self, mode:str=None):
+        self.mode = mode or settings.CHAT_PERSISTENCE_MODE
+        self._pending: Dict[str, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        #failed flushes per chat_history_id of the turns waiting for a retry
+        self._failures: Dict[str, int] = {}
+
+    @property
+    def write_behind(self) -> bool:
+        return self.mode == "write_behind"
+
+    async def save_turn(self, turn:Dict, db:AsyncSession=None):
+        """
+        persists one turn of a conversation
+
+        Args:
+        turn: Dict, chat_context of /chat-with-doc with the assistant answer appended
+        db: AsyncSession, used in sync mode, a new session is opened when missing
+        """
+        if not turn.get("chat_history_id"):
+            logger.warning(f"chat turn of user {turn.get('user_id')} has no chat_history_id, not saved")
+            return
+        turn = {key: value for key, value in turn.items() if key in ("chat_history_id", "user_id", "document_id", "title", "message", "summary", "summarized_count")}
+        if self.write_behind:
+            chat_history_id = turn["chat_history_id"]
+            self._pending[chat_history_id] = _merge(self._pending[chat_history_id], turn) if chat_history_id in self._pending else turn
+            if len(self._pending) >= settings.CHAT_WRITE_BEHIND_MAX_BATCH:
+                self._wakeup.set()
+            return
+        try:
+            await self._write([turn], db)
+        except Exception:
+            #already logged, a failed save must not fail the answer that was generated
+            return
+        await chat_cache.invalidate(turn.get("user_id"), turn["chat_history_id"])
+        await read_router.record_write(turn.get("user_id"))
+
+    @staticmethod
+    async def _write(turns:List[Dict], db:AsyncSession=None):
+        if db is None:
+            async with models.async_sessionlocal() as db:
+                return await ChatPersistence._write(turns, db)
+        try:
+            await write_turns(turns, db)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error in saving {len(turns)} chat turns: {str(e)}")
+            raise
+
+    @classmethod
+    async def _write_batch(cls, turns:List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """writes the turns, returns (saved, failed)"""
+        try:
+            await cls._write(turns)
+            return turns, []
+        except Exception:
+            if len(turns) == 1:
+                return [], turns
+        saved = []
+        failed = []
+        for turn in turns:
+            try:
+                await cls._write([turn])
+                saved.append(turn)
+            except Exception:
+                failed.append(turn)
+        return saved, failed
+
+    def _requeue(self, turn:Dict):
+        """puts a turn that failed to write back into the buffer, drops it after CHAT_WRITE_BEHIND_MAX_RETRIES failures"""
+        chat_history_id = turn["chat_history_id"]
+        failures = self._failures.get(chat_history_id, 0) + 1
+        if failures > settings.CHAT_WRITE_BEHIND_MAX_RETRIES:
+            self._failures.pop(chat_history_id, None)
+            logger.error(f"dropping chat turn of {chat_history_id} after {failures} failed writes")
+            return
+        self._failures[chat_history_id] = failures
+        #a turn of the same chat buffered while this one was written is newer
+        newer = self._pending.get(chat_history_id)
+        self._pending[chat_history_id] = _merge(turn, newer) if newer else turn
+        logger.warning(f"chat turn of {chat_history_id} not written, retry {failures}/{settings.CHAT_WRITE_BEHIND_MAX_RETRIES} with the next flush")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        turns = list(self._pending.values())
+        self._pending = {}
+        saved, failed = await self._write_batch(turns)
+        logger.info(f"flushed {len(saved)} of {len(turns)} chat turns")
+        for turn in failed:
+            self._requeue(turn)
+        for turn in saved:
+            self._failures.pop(turn["chat_history_id"], None)
+            await chat_cache.invalidate(turn.get("user_id"), turn["chat_history_id"])
+            await read_router.record_write(turn.get("user_id"))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.CHAT_WRITE_BEHIND_FLUSH_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"chat write-behind flush failed: {str(e)}")
+
+    def start(self):
+        if self.write_behind and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """lets a running flush finish, then writes the buffer until it is empty or its turns ran out of retries"""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    async def load_memory(self, chat_history_id:str, user_id:str, db:AsyncSession) -> ConversationMemory:
+        """conversation summary of the user's chat, including a turn of this worker that is not flushed yet"""
+        pending = self._pending.get(chat_history_id) if chat_history_id else None
+        if pending and "summary" in pending and pending["user_id"] == user_id:
+            return ConversationMemory(summary=pending["summary"], summarized_count=pending.get("summarized_count") or 0)
+        return await get_chat_memory(chat_history_id=chat_history_id, user_id=user_id, db=db)
+
+
+chat_persistence = ChatPersistence()
@@ -0,0 +1,32 @@
+from typing import Optional
+from config import settings
+from utils.logger import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if settings.CHAT_MESSAGE_COMPRESSION == "zstd" and zstandard is None:
+    logger.warning("CHAT_MESSAGE_COMPRESSION=zstd but the zstandard package is not installed, messages are stored uncompressed")
+
+
+def compress_text(content:str) -> Optional[bytes]:
+    """
+    zstd frame of the text when compression is enabled and the text is at least CHAT_MESSAGE_COMPRESS_MIN_BYTES,
+    None when it should be stored as plain text
+    """
+    if settings.CHAT_MESSAGE_COMPRESSION != "zstd" or zstandard is None:
+        return None
+    data = content.encode("utf-8")
+    if len(data) < settings.CHAT_MESSAGE_COMPRESS_MIN_BYTES:
+        return None
+    compressed = zstandard.ZstdCompressor(level=settings.CHAT_MESSAGE_ZSTD_LEVEL).compress(data)
+    #incompressible text is kept as plain text
+    return compressed if len(compressed) < len(data) else None
+
+
+def decompress_text(data:bytes) -> str:
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read compressed chat messages")
+    return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
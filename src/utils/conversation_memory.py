@@ -0,0 +1,106 @@
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional
+import tiktoken
+from config import settings
+from utils.logger import logger
+
+#per message overhead the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """loaded on the first count, not at import, tiktoken downloads the encoding file on a cold cache"""
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        #fall back to the ~4 chars per token estimate when offline
+        logger.warning(f"tiktoken encoding not available, using character estimate for token counts: {str(e)}")
+        return None
+
+
+def count_tokens(text:str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message:Dict) -> int:
+    return count_tokens(str(message.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationMemory:
+    """
+    Keeps the prompt for chat_with_doc inside a fixed token budget.
+
+    The most recent turns are sent verbatim, everything older is folded into a rolling summary
+    which is stored with the selected chat. `summarized_count` is the number of leading messages
+    already covered by the summary, so each fold only sends the messages that fell out of the
+    window since the last one.
+
+    Args:
+    summary: str, stored rolling summary of the conversation
+    summarized_count: int, number of messages already folded into the summary
+    token_budget: int, max tokens for summary + recent turns + latest user question
+    summary_tokens: int, max tokens the summary is allowed to grow to
+    """
+    def __init__(self, summary:Optional[str]=None, summarized_count:int=0, token_budget:int=None, summary_tokens:int=None):
+        self.summary = summary or ""
+        self.summarized_count = summarized_count or 0
+        self.token_budget = token_budget or settings.CHAT_MEMORY_TOKEN_BUDGET
+        self.summary_tokens = summary_tokens or settings.CHAT_MEMORY_SUMMARY_TOKENS
+
+    def _split(self, history:List[Dict], budget:int) -> tuple[List[Dict], List[Dict]]:
+        """Split unsummarized history into (older turns to fold, recent turns that fit in budget)"""
+        pending = history[self.summarized_count:]
+        used = 0
+        keep_from = len(pending)
+        for index in range(len(pending) - 1, -1, -1):
+            cost = message_tokens(pending[index])
+            if used + cost > budget:
+                break
+            used += cost
+            keep_from = index
+        return pending[:keep_from], pending[keep_from:]
+
+    async def prepare(self, messages:List[Dict], summarizer:Callable[[str, List[Dict], int], Awaitable[str]]) -> Dict:
+        """
+        Build the chat inputs for the latest user message, folding old turns into the summary when needed
+
+        Args:
+        messages: List[dict], full conversation with the latest user message last
+        summarizer: async callable(summary, messages, max_tokens) -> updated summary
+
+        Returns:
+        Dict: {"conversation_summary": str, "chat_context": List[dict], "user_chat": str}
+        """
+        history = messages[:-1]
+        user_chat = messages[-1]["content"]
+
+        if self.summarized_count > len(history):
+            #selected context no longer matches the stored summary, start again
+            logger.info(f"conversation memory reset, summarized_count: {self.summarized_count}, history: {len(history)}")
+            self.summary = ""
+            self.summarized_count = 0
+
+        budget = self.token_budget - self.summary_tokens - count_tokens(user_chat)
+        to_fold, recent = self._split(history, budget)
+
+        if to_fold:
+            #fold down to half the budget so the next few turns fit without another summary call
+            to_fold, recent = self._split(history, budget // 2)
+            logger.info(f"folding {len(to_fold)} messages into conversation summary")
+            self.summary = await summarizer(self.summary, to_fold, self.summary_tokens)
+            self.summarized_count += len(to_fold)
+
+        return {
+            "conversation_summary": self.summary,
+            "chat_context": recent,
+            "user_chat": user_chat,
+        }
+
+    def state(self) -> Dict:
+        return {"summary": self.summary or None, "summarized_count": self.summarized_count}
@@ -0,0 +1,173 @@
+"""
+Connection pool settings and metrics for the sync and async engines.
+
+DB_POOL_MODE:
+
+- "queue" (default): the app keeps DB_POOL_SIZE connections per engine and worker, and opens up to
+  DB_MAX_OVERFLOW more under load. A request that finds none free waits up to DB_POOL_TIMEOUT seconds,
+  then fails with a pool timeout. Connections are tested before use (DB_POOL_PRE_PING) and replaced
+  after DB_POOL_RECYCLE seconds, so connections that were dropped by Postgres or a load balancer are
+  not handed out.
+- "transaction_pooler": for PgBouncer / Supavisor in transaction mode. The pooler owns the
+  connections, so the app opens one per checkout and closes it on return (NullPool). Server side
+  prepared statements don't survive a transaction on a shared backend, so the asyncpg statement caches
+  are turned off.
+
+Every engine gets a PoolMetrics: checkout wait times, connections in use, overflow connections and
+pool timeouts, served by /db/pool.
+"""
+import time
+from collections import deque
+from typing import Dict
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from config import settings
+from utils.logger import logger
+
+#checkout waits kept for the percentiles
+WAIT_SAMPLES = 2048
+
+
+class PoolMetrics:
+    def __init__(self, name:str):
+        self.name = name
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.overflow_opened = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record_wait(self, wait_ms:float):
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self._waits.append(wait_ms)
+
+    def on_checkout(self, *args):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, *args):
+        self.in_use = max(self.in_use - 1, 0)
+
+    def on_connect(self, *args):
+        self.connects += 1
+
+    def on_invalidate(self, *args):
+        self.invalidated += 1
+
+    def _percentile(self, waits:list, fraction:float) -> float:
+        return round(waits[min(int(len(waits) * fraction), len(waits) - 1)], 3) if waits else None
+
+    def stats(self, pool) -> Dict:
+        waits = sorted(self._waits)
+        report = {
+            "mode": settings.DB_POOL_MODE,
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "connects": self.connects,
+            "invalidated": self.invalidated,
+            "overflow_opened": self.overflow_opened,
+            "timeouts": self.timeouts,
+            "wait_ms": {
+                "avg": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else None,
+                "p50": self._percentile(waits, 0.5),
+                "p95": self._percentile(waits, 0.95),
+                "p99": self._percentile(waits, 0.99),
+                "max": round(self.max_wait_ms, 3),
+            },
+        }
+        if isinstance(pool, QueuePool):
+            report.update({"size": pool.size(), "idle": pool.checkedin(), "overflow": max(pool.overflow(), 0), "max_overflow": settings.DB_MAX_OVERFLOW})
+        return report
+
+
+class _TimedPool:
+    """times how long a checkout waits for a connection, the checkout event only fires once it has one"""
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        overflow = self.overflow() if isinstance(self, QueuePool) else 0
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.timeouts += 1
+                logger.error(f"{self.metrics.name} database pool timed out after {settings.DB_POOL_TIMEOUT}s: {self.status()}")
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait((time.perf_counter() - started) * 1000)
+            if isinstance(self, QueuePool) and self.overflow() > max(overflow, 0):
+                self.metrics.overflow_opened += 1
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedNullPool(_TimedPool, NullPool):
+    pass
+
+
+def engine_options(is_async:bool=False) -> Dict:
+    """
+    create_engine / create_async_engine keyword arguments for DB_POOL_MODE
+
+    Args:
+    is_async: bool, options for the asyncpg engine
+
+    Returns:
+    Dict: pool class and pool settings
+    """
+    if settings.DB_POOL_MODE == "transaction_pooler":
+        options = {"poolclass": TimedNullPool}
+        if is_async:
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        return options
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def instrument(engine, name:str) -> PoolMetrics:
+    """attaches a PoolMetrics to the pool of a sync engine (the .sync_engine of an async one)"""
+    metrics = PoolMetrics(name)
+    engine.pool.metrics = metrics
+    event.listen(engine, "checkout", metrics.on_checkout)
+    event.listen(engine, "checkin", metrics.on_checkin)
+    event.listen(engine, "connect", metrics.on_connect)
+    event.listen(engine, "invalidate", metrics.on_invalidate)
+    return metrics
+
+
+def pool_stats(engines:Dict) -> Dict:
+    """
+    Args:
+    engines: Dict, name -> sync engine
+
+    Returns:
+    Dict: PoolMetrics.stats per engine
+    """
+    return {name: engine.pool.metrics.stats(engine.pool) if engine.pool.metrics else None for name, engine in engines.items()}
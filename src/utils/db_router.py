@@ -0,0 +1,167 @@
+"""
+Routes the sessions of read-only endpoints to read replicas.
+
+- ASYNC_DATABASE_REPLICA_URLS: comma separated asyncpg URLs of the replicas. Without replicas every
+  session goes to the primary and nothing below runs.
+- Lag: at most every REPLICA_LAG_CHECK_SECONDS per replica and worker, the router asks the replica
+  how far its replay is behind. A replica more than REPLICA_MAX_LAG_SECONDS behind, or one that doesn't
+  answer, gets no reads until a later check finds it caught up. Healthy replicas take reads round
+  robin, and reads go to the primary when none qualifies.
+- Read-your-writes: record_write(user_id) after a commit sends the reads of that user to the primary
+  for READ_YOUR_WRITES_SECONDS, so a chat that was just saved is never missing from the list that is
+  loaded next. Kept in process and, with Redis attached, in Redis for the other workers. The window
+  has to be longer than REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_SECONDS, a replica that may not
+  have replayed the write yet is never used inside it.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+from cachetools import TTLCache
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+import models
+from config import settings
+from utils.logger import logger
+
+#replay lag in seconds, 0 when everything received is replayed (an idle primary sends nothing to replay)
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 1e9)
+END
+"""
+#users with a write inside the window, per worker
+MAX_TRACKED_WRITERS = 100_000
+
+
+class Replica:
+    def __init__(self, name:str, engine):
+        self.name = name
+        self.engine = engine
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self.checked_at = 0.0
+        self.reads = 0
+        self._lock = asyncio.Lock()
+
+    async def check(self):
+        """refreshes lag and health when the last check is older than REPLICA_LAG_CHECK_SECONDS"""
+        if time.monotonic() - self.checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+            return
+        async with self._lock:
+            if time.monotonic() - self.checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+                return
+            try:
+                async with self.engine.connect() as connection:
+                    self.lag = float((await connection.execute(text(REPLICA_LAG_QUERY))).scalar())
+                healthy = self.lag <= settings.REPLICA_MAX_LAG_SECONDS
+            except Exception as e:
+                logger.warning(f"replica {self.name} unavailable, reading from the primary: {str(e)}")
+                self.lag = None
+                healthy = False
+            if healthy != self.healthy:
+                logger.info(f"replica {self.name} {'takes reads again' if healthy else 'is out of rotation'}, lag {self.lag}")
+            self.healthy = healthy
+            self.checked_at = time.monotonic()
+
+    def fail(self):
+        """takes the replica out of rotation until the next check"""
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+class ReadRouter:
+    def __init__(self, engines:List):
+        self.replicas = [Replica(f"replica{index}", engine) for index, engine in enumerate(engines)]
+        self.redis = None
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        self._next = 0
+        self._writes = TTLCache(maxsize=MAX_TRACKED_WRITERS, ttl=settings.READ_YOUR_WRITES_SECONDS)
+        self._sessionmaker = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+    def attach(self, redis):
+        self.redis = redis
+
+    @staticmethod
+    def _write_key(user_id:str) -> str:
+        return f"db_router:wrote:{user_id}"
+
+    async def record_write(self, user_id:str):
+        """call after a commit of the user, the reads of the user stay on the primary for READ_YOUR_WRITES_SECONDS"""
+        if not self.replicas or not user_id:
+            return
+        self._writes[user_id] = True
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._write_key(user_id), 1, ex=max(int(settings.READ_YOUR_WRITES_SECONDS), 1))
+            except Exception as e:
+                logger.warning(f"unable to share the write of user {user_id} with other workers: {str(e)}")
+
+    async def _wrote_recently(self, user_id:str) -> bool:
+        if user_id in self._writes:
+            return True
+        if self.redis is None:
+            return False
+        try:
+            return bool(await self.redis.exists(self._write_key(user_id)))
+        except Exception as e:
+            #without the shared marker a replica could miss the write, stay on the primary
+            logger.warning(f"read-your-writes marker unavailable, reading from the primary: {str(e)}")
+            return True
+
+    async def pick(self, user_id:str=None) -> Optional[Replica]:
+        """replica for the next read of the user, None for the primary"""
+        if not self.replicas:
+            return None
+        if user_id and await self._wrote_recently(user_id):
+            self.sticky_reads += 1
+            return None
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next]
+
+    @asynccontextmanager
+    async def session(self, user_id:str=None) -> AsyncIterator[AsyncSession]:
+        """
+        session for read-only work, on a replica when one is healthy and the user has no recent write
+
+        Args:
+        user_id: str, user the reads are made for, None skips read-your-writes
+        """
+        replica = await self.pick(user_id)
+        if replica is None:
+            self.primary_reads += 1
+            async with models.async_sessionlocal() as db:
+                yield db
+            return
+        replica.reads += 1
+        async with self._sessionmaker(bind=replica.engine) as db:
+            try:
+                yield db
+            except DBAPIError as e:
+                if e.connection_invalidated:
+                    replica.fail()
+                raise
+            except OSError:
+                replica.fail()
+                raise
+
+    def stats(self) -> Dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "replicas": [
+                {"name": replica.name, "healthy": replica.healthy, "lag_seconds": replica.lag, "reads": replica.reads}
+                for replica in self.replicas
+            ],
+        }
+
+
+read_router = ReadRouter(models.replica_engines)
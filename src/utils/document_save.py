@@ -47,8 +47,37 @@ def upload_document_s3(s3_client, file_obj, current_document_path, content_type,
         logger.error(f"something went wrong while uploading to s3: {str(e)}")
         raise 
 
-def get_document_s3(s3_client):
-    raise NotImplementedError
+def open_document_s3(s3_client, document_path, bucket_name):
+    """streaming body of a stored object, None when the key doesn't exist"""
+    try:
+        return s3_client.get_object(Bucket=bucket_name, Key=document_path)["Body"]
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    except Exception as e:
+        logger.error(f"something went wrong while reading from s3: {str(e)}")
+        raise
+
+def document_exists_s3(s3_client, document_path, bucket_name):
+    """whether the key exists, checked with HEAD so the object isn't downloaded"""
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=document_path)
+        return True
+    except s3_client.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return False
+        logger.error(f"something went wrong while reading from s3: {str(e)}")
+        raise
+
+def get_document_s3(s3_client, document_path, bucket_name):
+    """content of a stored object, None when the key doesn't exist"""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=document_path)
+        return response["Body"].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    except Exception as e:
+        logger.error(f"something went wrong while reading from s3: {str(e)}")
+        raise
 
 
     
@@ -0,0 +1,23 @@
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+#tags of the request an LLM call is made for, read by the governor (fairness) and usage accounting
+llm_call_context: ContextVar[Dict[str, Optional[str]]] = ContextVar("llm_call_context", default={})
+
+
+def set_llm_context(**tags:Optional[str]):
+    """
+    Tag every LLM call made from the current task onwards
+
+    Args:
+    user_id: str,
+    document_id: str,
+    task_id: str,
+    """
+    current = dict(llm_call_context.get())
+    current.update({key: value for key, value in tags.items() if value is not None})
+    llm_call_context.set(current)
+
+
+def get_llm_context() -> Dict[str, Optional[str]]:
+    return llm_call_context.get()
@@ -0,0 +1,276 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+from config import settings
+from utils.llm_context import get_llm_context
+from utils.logger import logger
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Atomic refill + take, returns the seconds to wait when the bucket doesn't hold `cost` yet (nothing is taken then)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) * 2 + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket holding `capacity` units refilled at `capacity / period` per second.
+
+    Shared across workers through Redis when a client is attached, per process otherwise
+    (or when Redis is unreachable, so a Redis outage degrades to local limits instead of failing calls).
+    """
+    def __init__(self, name:str, capacity:int, period:float=60.0):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.redis = None
+        self._script = None
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def attach(self, redis):
+        self.redis = redis
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT) if redis is not None else None
+
+    def _take_local(self, cost:float) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return 0.0
+        return (cost - self._tokens) / self.rate
+
+    async def _take(self, cost:float) -> float:
+        if self._script is not None:
+            try:
+                return float(await self._script(keys=[f"llm_governor:bucket:{self.name}"], args=[self.capacity, self.rate, cost]))
+            except Exception as e:
+                logger.warning(f"redis token bucket {self.name} unavailable, using local bucket: {str(e)}")
+        return self._take_local(cost)
+
+    async def acquire(self, cost:float):
+        cost = min(cost, self.capacity)
+        while True:
+            wait = await self._take(cost)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class FairLimiter:
+    """
+    Concurrency limiter that serves waiting callers round robin by key, so one user uploading a
+    large deck can't starve everybody else. The limit is a float so AIMD can adjust it in small steps.
+    """
+    def __init__(self, limit:float):
+        self.limit = limit
+        self.active = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, key:str):
+        if self.active < int(self.limit) and not self._waiting():
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                #slot was handed over right before the cancel, give it back
+                self.release()
+            else:
+                queue = self._queues.get(key)
+                if queue and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._queues[key]
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        while self._queues and self.active < max(int(self.limit), 1):
+            key, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                #key goes to the back of the line after each grant
+                self._queues[key] = queue
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+
+class LLMGovernor:
+    """
+    Single entry point for LLM calls.
+
+    - request and token per minute budgets as token buckets, shared across workers through Redis
+    - fair queueing by user_id (from utils.llm_context) behind an adaptive concurrency limit
+    - AIMD: the limit grows by 1/limit after every call under LLM_TARGET_LATENCY_MS, shrinks by 10%
+      after a slow call and halves after a 429. The limit is per process on purpose: it adapts to the
+      latency this worker observes, the provider wide budgets are the shared buckets and the shared
+      429 cooldown, so N workers run at most N times the limit within those budgets
+    - retries of 429 / 5xx / timeouts with full jitter exponential backoff; a 429 also sets a shared
+      cooldown in Redis that pauses every worker until it expires
+    """
+    def __init__(self):
+        self.requests = TokenBucket("requests", settings.LLM_REQUESTS_PER_MINUTE)
+        self.tokens = TokenBucket("tokens", settings.LLM_TOKENS_PER_MINUTE)
+        self.limiter = FairLimiter(settings.LLM_INITIAL_CONCURRENCY)
+        self.min_concurrency = settings.LLM_MIN_CONCURRENCY
+        self.max_concurrency = settings.LLM_MAX_CONCURRENCY
+        self.target_latency = settings.LLM_TARGET_LATENCY_MS / 1000
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.redis = None
+
+    def attach(self, redis):
+        """Share budgets and cooldowns across workers, called from the app lifespan"""
+        self.redis = redis
+        self.requests.attach(redis)
+        self.tokens.attach(redis)
+
+    def _on_success(self, latency:float):
+        if latency > self.target_latency:
+            self.limiter.limit = max(self.min_concurrency, self.limiter.limit * 0.9)
+        else:
+            self.limiter.limit = min(self.max_concurrency, self.limiter.limit + 1 / self.limiter.limit)
+            self.limiter.wake()
+
+    def _on_rate_limited(self):
+        self.limiter.limit = max(self.min_concurrency, self.limiter.limit / 2)
+        logger.warning(f"LLM provider rate limited, concurrency limit lowered to {self.limiter.limit:.2f}")
+
+    async def _cooldown(self):
+        if self.redis is None:
+            return
+        try:
+            remaining = await self.redis.pttl("llm_governor:cooldown")
+        except Exception:
+            return
+        if remaining and remaining > 0:
+            await asyncio.sleep(remaining / 1000)
+
+    async def _set_cooldown(self, seconds:float):
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set("llm_governor:cooldown", 1, px=max(int(seconds * 1000), 1), nx=True)
+        except Exception as e:
+            logger.warning(f"unable to share LLM cooldown: {str(e)}")
+
+    @asynccontextmanager
+    async def limit(self, estimated_tokens:int=0):
+        """Hold a budgeted, fairly queued slot for one LLM call"""
+        key = get_llm_context().get("user_id") or "anonymous"
+        await self._cooldown()
+        await self.requests.acquire(1)
+        if estimated_tokens:
+            await self.tokens.acquire(estimated_tokens)
+        await self.limiter.acquire(key)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if status_code(e) == 429:
+                self._on_rate_limited()
+            raise
+        else:
+            self._on_success(time.perf_counter() - started)
+        finally:
+            self.limiter.release()
+
+    def backoff(self, attempt:int, error:Exception) -> float:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(settings.LLM_BACKOFF_MAX_SECONDS, settings.LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    async def run(self, call:Callable[[], Awaitable[Any]], estimated_tokens:int=0) -> Any:
+        """
+        Run an LLM call under the governor, retrying transient failures
+
+        Args:
+        call: callable returning a fresh awaitable for every attempt
+        estimated_tokens: int, prompt + expected completion tokens charged to the token budget
+
+        Returns:
+        result of the call
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self.limit(estimated_tokens):
+                    return await call()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e)
+                if status_code(e) == 429:
+                    await self._set_cooldown(delay)
+                attempt += 1
+                logger.warning(f"LLM call failed ({type(e).__name__}: {status_code(e)}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "active": self.limiter.active,
+            "waiting": self.limiter._waiting(),
+            "shared": self.redis is not None,
+        }
+
+
+def status_code(error:Exception) -> Optional[int]:
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retryable(error:Exception) -> bool:
+    if status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    #openai.APITimeoutError / APIConnectionError and plain network timeouts carry no status code
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)) or type(error).__name__ in {"APITimeoutError", "APIConnectionError"}
+
+
+def retry_after_seconds(error:Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+governor = LLMGovernor()
@@ -0,0 +1,220 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+from config import settings
+from utils.llm_context import get_llm_context
+from utils.logger import logger
+
+# USD per 1M tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+USAGE_GROUP_COLUMNS = {
+    "user_id": models.LLMUsage.user_id,
+    "document_id": models.LLMUsage.document_id,
+    "task_id": models.LLMUsage.task_id,
+    "stage": models.LLMUsage.stage,
+    "model": models.LLMUsage.model,
+}
+
+
+def usage_cost(model:Optional[str], prompt_tokens:int, completion_tokens:int, cached_tokens:int) -> float:
+    prices = next((price for name, price in sorted(MODEL_PRICES.items(), key=lambda item: -len(item[0])) if model and model.startswith(name)), None)
+    if not prices:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+class UsageRecorder:
+    """
+    Buffers usage records and writes them with one bulk insert every LLM_USAGE_FLUSH_SECONDS
+    (or as soon as LLM_USAGE_BATCH_SIZE records are waiting).
+
+    Usage is for reporting only and recorded best effort: records still buffered when the process is
+    killed are lost. A failed insert puts its records back into the buffer, after LLM_USAGE_MAX_RETRIES
+    failed flushes in a row they are logged and dropped. A graceful shutdown waits for a running flush
+    and writes what is left.
+    """
+    def __init__(self):
+        self._buffer: List[Dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._failures = 0
+
+    def record(self, **usage:Any):
+        self._buffer.append(usage)
+        if len(self._buffer) >= settings.LLM_USAGE_BATCH_SIZE:
+            self._wakeup.set()
+
+    @staticmethod
+    async def _write(records:List[Dict]):
+        async with models.async_sessionlocal() as db:
+            try:
+                await db.execute(insert(models.LLMUsage), records)
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"unable to save {len(records)} llm usage records: {str(e)}")
+                raise
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        try:
+            await self._write(records)
+        except Exception:
+            self._failures += 1
+            if self._failures > settings.LLM_USAGE_MAX_RETRIES:
+                logger.error(f"dropping {len(records)} llm usage records after {self._failures} failed flushes")
+                self._failures = 0
+            else:
+                #older records go first, records added meanwhile stay behind them
+                self._buffer = records + self._buffer
+            return
+        self._failures = 0
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.LLM_USAGE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """lets a running flush finish, then writes the buffer until it is empty or ran out of retries"""
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._buffer:
+            await self.flush()
+
+
+usage_recorder = UsageRecorder()
+
+
+class UsageCallbackHandler(AsyncCallbackHandler):
+    """
+    Records tokens, latency, model and prompt cache status of every chat model call it is attached to.
+    The request tags (user_id, document_id, task_id) are captured when the handler is created.
+
+    Args:
+    stage: str, pipeline stage the calls belong to (analyze_input, chat_with_doc, summarize_image ...)
+    """
+    def __init__(self, stage:str):
+        self.stage = stage
+        self.tags = dict(get_llm_context())
+        self._started: Dict[UUID, float] = {}
+
+    async def on_chat_model_start(self, serialized:Dict[str, Any], messages:List[List[Any]], *, run_id:UUID, **kwargs:Any):
+        self._started[run_id] = time.perf_counter()
+
+    def _record(self, run_id:UUID, status:str, model:Optional[str]=None, usage:Optional[Dict]=None):
+        started = self._started.pop(run_id, None)
+        usage = usage or {}
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        usage_recorder.record(
+            user_id=self.tags.get("user_id"),
+            document_id=self.tags.get("document_id"),
+            task_id=self.tags.get("task_id"),
+            stage=self.stage,
+            model=model,
+            status=status,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            cache_status="hit" if cached_tokens else "miss",
+            latency_ms=int((time.perf_counter() - started) * 1000) if started else 0,
+            cost_usd=usage_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+        )
+
+    async def on_llm_end(self, response:LLMResult, *, run_id:UUID, **kwargs:Any):
+        usage = None
+        model = None
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        message = getattr(generation, "message", None)
+        if message is not None:
+            usage = getattr(message, "usage_metadata", None)
+            model = (message.response_metadata or {}).get("model_name")
+        if usage is None and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            usage = {"input_tokens": token_usage.get("prompt_tokens", 0), "output_tokens": token_usage.get("completion_tokens", 0)}
+        if model is None and response.llm_output:
+            model = response.llm_output.get("model_name")
+        self._record(run_id, "ok", model=model, usage=usage)
+
+    async def on_llm_error(self, error:BaseException, *, run_id:UUID, **kwargs:Any):
+        self._record(run_id, "error")
+
+
+def usage_config(stage:str) -> Dict:
+    """Runnable config that records the usage of the calls under the given stage"""
+    return {"callbacks": [UsageCallbackHandler(stage=stage)], "run_name": stage}
+
+
+async def get_usage_summary(db:AsyncSession, group_by:str="stage", user_id:str=None, since:datetime=None) -> List[Dict]:
+    """
+    rolls up llm usage for capacity planning
+
+    Args:
+    group_by: str, one of user_id, document_id, task_id, stage, model
+    user_id: str, limit the rollup to one user
+    since: datetime, only count calls after this time
+
+    Returns:
+    List[Dict]: calls, errors, tokens, cost and latency per group, most expensive first
+    """
+    group_column = USAGE_GROUP_COLUMNS[group_by]
+    usage = models.LLMUsage
+    query = select(
+        group_column.label("key"),
+        func.count().label("calls"),
+        func.count().filter(usage.status == "error").label("errors"),
+        func.coalesce(func.sum(usage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(usage.completion_tokens), 0).label("completion_tokens"),
+        func.coalesce(func.sum(usage.cached_tokens), 0).label("cached_tokens"),
+        func.coalesce(func.sum(usage.cost_usd), 0).label("cost_usd"),
+        func.avg(usage.latency_ms).label("avg_latency_ms"),
+        func.percentile_cont(0.95).within_group(usage.latency_ms).label("p95_latency_ms"),
+    ).group_by(group_column)
+    if user_id:
+        query = query.where(usage.user_id == user_id)
+    if since:
+        query = query.where(usage.created_at >= since)
+    rows = (await db.execute(query.order_by(func.sum(usage.cost_usd).desc()))).all()
+    return [
+        {
+            group_by: row.key,
+            "calls": row.calls,
+            "errors": row.errors,
+            "prompt_tokens": row.prompt_tokens,
+            "completion_tokens": row.completion_tokens,
+            "cached_tokens": row.cached_tokens,
+            "cost_usd": round(row.cost_usd, 6),
+            "avg_latency_ms": round(float(row.avg_latency_ms or 0), 1),
+            "p95_latency_ms": round(row.p95_latency_ms or 0, 1),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,20 @@
+import base64
+import json
+from typing import Any, List
+from fastapi import HTTPException, status
+
+
+def encode_cursor(*values:Any) -> str:
+    """opaque cursor of the sort key of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(list(values), default=str).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor:str, size:int) -> List[Any]:
+    """sort key values of an encode_cursor cursor, 400 when the cursor was not produced by us"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
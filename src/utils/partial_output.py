@@ -0,0 +1,85 @@
+import json
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class IncrementalFieldParser:
+    """
+    Parses a JSON object while it is being generated and reports each top level field once its value is complete.
+
+    The model writes the object key by key, so a comma at the top level of the object ends the field before it.
+    Every piece of text is scanned once for those commas (tracking strings and nesting) and only the text of
+    the completed field is parsed, the cost stays linear in the length of the output. The last field is only
+    final once the whole object has arrived (finish()).
+
+    Args:
+    on_field: callable(field, value) called once per completed field, in generation order
+    """
+    def __init__(self, on_field:Callable[[str, Any], None]):
+        self.on_field = on_field
+        self.buffer = ""
+        self.published: Dict[str, Any] = {}
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._is_object = False
+        #start of the current top level field in buffer
+        self._field_start = 0
+
+    def _publish(self, parsed:Dict, keys:List[str]) -> List[Tuple[str, Any]]:
+        completed = []
+        for key in keys:
+            if key not in self.published:
+                self.published[key] = parsed[key]
+                completed.append((key, parsed[key]))
+                self.on_field(key, parsed[key])
+        return completed
+
+    def _complete_field(self, end:int) -> List[Tuple[str, Any]]:
+        field = self.buffer[self._field_start:end]
+        self._field_start = end + 1
+        if not self._is_object:
+            return []
+        try:
+            parsed = json.loads("{" + field + "}")
+        except ValueError:
+            return []
+        return self._publish(parsed, list(parsed))
+
+    def feed(self, text:str) -> List[Tuple[str, Any]]:
+        """Add the next piece of generated JSON, returns the fields completed by it"""
+        if not text:
+            return []
+        start = len(self.buffer)
+        self.buffer += text
+        completed = []
+        for index in range(start, len(self.buffer)):
+            char = self.buffer[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._is_object = char == "{"
+                    self._field_start = index + 1
+            elif char in "}]":
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                completed += self._complete_field(index)
+        return completed
+
+    def finish(self) -> Dict:
+        """Parse the complete object and report the fields that haven't been reported yet"""
+        if not self.buffer.strip():
+            raise ValueError("no output was streamed, there is no object to parse")
+        parsed = json.loads(self.buffer)
+        if not isinstance(parsed, dict):
+            raise ValueError(f"streamed output is a {type(parsed).__name__}, not a JSON object")
+        self._publish(parsed, list(parsed))
+        return parsed
@@ -69,6 +69,8 @@
 chat_with_context = """
 You are an AI name AlignIQ.
 You are an expert in system architecture, software development, data engineering, Data science,AI and all software/product development and you are responsible for answering questions and providing recommendations to the user questions taking providing the chat context of previous Assistance and user converstaion. Your main purpose is to provide the correct answer to the user question with the details provided or provide the details that user ask for.
+Summary of the earlier part of the conversation (empty if there is none):
+{conversation_summary}
 The context of the chat is:
 {chat_context}
 The user question is:
@@ -189,3 +191,75 @@ Document to analyze:
 {document}
 
 Return ONLY valid JSON:"""
+
+
+summarize_conversation = """You are maintaining a running summary of a conversation between a user and AlignIQ, an AI assistant that answers questions about a technical document and its recommendations.
+
+Current summary:
+{summary}
+
+New messages to fold into the summary:
+{messages}
+
+Rewrite the summary so it also covers the new messages.
+*** Keep every decision, requirement, number, technology, name and open question that was mentioned***
+*** Drop greetings, repetition and formatting***
+*** Keep the summary under {max_tokens} tokens***
+
+Return ONLY the updated summary:"""
+
+
+ambiguity_questions = """
+        Identify ambiguities in these requirements and technicial challeges: {input}
+        Generate follow-up questions to resolve them.
+        Format: {{"questions": ["question1", "question2"]}}
+        """
+
+tech_recommendations = """
+        Based on requirements: {input}
+        Suggest:
+        1. Primary tech stack (cloud + on-prem options)
+        2. Alternatives with cost comparisons
+        
+        
+        Format: {{
+            "primary_stack": {{
+                "cloud": ["tech1", "tech2"],
+                "on_prem": ["tech3", "tech4"],
+                "Optimized technologies to complete this project with cost efficiency": ["devops", "software technologies","Data science","AI"],
+                "Developers required to complete this project": []
+                                                  
+            }},
+            "alternatives": [
+                {{
+                    "type": "cloud",
+                    "tech": ["alt_tech1"],
+                    "cost_savings": ""
+                }}
+            ]
+        }}
+        """
+
+
+summarize_images = """
+        You are a technical expert. You will receive several images extracted from the same document, each one preceded by its label "Image <number>".
+        Analyze every image separately and in detail.
+        If it's a software architecture diagram, explain all components, connections,
+        data flows, and technologies. Highlight key design patterns or potential issues.
+        Include every important detail, such as text labels, symbols, relationships, and overall structure.
+        Return exactly one summary per image and set image_index to the number from its label.
+        """
+
+
+document_gate = """
+        You only decide whether a document should go through a full technical project analysis. You get an excerpt sampled
+        from the beginning, middle and end of the document.
+
+        Technical: RFPs, RFIs, product ideas, requirement or design documents that propose a NEW system/product to be built
+        or improvements to an existing software product.
+        Not technical: invoices, receipts, resumes/CVs, case studies, academic papers, marketing material, contracts and
+        anything describing past work, even when it mentions technologies.
+
+        Document excerpt:
+        {excerpt}
+        """
@@ -66,6 +66,13 @@ class ProjectDefinition(BaseModel):
         return md, title
 
 
+class DocumentGate(BaseModel):
+    is_technical_document: bool = Field(description="True if the document proposes a system/product to be built (RFP, RFI, product idea, requirements)")
+    document_type: str = Field(description="Short document type, e.g. RFP, product idea, invoice, resume")
+    document_analysis: str = Field(description="One or two sentences explaining the classification")
+    title: str = Field(description="professional Title of the document under 7 words")
+
+
 class Chat_with_context(BaseModel):
     response: str = Field(description="response from LLM chat responding to user question regarding the document and its recommendations")
 
@@ -76,3 +83,13 @@ class Chat_with_context(BaseModel):
             md += message
         return md
 
+
+
+
+class ImageSummary(BaseModel):
+    image_index: int = Field(description="Number of the image as labelled in the request, starting at 1")
+    summary: str = Field(description="Detailed technical explanation of the image")
+
+
+class ImageBatchSummary(BaseModel):
+    images: list[ImageSummary] = Field(description="One summary per image in the request, in the same order")
@@ -9,6 +9,15 @@ from config import settings
 from ipaddress import ip_address
 from utils.logger import logger
 from fastapi.responses import JSONResponse
+from utils.llm_governor import governor
+from utils.llm_usage import usage_recorder
+from agents.report import report_renderer
+from utils.chat_persistence import chat_persistence
+from utils.chat_cache import chat_cache
+from utils.user_cache import user_cache
+from utils.db_router import read_router
+from models import async_engine, replica_engines
+from migrations import check_schema
 
 
 PREMIUM_LIMIT = "100/minute"
@@ -100,6 +109,12 @@ class CustomRateLimiter:
 async def lifespan(app: FastAPI):
 
     logger.info("Loaded with rate limiter")
+    # Compile prompts, response schemas and runnables once instead of per request
+    from agents.workflow import chains
+    chains.build()
+    # The schema is created and upgraded by python -m migrations upgrade, only check it is current
+    await check_schema(async_engine)
+
     # Initialize Redis connection pool
     redis = Redis(
         host=settings.REDIS_HOST,
@@ -114,6 +129,11 @@ async def lifespan(app: FastAPI):
     try:
         await redis.ping()
         logger.info("Redis connection successful")
+        # LLM rate budgets and cooldowns are shared by every worker through Redis
+        governor.attach(redis)
+        chat_cache.attach(redis)
+        user_cache.attach(redis)
+        read_router.attach(redis)
     except Exception as e:
         logger.error(f"Redis connection failed: {e}")
 
@@ -123,7 +143,15 @@ async def lifespan(app: FastAPI):
                             http_callback=rate_limit_exceeded_callback, 
                             prefix="fastapi-limiter:"
                             )
+    usage_recorder.start()
+    chat_persistence.start()
     yield
+    await chat_persistence.stop()
+    await usage_recorder.stop()
+    await async_engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+    report_renderer.shutdown()
     await redis.close()
     await FastAPILimiter.close()
 
@@ -0,0 +1,189 @@
+"""
+Full-text search over a user's chats, documents and analyses.
+
+Everything searchable is a row of search_entries. tsv is a generated column, so Postgres computes it
+and updates the GIN index in the same statement that writes the row. The write paths add their rows
+in the transaction that stores the data:
+
+- chat_title: one row per chat, updated when the title changes
+- chat_message: one row per message (part = seq). Written from the plain text, so compressed
+  messages are searchable too.
+- document: extracted text of an uploaded document, in chunks of SEARCH_DOCUMENT_CHUNK_CHARS (part = chunk)
+- analysis: the text of a stored analysis
+
+Rows of a deleted chat are removed with it.
+"""
+import json
+from typing import Any, Dict, Iterable, List
+from sqlalchemy import Float, and_, or_, cast, delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+import models
+from config import settings
+from utils.pagination import encode_cursor, decode_cursor
+
+SOURCES = ("chat_title", "chat_message", "document", "analysis")
+#longer messages are indexed up to this size, Postgres caps a tsvector at 1MB
+MAX_MESSAGE_CHARS = 200_000
+HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=30, MinWords=10, StartSel=<b>, StopSel=</b>"
+
+
+def _entry(user_id:str, source:str, source_id:str, part:int=0, document_id:str=None, title:str=None, body:str=None) -> Dict:
+    return {"user_id": user_id, "source": source, "source_id": source_id, "part": part, "document_id": document_id, "title": title, "body": body}
+
+
+def _chunks(text:str, size:int) -> List[str]:
+    """splits on whitespace close to `size` characters so words are not cut"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            end = space if space > start else end
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def _text_values(value:Any) -> Iterable[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _text_values(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _text_values(item)
+
+
+async def index_entries(entries:List[Dict], db:AsyncSession):
+    """inserts or replaces search entries, callers commit"""
+    if not entries:
+        return
+    statement = insert(models.SearchEntry)
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=["source", "source_id", "part"],
+            set_={"title": statement.excluded.title, "body": statement.excluded.body, "document_id": statement.excluded.document_id},
+            #unchanged rows are left alone, no new row version and no GIN update
+            where=or_(
+                models.SearchEntry.title.is_distinct_from(statement.excluded.title),
+                models.SearchEntry.body.is_distinct_from(statement.excluded.body),
+            ),
+        ),
+        entries,
+    )
+
+
+def chat_title_entry(user_id:str, document_id:str, chat_history_id:str, title:str) -> Dict:
+    return _entry(user_id, "chat_title", chat_history_id, document_id=document_id, title=title)
+
+
+def chat_message_entries(user_id:str, document_id:str, chat_history_id:str, first_seq:int, messages:List[Dict]) -> List[Dict]:
+    """entries for messages stored from seq first_seq on"""
+    entries = []
+    for seq, message in enumerate(messages, start=first_seq):
+        content = message.get("content")
+        content = content if isinstance(content, str) else json.dumps(content)
+        if content:
+            entries.append(_entry(user_id, "chat_message", chat_history_id, part=seq, document_id=document_id, body=content[:MAX_MESSAGE_CHARS]))
+    return entries
+
+
+async def index_document_text(user_id:str, document_id:str, title:str, text:str, db:AsyncSession):
+    """indexes the extracted text of a document, replaces earlier chunks, callers commit"""
+    chunks = [chunk for chunk in _chunks(text or "", settings.SEARCH_DOCUMENT_CHUNK_CHARS) if chunk.strip()]
+    await db.execute(delete(models.SearchEntry).where(
+        models.SearchEntry.source == "document", models.SearchEntry.source_id == document_id, models.SearchEntry.part >= len(chunks)
+    ))
+    await index_entries([_entry(user_id, "document", document_id, part=part, document_id=document_id, title=title, body=chunk) for part, chunk in enumerate(chunks)], db)
+
+
+async def index_analysis(user_id:str, document_id:str, analysis_id:str, title:str, analysis:Dict, db:AsyncSession):
+    """indexes every text value of a stored analysis, callers commit"""
+    body = "\n".join(_text_values(analysis))[:MAX_MESSAGE_CHARS]
+    await index_entries([_entry(user_id, "analysis", analysis_id, document_id=document_id, title=title, body=body)], db)
+    #the document chunks are found by the analysis title too
+    if title:
+        await db.execute(update(models.SearchEntry).where(models.SearchEntry.source == "document", models.SearchEntry.source_id == document_id).values(title=title))
+
+
+async def remove_chat_entries(chat_history_id:str, db:AsyncSession):
+    """drops the title and messages of a chat from the index, callers commit"""
+    await db.execute(delete(models.SearchEntry).where(
+        models.SearchEntry.source.in_(("chat_title", "chat_message")), models.SearchEntry.source_id == chat_history_id
+    ))
+
+
+async def search(user_id:str, query:str, db:AsyncSession, limit:int=None, cursor:str=None, sources:List[str]=None) -> Dict:
+    """
+    ranked full-text search over the entries of the user
+
+    The query uses web search syntax ("exact phrase", or, -excluded). Results are ordered by ts_rank_cd,
+    titles weigh more than bodies. Snippets are only built for the rows of the page.
+
+    Args:
+    user_id: str,
+    query: str, search text
+    db: AsyncSession
+    limit: int, page size, defaults to SEARCH_PAGE_SIZE
+    cursor: str, next_cursor of the previous page
+    sources: List[str], subset of chat_title, chat_message, document, analysis
+
+    Returns:
+    Dict: {"results": [{source, source_id, part, document_id, title, snippet, rank}], "next_cursor": str or None}
+    """
+    if not query or not query.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    unknown = set(sources or []) - set(SOURCES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search sources: {', '.join(sorted(unknown))}")
+    limit = min(max(limit or settings.SEARCH_PAGE_SIZE, 1), settings.SEARCH_MAX_PAGE_SIZE)
+
+    entry = models.SearchEntry
+    tsquery = func.websearch_to_tsquery(models.SEARCH_CONFIG, query)
+    #double precision so the rank in the cursor compares equal to the recomputed one
+    rank = cast(func.ts_rank_cd(entry.tsv, tsquery), Float(53))
+    matches = select(
+        entry.search_id, entry.source, entry.source_id, entry.part, entry.document_id, entry.title, entry.body, rank.label("rank")
+    ).where(entry.user_id == user_id, entry.tsv.op("@@")(tsquery))
+    if sources:
+        matches = matches.where(entry.source.in_(sources))
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, 2)
+        try:
+            last_rank, last_id = float(last_rank), int(last_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        matches = matches.where(tuple_(rank, entry.search_id) < (last_rank, last_id))
+    page = matches.order_by(rank.desc(), entry.search_id.desc()).limit(limit + 1).subquery()
+
+    chat = models.ChatHistory
+    rows = (await db.execute(
+        select(
+            page.c.search_id, page.c.source, page.c.source_id, page.c.part, page.c.document_id, page.c.rank,
+            func.coalesce(page.c.title, chat.title).label("title"),
+            func.ts_headline(models.SEARCH_CONFIG, func.coalesce(page.c.body, page.c.title, ""), tsquery, HEADLINE_OPTIONS).label("snippet"),
+        )
+        .outerjoin(chat, and_(page.c.source == "chat_message", chat.chat_history_id == page.c.source_id))
+        .order_by(page.c.rank.desc(), page.c.search_id.desc())
+    )).all()
+    results = rows[:limit]
+    next_cursor = encode_cursor(results[-1].rank, results[-1].search_id) if len(rows) > limit else None
+    return {
+        "results": [
+            {
+                "source": row.source,
+                "source_id": row.source_id,
+                "part": row.part,
+                "document_id": row.document_id,
+                "title": row.title,
+                "snippet": row.snippet,
+                "rank": row.rank,
+            }
+            for row in results
+        ],
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,146 @@
+"""
+Cache of user identities for the login and OAuth callback paths.
+
+Entries:
+
+- profile: the users row, keyed by email + provider and by user_id
+
+Two tiers, like utils.chat_cache: an in-process LRU of USER_CACHE_LOCAL_MAX_ENTRIES entries that
+expire after USER_CACHE_LOCAL_TTL_SECONDS, and Redis for USER_CACHE_TTL_SECONDS when it is attached.
+Only users that were found are cached, a lookup that finds nobody always goes to the database, so a
+user registering right after a failed login is seen at once.
+
+Code that changes a user calls invalidate after its commit. The local entries of the worker and the
+Redis entries are dropped right away, the local entries of other workers expire within the local TTL.
+Password hashes are never cached, neither locally nor in Redis: password login takes the profile from
+here and reads the hash from login_details on every attempt, so a changed password applies at once.
+USER_CACHE_TTL_SECONDS=0 turns the cache off.
+"""
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from cachetools import TTLCache
+from config import settings
+from utils.logger import logger
+
+PREFIX = "user_cache"
+PROFILE_FIELDS = ("user_id", "oauth_id", "email_address", "full_name", "first_name", "last_name", "verified_email", "picture", "provider")
+
+
+def profile_key(email_address:str, provider:str) -> str:
+    return f"{PREFIX}:profile:{provider}:{email_address}"
+
+
+def user_key(user_id:str) -> str:
+    return f"{PREFIX}:id:{user_id}"
+
+
+class UserCache:
+    def __init__(self):
+        self.redis = None
+        self._local = TTLCache(maxsize=settings.USER_CACHE_LOCAL_MAX_ENTRIES, ttl=settings.USER_CACHE_LOCAL_TTL_SECONDS)
+        #bumped by every invalidation, a load that started before it is not stored
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.USER_CACHE_TTL_SECONDS > 0
+
+    def attach(self, redis):
+        self.redis = redis
+
+    async def get(self, key:str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        cached = self._local.get(key)
+        if cached is None and self.redis is not None:
+            try:
+                cached = await self.redis.get(key)
+            except Exception as e:
+                logger.warning(f"user cache unavailable, reading from the database: {str(e)}")
+            if cached is not None:
+                self._local[key] = cached
+        return json.loads(cached) if cached is not None else None
+
+    async def set(self, keys:List[str], value:Any, generation:int=None):
+        """
+        stores value under every key
+
+        Args:
+        keys: List[str], keys of the same entry (e.g. by email and by user_id)
+        value: JSON serializable value
+        generation: int, generation read before the database lookup, nothing is stored when an
+                    invalidation ran since
+        """
+        if not self.enabled or (generation is not None and generation != self._generation):
+            return
+        encoded = json.dumps(value, separators=(",", ":"))
+        for key in keys:
+            self._local[key] = encoded
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, encoded, ex=settings.USER_CACHE_TTL_SECONDS)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"unable to cache user entry {keys[0]}: {str(e)}")
+
+    async def get_or_load(self, key:str, loader:Callable[[], Awaitable[Optional[Dict]]], aliases:Callable[[Dict], List[str]]=None) -> Optional[Dict]:
+        """
+        cached entry of key
+
+        Args:
+        key: str,
+        loader: coroutine function reading the database, returns None when nothing was found
+        aliases: function returning the other keys of a loaded value, e.g. its user_id key
+
+        Returns:
+        Dict or None: the cached or loaded entry
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+        generation = self._generation
+        value = await loader()
+        if value is not None:
+            await self.set([key] + (aliases(value) if aliases else []), value, generation)
+        return value
+
+    async def invalidate(self, user_id:str=None, email_address:str=None, provider:str=None):
+        """
+        drops the cached profile entries of a user, call after the change is committed
+
+        Args:
+        user_id: str,
+        email_address: str, together with provider for the profile entry
+        provider: str, e.g. Local or the OAuth provider name
+        """
+        if not self.enabled:
+            return
+        if user_id and not email_address:
+            profile = await self.get(user_key(user_id))
+            if profile:
+                email_address, provider = profile["email_address"], profile["provider"]
+        self._generation += 1
+        keys = []
+        if user_id:
+            keys.append(user_key(user_id))
+        if email_address and provider:
+            keys.append(profile_key(email_address, provider))
+        for key in keys:
+            self._local.pop(key, None)
+        if self.redis is None or not keys:
+            return
+        try:
+            await self.redis.delete(*keys)
+        except Exception as e:
+            logger.error(f"unable to invalidate user cache entries {keys}, they expire in {settings.USER_CACHE_TTL_SECONDS}s: {str(e)}")
+
+
+def profile_of(user) -> Dict:
+    """cacheable profile of a models.User"""
+    return {field: getattr(user, field) for field in PROFILE_FIELDS}
+
+
+user_cache = UserCache()
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+
+services = pytest.importorskip("routers.services")
+
+
+def token(email):
+    return {"regular_login_token": {"id": "user", "email": email}}
+
+
+@pytest.fixture(autouse=True)
+def admins(monkeypatch):
+    monkeypatch.setattr(services.settings, "ADMIN_EMAILS", ["admin@example.com"])
+
+
+def test_pool_stats_are_only_for_admins():
+    with pytest.raises(HTTPException) as forbidden:
+        asyncio.run(services.get_pool_stats(current_token=token("user@example.com")))
+    assert forbidden.value.status_code == 403
+    stats = asyncio.run(services.get_pool_stats(current_token=token("admin@example.com")))
+    assert {"async", "sync", "read_routing"} <= set(stats)
+
+
+def test_chain_stats_are_only_for_admins():
+    with pytest.raises(HTTPException) as forbidden:
+        asyncio.run(services.get_chain_stats(current_token=token("user@example.com")))
+    assert forbidden.value.status_code == 403
+    stats = asyncio.run(services.get_chain_stats(current_token=token("admin@example.com")))
+    assert set(stats) == {"chains", "governor"}
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+import models
+from scripts import archive_chats as archive_script
+from utils.chat_history import append_chat_messages
+
+OLD = datetime.now(timezone.utc) - timedelta(days=90)
+RECENT = datetime.now(timezone.utc) - timedelta(days=1)
+
+
+@pytest.fixture
+def chats(pg, monkeypatch):
+    """deleted chats d1, d2 from 90 days ago, a chat deleted yesterday and an active old chat, each with messages"""
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            for chat_id, modified_at, active in [("d1", OLD, False), ("d2", OLD, False), ("recent", RECENT, False), ("active", OLD, True)]:
+                db.add(models.ChatHistory(chat_history_id=chat_id, user_id="user", document_id="document", title=chat_id, active_tag=active, modified_at=modified_at))
+                await db.flush()
+                db.add(models.SelectedChat(chat_history_id=chat_id, user_id="user", document_id="document", title=chat_id, summary="s"))
+                await append_chat_messages(chat_id, [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}], db, start_seq=0)
+            await db.commit()
+
+    pg.run(scenario)
+    engine = create_engine(pg.url, poolclass=NullPool)
+    monkeypatch.setattr(models, "sessionlocal", sessionmaker(bind=engine))
+    yield engine
+    engine.dispose()
+
+
+def chat_ids(engine, table):
+    with engine.connect() as connection:
+        return sorted(set(connection.execute(select(table.chat_history_id)).scalars()))
+
+
+def test_old_deleted_chats_move_to_the_archive_in_batches(chats):
+    assert archive_script.archive_chats(older_than_days=30, batch_size=1) == 2
+    for table, archive in archive_script.ARCHIVES:
+        assert chat_ids(chats, table) == ["active", "recent"]
+        assert chat_ids(chats, archive) == ["d1", "d2"]
+    with chats.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(models.ChatMessageArchive)).scalar() == 4
+        assert connection.execute(select(models.SelectedChatArchive.summary).where(models.SelectedChatArchive.chat_history_id == "d1")).scalar() == "s"
+
+
+def test_nothing_left_to_archive(chats):
+    archive_script.archive_chats(older_than_days=30)
+    assert archive_script.archive_chats(older_than_days=30) == 0
+
+
+def test_failed_batch_leaves_the_chats_untouched(chats, monkeypatch):
+    #the chat_history copy fails after the messages and selected chats were copied in the same transaction
+    monkeypatch.setattr(archive_script, "ARCHIVES", archive_script.ARCHIVES[:2] + [(models.ChatHistory, models.SelectedChatArchive)])
+    with pytest.raises(Exception):
+        archive_script.archive_chats(older_than_days=30)
+    assert chat_ids(chats, models.ChatMessage) == ["active", "d1", "d2", "recent"]
+    assert chat_ids(chats, models.ChatMessageArchive) == []
@@ -0,0 +1,54 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, text
+import models
+
+
+def test_get_async_db_yields_a_session_and_closes_it(pg):
+    async def scenario(sessions):
+        dependency = models.get_async_db()
+        db = await dependency.__anext__()
+        value = (await db.execute(text("SELECT 1"))).scalar()
+        await dependency.aclose()
+        return value, db.in_transaction()
+
+    assert pg.run(scenario) == (1, False)
+
+
+def test_queries_of_concurrent_requests_overlap(pg):
+    async def request():
+        async for db in models.get_async_db():
+            await db.execute(text("SELECT pg_sleep(0.3)"))
+
+    async def scenario(sessions):
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(4)))
+        return time.perf_counter() - started
+
+    #one after another they would take 1.2s, the event loop is never blocked by a query
+    assert pg.run(scenario) < 0.9
+
+
+def test_local_account_is_created_once(pg, monkeypatch):
+    pytest.importorskip("easyocr")
+    import database_scripts
+    from utils.user_cache import UserCache
+
+    monkeypatch.setattr(database_scripts, "user_cache", UserCache())
+
+    user = {"id": None, "email": "new@example.com", "given_name": "A", "family_name": "B", "name": "A B", "verified_email": False, "picture": None, "password": "secret"}
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            created = await database_scripts.create_user(user, "Local", db)
+            hashed = (await db.execute(select(models.LoginDetails.hashed_password).where(models.LoginDetails.user_id == created.user_id))).scalar()
+            with pytest.raises(HTTPException) as again:
+                await database_scripts.create_user(user, "Local", db)
+            return created, hashed, again.value.status_code
+
+    created, hashed, status_code = pg.run(scenario)
+    assert created.email_address == "new@example.com" and created.created_at is not None
+    assert hashed and hashed != "secret"
+    assert status_code == 400
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from langchain_core.runnables import RunnableLambda
+from agents.chains import CHAIN_BUILDERS, ChainRegistry
+from agents.llm_backend import get_chat_model
+
+
+def test_every_registered_chain_builds():
+    registry = ChainRegistry(get_chat_model())
+    assert set(registry.build()) == set(CHAIN_BUILDERS)
+
+
+@pytest.fixture
+def registry():
+    built = []
+
+    def upper(llm):
+        built.append(llm)
+        return RunnableLambda(lambda text: text.upper())
+
+    def words(llm):
+        return RunnableLambda(lambda text: text.split())
+
+    registry = ChainRegistry("llm", {"upper": upper, "words": words})
+    registry.built = built
+    return registry
+
+
+def test_chains_are_built_once_and_shared(registry):
+    assert registry.get("upper") is registry.get("upper")
+    assert registry.built == ["llm"]
+
+
+def test_unknown_chain_is_rejected(registry):
+    with pytest.raises(KeyError, match="chain not registered: missing"):
+        registry.get("missing")
+
+
+def test_invocations_are_counted(registry):
+    assert asyncio.run(registry.ainvoke("upper", "shared")) == "SHARED"
+    asyncio.run(registry.ainvoke("upper", "again"))
+    stats = registry.stats()["upper"]
+    assert stats["invocations"] == 2
+    assert stats["avg_latency_ms"] >= stats["avg_overhead_ms"] >= 0
+    assert stats["saved_build_ms"] == pytest.approx(stats["build_ms"] * 2, abs=0.01)
+
+
+def test_stream_counts_as_one_invocation(registry):
+    async def scenario():
+        return [chunk async for chunk in registry.astream("words", "a b")]
+
+    assert asyncio.run(scenario()) == [["a", "b"]]
+    assert registry.stats()["words"]["invocations"] == 1
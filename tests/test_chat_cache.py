@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime
+import pytest
+from utils import chat_cache as chat_cache_module
+from utils.chat_cache import ChatCache
+
+
+@pytest.fixture
+def cache(monkeypatch, redis):
+    monkeypatch.setattr(chat_cache_module.settings, "CHAT_CACHE_TTL_SECONDS", 300)
+    cache = ChatCache()
+    cache.attach(redis)
+    return cache
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def read(cache, loader, kind="list", user_id="user", chat_history_id=None, params=(20, None)):
+    return asyncio.run(cache.get_or_load(kind, user_id, chat_history_id, params, loader))
+
+
+def test_repeated_read_is_served_from_the_cache(cache):
+    loader = Loader({"user_details": [{"modified_at": datetime(2025, 1, 1)}]})
+    read(cache, loader)
+    #the cached copy is JSON, datetimes come back as ISO strings
+    assert read(cache, loader) == {"user_details": [{"modified_at": "2025-01-01T00:00:00"}]}
+    assert loader.calls == 1
+
+
+def test_other_workers_read_the_redis_entry(cache, redis):
+    read(cache, Loader(["chats"]))
+    other = ChatCache()
+    other.attach(redis)
+    loader = Loader(["from the database"])
+    assert read(other, loader) == ["chats"] and loader.calls == 0
+
+
+def test_params_are_part_of_the_key(cache):
+    loader = Loader(["page"])
+    read(cache, loader, params=(20, None))
+    read(cache, loader, params=(20, "cursor"))
+    assert loader.calls == 2
+
+
+def test_a_write_replaces_the_version_for_every_worker(cache, redis):
+    other = ChatCache()
+    other.attach(redis)
+    read(cache, Loader(["old"]), kind="chat", chat_history_id="chat")
+    asyncio.run(other.invalidate("user", "chat"))
+    loader = Loader(["new"])
+    #the local tier of this worker still holds the old entry until its TTL, Redis no longer does
+    cache._local.clear()
+    assert read(cache, loader, kind="chat", chat_history_id="chat") == ["new"]
+
+
+def test_invalidate_drops_local_entries_of_the_user_and_chat(cache):
+    read(cache, Loader(["list"]))
+    read(cache, Loader(["chat"]), kind="chat", chat_history_id="chat")
+    read(cache, Loader(["other list"]), user_id="other")
+    asyncio.run(cache.invalidate("user", "chat"))
+    assert [key[1] for key in cache._local.keys()] == ["other"]
+
+
+def test_load_racing_an_invalidation_is_not_kept_locally(cache):
+    async def stale():
+        await cache.invalidate("user")
+        return ["stale"]
+
+    read(cache, stale)
+    assert len(cache._local) == 0
+
+
+def test_failing_redis_falls_back_to_the_database(cache):
+    class Down:
+        def pipeline(self, transaction=True):
+            raise ConnectionError("redis down")
+
+    cache.attach(Down())
+    loader = Loader(["rows"])
+    assert read(cache, loader) == ["rows"] and loader.calls == 1
+
+
+def test_loader_errors_are_not_cached(cache):
+    class Failing:
+        calls = 0
+
+        async def __call__(self):
+            Failing.calls += 1
+            raise RuntimeError("database down")
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            read(cache, Failing())
+    assert Failing.calls == 2
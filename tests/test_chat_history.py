@@ -0,0 +1,220 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+import models
+from utils.chat_history import append_chat_messages, delete_chat_history, save_chat_history, unsaved_messages, _list_user_chats, _load_single_chat, _message_row
+from utils.compression import decompress_text
+
+
+def message(role, content, timestamp):
+    return {"role": role, "content": content, "timestamp": timestamp}
+
+
+CONVERSATION = [
+    message("user", "q1", "t1"),
+    message("assistant", "a1", "t2"),
+    message("user", "q2", "t3"),
+    message("assistant", "a2", "t4"),
+]
+
+
+def test_everything_is_new_for_a_chat_without_messages():
+    assert unsaved_messages(CONVERSATION, None) == CONVERSATION
+
+
+def test_messages_after_the_last_stored_one_are_new():
+    assert unsaved_messages(CONVERSATION, CONVERSATION[1]) == CONVERSATION[2:]
+
+
+def test_nothing_is_new_when_the_client_resends_the_conversation():
+    assert unsaved_messages(CONVERSATION, CONVERSATION[-1]) == []
+
+
+def test_selected_subset_without_the_last_stored_message_is_not_placed():
+    #the user selected q1 and q2 as context, the stored conversation ends with a2
+    assert unsaved_messages([CONVERSATION[0], CONVERSATION[2], message("user", "q3", "t5")], CONVERSATION[-1]) is None
+
+
+def test_last_stored_message_is_matched_on_role_content_and_timestamp():
+    assert unsaved_messages(CONVERSATION, message("assistant", "a1", "other")) is None
+    assert unsaved_messages(CONVERSATION, message("user", "a1", "t2")) is None
+
+
+def test_structured_content_matches_its_stored_text():
+    structured = [message("user", "q1", "t1"), message("assistant", {"message": "a1"}, "t2"), message("user", "q2", "t3")]
+    stored = {"role": "assistant", "content": _message_row("chat", 1, structured[1])["content"], "timestamp": "t2"}
+    assert unsaved_messages(structured, stored) == structured[2:]
+
+
+def test_repeated_message_matches_the_latest_occurrence():
+    repeated = [message("user", "again", "t1"), message("assistant", "a", "t2"), message("user", "again", "t1"), message("assistant", "b", "t3")]
+    assert unsaved_messages(repeated, repeated[0]) == repeated[3:]
+
+
+def test_append_numbers_messages_from_start_seq(db):
+    appended = asyncio.run(append_chat_messages("chat", CONVERSATION[2:], db, start_seq=2, user_id="user", document_id="document"))
+    assert appended == 2
+    assert db.tables() == ["chat_messages", "search_entries"]
+    rows = db.params("chat_messages")[0]
+    assert [(row["seq"], row["content"]) for row in rows] == [(2, "q2"), (3, "a2")]
+    assert [entry["part"] for entry in db.params("search_entries")[0]] == [2, 3]
+
+
+def test_append_without_messages_writes_nothing(db):
+    assert asyncio.run(append_chat_messages("chat", [], db, start_seq=4, user_id="user")) == 0
+    assert db.executed == []
+
+
+def test_append_without_user_skips_the_search_index(db):
+    asyncio.run(append_chat_messages("chat", CONVERSATION[:1], db, start_seq=0))
+    assert db.tables() == ["chat_messages"]
+
+
+@pytest.mark.parametrize("content, stored", [("text", "text"), ({"message": "x"}, '{"message": "x"}')])
+def test_message_row_stores_text(content, stored):
+    row = _message_row("chat", 0, message("assistant", content, "t"))
+    assert (row["content"] if row["content_zstd"] is None else decompress_text(row["content_zstd"])) == stored
+
+
+def test_update_that_doesnt_continue_the_conversation_is_rejected(pg):
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            created = await save_chat_history({"user_id": "user", "document_id": "document", "title": "t", "message": CONVERSATION[:2]}, db)
+            chat = {"chat_history_id": created["chat_history_id"], "user_id": "user", "document_id": "document"}
+            updated = await save_chat_history(dict(chat, message=CONVERSATION), db)
+            with pytest.raises(HTTPException) as rejected:
+                await save_chat_history(dict(chat, message=[CONVERSATION[0], message("user", "q3", "t5")]), db)
+            stored = (await db.execute(select(models.ChatMessage.content).where(models.ChatMessage.chat_history_id == chat["chat_history_id"]).order_by(models.ChatMessage.seq))).scalars().all()
+        return updated["status"], rejected.value.status_code, stored
+
+    assert pg.run(scenario) == ("updated", 409, ["q1", "a1", "q2", "a2"])
+
+
+def test_chat_list_pages_by_modified_at_without_gaps(pg):
+
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            await pg.add_user(db, "other", ["other document"])
+            #c2 and c3 share modified_at, the chat id breaks the tie
+            for chat_id, minutes, active in [("c1", 1, True), ("c2", 2, True), ("c3", 2, True), ("c4", 3, True), ("c5", 4, False)]:
+                db.add(models.ChatHistory(chat_history_id=chat_id, user_id="user", document_id="document", title=chat_id, active_tag=active, modified_at=start + timedelta(minutes=minutes)))
+            db.add(models.ChatHistory(chat_history_id="c6", user_id="other", document_id="other document", title="c6", modified_at=start))
+            await db.commit()
+            pages, cursor = [], None
+            while True:
+                page = await _list_user_chats("user", db, limit=2, cursor=cursor)
+                pages.append([chat["chat_history_id"] for chat in page["user_details"]])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    return pages
+
+    assert pg.run(scenario) == [["c4", "c3"], ["c2", "c1"]]
+
+
+def test_user_without_chats_gets_a_404(pg):
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            with pytest.raises(HTTPException) as missing:
+                await _list_user_chats("nobody", db)
+            return missing.value.status_code
+
+    assert pg.run(scenario) == 404
+
+
+def page_through(load):
+    """seq lists of every page, newest page first"""
+    async def scenario(sessions):
+        async with sessions() as db:
+            pages, before = [], None
+            while True:
+                page = await load(db, before)
+                pages.append([(message["seq"], message.get("content")) for message in page["messages"]])
+                before = page["next_cursor"]
+                if before is None:
+                    return pages, page
+    return scenario
+
+
+def test_messages_are_paged_backwards_from_the_newest(pg):
+    async def setup(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="t"))
+            await db.flush()
+            await append_chat_messages("chat", CONVERSATION + [message("user", "q3", "t5")], db, start_seq=0)
+            await db.commit()
+
+    pg.run(setup)
+    pages, last = pg.run(page_through(lambda db, before: _load_single_chat("user", "chat", db, limit=2, before=before)))
+    assert pages == [[(3, "a2"), (4, "q3")], [(1, "a1"), (2, "q2")], [(0, "q1")]]
+    assert last["title"] == "t"
+
+
+def test_requested_fields_only(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="t"))
+            await db.flush()
+            await append_chat_messages("chat", CONVERSATION, db, start_seq=0)
+            await db.commit()
+            return await _load_single_chat("user", "chat", db, limit=1, fields=["role"])
+
+    assert pg.run(scenario)["messages"] == [{"role": "assistant", "seq": 3}]
+
+
+def test_legacy_transcript_is_paged_the_same_way(pg):
+    async def setup(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            #not backfilled into chat_messages yet
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="t", message=CONVERSATION + [message("user", "q3", "t5")]))
+            await db.commit()
+
+    pg.run(setup)
+    pages, _ = pg.run(page_through(lambda db, before: _load_single_chat("user", "chat", db, limit=2, before=before)))
+    assert pages == [[(3, "a2"), (4, "q3")], [(1, "a1"), (2, "q2")], [(0, "q1")]]
+
+
+def test_another_users_chat_is_not_found(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="t"))
+            await db.commit()
+            with pytest.raises(HTTPException) as missing:
+                await _load_single_chat("someone else", "chat", db, limit=2)
+            return missing.value.status_code
+
+    assert pg.run(scenario) == 404
+
+
+def test_chat_updates_and_deletes_only_touch_the_owners_active_chat(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            created = await save_chat_history({"user_id": "user", "document_id": "document", "title": "t", "message": [{"role": "user", "content": "q", "timestamp": "t1"}]}, db)
+            chat_id = created["chat_history_id"]
+            codes = []
+            for call in (
+                save_chat_history({"chat_history_id": chat_id, "user_id": "someone else", "document_id": "document", "title": "stolen", "message": []}, db),
+                delete_chat_history("someone else", chat_id, db),
+            ):
+                with pytest.raises(HTTPException) as rejected:
+                    await call
+                codes.append(rejected.value.status_code)
+            deleted = await delete_chat_history("user", chat_id, db)
+            with pytest.raises(HTTPException) as again:
+                await delete_chat_history("user", chat_id, db)
+            title = (await db.execute(select(models.ChatHistory.title).where(models.ChatHistory.chat_history_id == chat_id))).scalar()
+            return codes, deleted["status"], again.value.status_code, title
+
+    assert pg.run(scenario) == ([404, 404], "deleted", 404, "t")
@@ -0,0 +1,197 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import chat_persistence
+from utils.chat_persistence import ChatPersistence, _merge, write_turns
+
+
+def turn(chat_history_id="chat", user_id="user", message=None, **values):
+    return {
+        "chat_history_id": chat_history_id, "user_id": user_id, "document_id": "document", "title": "title",
+        "message": message if message is not None else [{"role": "user", "content": "q", "timestamp": "t"}],
+        **values,
+    }
+
+
+def test_merge_keeps_the_later_turn():
+    pending = turn(message=[{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}, {"role": "user", "content": "c"}], summary="old", summarized_count=2)
+    later = turn(message=[{"role": "user", "content": "d"}], summary="new", summarized_count=0)
+    #a shorter selected context still replaces a longer one, the summary was counted over it
+    assert _merge(pending, later) == later
+
+
+def test_merge_keeps_keys_only_the_pending_turn_has():
+    pending = turn(summary="summary", summarized_count=1)
+    later = turn(title="renamed")
+    assert _merge(pending, later) == dict(later, summary="summary", summarized_count=1)
+
+
+def test_turns_never_touch_chat_messages(db):
+    #new chat: not in chat_history, not archived, no selected_chat yet
+    asyncio.run(write_turns([turn(summary="s", summarized_count=0)], db))
+    assert "chat_messages" not in db.tables()
+    assert db.tables() == ["chat_history", "chat_history_archive", "chat_history", "selected_chat", "selected_chat", "search_entries"]
+    selected = db.params("selected_chat")[1][0]
+    assert selected["message"] == turn()["message"]
+    assert (selected["summary"], selected["summarized_count"]) == ("s", 0)
+
+
+def test_existing_selected_chat_gets_the_new_context(db):
+    context = [{"role": "assistant", "content": "a1", "timestamp": "t2"}, {"role": "user", "content": "q2", "timestamp": "t3"}]
+    db.results = [
+        [SimpleNamespace(chat_history_id="chat", user_id="user", active_tag=True)],
+        [("chat", "selected")],
+    ]
+    asyncio.run(write_turns([turn(message=context)], db))
+    assert db.tables() == ["chat_history", "chat_history", "selected_chat", "selected_chat", "search_entries"]
+    update = db.params("selected_chat")[1][0]
+    assert update["selected_chat_id"] == "selected" and update["message"] == context
+    assert "summary" not in update
+
+
+def test_turns_of_foreign_or_deleted_chats_are_skipped(db):
+    db.results = [[
+        SimpleNamespace(chat_history_id="foreign", user_id="someone else", active_tag=True),
+        SimpleNamespace(chat_history_id="deleted", user_id="user", active_tag=False),
+    ]]
+    asyncio.run(write_turns([turn("foreign"), turn("deleted")], db))
+    assert db.tables() == ["chat_history"]
+
+
+def test_write_behind_buffers_one_turn_per_chat():
+    persistence = ChatPersistence(mode="write_behind")
+    asyncio.run(persistence.save_turn(turn(summary="first", summarized_count=0)))
+    asyncio.run(persistence.save_turn(turn(summary="second", summarized_count=2, extra="dropped")))
+    asyncio.run(persistence.save_turn(turn("other")))
+    assert list(persistence._pending) == ["chat", "other"]
+    assert persistence._pending["chat"]["summary"] == "second"
+    assert "extra" not in persistence._pending["chat"]
+    memory = asyncio.run(persistence.load_memory("chat", "user", db=None))
+    assert (memory.summary, memory.summarized_count) == ("second", 2)
+
+
+def test_turn_without_chat_id_is_not_saved():
+    persistence = ChatPersistence(mode="write_behind")
+    asyncio.run(persistence.save_turn(turn(chat_history_id=None)))
+    assert persistence._pending == {}
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """ChatPersistence._write replaced by a recorder, failing while `failing` holds the chat ids to fail"""
+    state = SimpleNamespace(written=[], failing=set(), delay=0)
+
+    async def write(turns, db=None):
+        await asyncio.sleep(state.delay)
+        if any(turn["chat_history_id"] in state.failing for turn in turns):
+            raise RuntimeError("database unavailable")
+        state.written += [turn["chat_history_id"] for turn in turns]
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(ChatPersistence, "_write", staticmethod(write))
+    monkeypatch.setattr(chat_persistence.chat_cache, "invalidate", noop)
+    monkeypatch.setattr(chat_persistence.read_router, "record_write", noop)
+    return state
+
+
+def test_failed_turn_is_retried_with_the_next_flush(writes):
+    persistence = ChatPersistence(mode="write_behind")
+    writes.failing = {"chat"}
+    asyncio.run(persistence.save_turn(turn()))
+    asyncio.run(persistence.save_turn(turn("other")))
+    asyncio.run(persistence.flush())
+    assert writes.written == ["other"]
+    assert list(persistence._pending) == ["chat"]
+    writes.failing = set()
+    asyncio.run(persistence.flush())
+    assert writes.written == ["other", "chat"]
+    assert persistence._pending == {} and persistence._failures == {}
+
+
+def test_newer_turn_wins_over_a_requeued_one(writes):
+    persistence = ChatPersistence(mode="write_behind")
+    writes.failing = {"chat"}
+    asyncio.run(persistence.save_turn(turn(summary="old")))
+
+    async def scenario():
+        flush = asyncio.create_task(persistence.flush())
+        await asyncio.sleep(0)
+        #buffered while the failing write is running
+        await persistence.save_turn(turn(summary="new"))
+        await flush
+
+    writes.delay = 0.01
+    asyncio.run(scenario())
+    assert persistence._pending["chat"]["summary"] == "new"
+
+
+def test_turn_is_dropped_and_logged_after_the_retries(writes, monkeypatch, caplog):
+    monkeypatch.setattr(chat_persistence.settings, "CHAT_WRITE_BEHIND_MAX_RETRIES", 2)
+    persistence = ChatPersistence(mode="write_behind")
+    writes.failing = {"chat"}
+    asyncio.run(persistence.save_turn(turn()))
+    for _ in range(3):
+        asyncio.run(persistence.flush())
+    assert persistence._pending == {} and persistence._failures == {}
+    assert "dropping chat turn of chat after 3 failed writes" in caplog.text
+
+
+def test_stop_waits_for_a_running_flush(writes):
+    writes.delay = 0.05
+
+    async def scenario():
+        persistence = ChatPersistence(mode="write_behind")
+        persistence.start()
+        await persistence.save_turn(turn())
+        persistence._wakeup.set()
+        #the flush has taken the buffer and is writing when shutdown starts
+        await asyncio.sleep(0.01)
+        assert persistence._pending == {}
+        await persistence.save_turn(turn("late"))
+        await persistence.stop()
+        return persistence
+
+    persistence = asyncio.run(scenario())
+    assert writes.written == ["chat", "late"]
+    assert persistence._task is None
+
+
+def test_stop_retries_failed_turns(writes, monkeypatch):
+    monkeypatch.setattr(chat_persistence.settings, "CHAT_WRITE_BEHIND_MAX_RETRIES", 3)
+    persistence = ChatPersistence(mode="write_behind")
+    writes.failing = {"chat"}
+    asyncio.run(persistence.save_turn(turn()))
+    asyncio.run(persistence.stop())
+    assert persistence._pending == {}
+
+
+def test_pending_summary_of_another_users_chat_is_not_loaded(pg):
+    persistence = ChatPersistence(mode="write_behind")
+    asyncio.run(persistence.save_turn(turn(summary="private", summarized_count=2)))
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            return await persistence.load_memory("chat", "someone else", db=db)
+
+    assert pg.run(scenario).summary == ""
+
+
+def test_stored_summary_is_only_loaded_for_the_owner(pg):
+    import models
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            await pg.add_user(db, "other")
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="t"))
+            await db.flush()
+            db.add(models.SelectedChat(chat_history_id="chat", user_id="user", document_id="document", title="t", summary="private", summarized_count=2))
+            await db.commit()
+            persistence = ChatPersistence(mode="write_through")
+            return await persistence.load_memory("chat", "user", db=db), await persistence.load_memory("chat", "other", db=db)
+
+    owner, other = pg.run(scenario)
+    assert (owner.summary, owner.summarized_count) == ("private", 2)
+    assert (other.summary, other.summarized_count) == ("", 0)
@@ -0,0 +1,83 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from agents import workflow
+from agents.workflow import ProjectScopingAgent
+
+MESSAGES = [{"role": "user", "content": "which database?", "timestamp": "t1"}]
+
+
+class StreamingChains:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.calls = []
+
+    async def astream(self, name, inputs):
+        self.calls.append((name, inputs))
+        for token in self.tokens:
+            if isinstance(token, Exception):
+                raise token
+            yield token
+
+
+def collect(generator):
+    async def scenario():
+        return [item async for item in generator]
+    return asyncio.run(scenario())
+
+
+def test_stream_yields_the_generated_chunks(monkeypatch):
+    chains = StreamingChains(["Post", "", "gres"])
+    monkeypatch.setattr(workflow, "chains", chains)
+    assert collect(ProjectScopingAgent.stream_chat_with_doc(MESSAGES)) == ["Post", "gres"]
+    name, inputs = chains.calls[0]
+    assert name == "chat_with_doc_stream" and inputs["user_chat"] == "which database?"
+
+
+def test_unparsable_llm_json_is_reported_not_raised():
+    agent = ProjectScopingAgent.__new__(ProjectScopingAgent)
+    assert asyncio.run(agent._safe_json_parse("```json\n{\"a\": 1}\n```")) == {"a": 1}
+    assert asyncio.run(agent._safe_json_parse("not json")) == {"error": "Invalid JSON response from LLM"}
+
+
+@pytest.fixture
+def route(monkeypatch):
+    services = pytest.importorskip("routers.services")
+    saved = []
+
+    class Persistence:
+        async def load_memory(self, chat_history_id, user_id, db):
+            return workflow.ConversationMemory()
+
+        async def save_turn(self, chat, db=None):
+            saved.append(chat)
+
+    class Session:
+        async def close(self):
+            pass
+
+    monkeypatch.setattr(services, "chat_persistence", Persistence())
+    monkeypatch.setattr(services, "async_sessionlocal", Session)
+
+    def stream(tokens):
+        monkeypatch.setattr(workflow, "chains", StreamingChains(tokens))
+        request = services.ChatHistoryDetails(chat_history_id="chat", user_id="user", document_id="document", message=MESSAGES)
+        response = asyncio.run(services.conversation_with_doc_stream(request, current_user={"regular_login_token": {"id": "user"}}))
+        return "".join(collect(response.body_iterator))
+
+    return SimpleNamespace(stream=stream, saved=saved)
+
+
+def test_route_streams_tokens_then_done_and_saves_the_answer(route):
+    body = route.stream(["Post", "gres"])
+    events = body.strip().split("\n\n")
+    assert events[:2] == [f"data: {json.dumps({'token': 'Post'})}", f"data: {json.dumps({'token': 'gres'})}"]
+    assert events[2] == f"event: done\ndata: {json.dumps({'message': 'Postgres'})}"
+    assert route.saved[0]["message"][-1]["content"] == "Postgres"
+
+
+def test_failed_generation_ends_with_an_error_event_and_saves_nothing(route):
+    body = route.stream(["Post", RuntimeError("provider down")])
+    assert body.strip().split("\n\n")[-1] == f"event: error\ndata: {json.dumps({'detail': 'Internal server error'})}"
+    assert route.saved == []
@@ -0,0 +1,34 @@
+import pytest
+from utils import compression
+from utils.compression import compress_text, decompress_text
+
+pytest.importorskip("zstandard")
+
+TEXT = "The platform shall integrate with SAP. " * 200
+
+
+@pytest.fixture
+def zstd(monkeypatch):
+    monkeypatch.setattr(compression.settings, "CHAT_MESSAGE_COMPRESSION", "zstd")
+    monkeypatch.setattr(compression.settings, "CHAT_MESSAGE_COMPRESS_MIN_BYTES", 1024)
+
+
+def test_long_text_round_trips(zstd):
+    compressed = compress_text(TEXT)
+    assert compressed is not None and len(compressed) < len(TEXT)
+    assert decompress_text(compressed) == TEXT
+
+
+def test_short_text_stays_plain(zstd):
+    assert compress_text("short answer") is None
+
+
+def test_text_that_doesnt_shrink_stays_plain(zstd, monkeypatch):
+    #the zstd frame header outweighs what a few distinct characters save
+    monkeypatch.setattr(compression.settings, "CHAT_MESSAGE_COMPRESS_MIN_BYTES", 1)
+    assert compress_text("qwertyuiop") is None
+
+
+def test_nothing_is_compressed_when_turned_off(monkeypatch):
+    monkeypatch.setattr(compression.settings, "CHAT_MESSAGE_COMPRESSION", "none")
+    assert compress_text(TEXT) is None
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from utils import conversation_memory
+from utils.conversation_memory import MESSAGE_OVERHEAD_TOKENS, ConversationMemory, count_tokens, message_tokens
+
+
+@pytest.fixture(autouse=True)
+def character_estimate(monkeypatch):
+    #4 characters per token, the offline estimate, so budgets are exact
+    monkeypatch.setattr(conversation_memory, "_encoding", lambda: None)
+
+
+def turns(count:int, size:int=40):
+    return [{"role": "user" if index % 2 == 0 else "assistant", "content": f"{index:02d}" + "x" * (size - 2)} for index in range(count)]
+
+
+class Summarizer:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, summary, messages, max_tokens):
+        self.calls.append((summary, [message["content"][:2] for message in messages], max_tokens))
+        return f"{summary}+{len(messages)}"
+
+
+def test_character_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("x" * 40) == 11
+    assert message_tokens({"content": "x" * 40}) == 11 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_short_conversation_is_sent_verbatim():
+    summarizer = Summarizer()
+    memory = ConversationMemory(token_budget=1000, summary_tokens=100)
+    messages = turns(5)
+    inputs = asyncio.run(memory.prepare(messages, summarizer))
+    assert inputs == {"conversation_summary": "", "chat_context": messages[:-1], "user_chat": messages[-1]["content"]}
+    assert summarizer.calls == []
+    assert memory.state() == {"summary": None, "summarized_count": 0}
+
+
+def test_old_turns_are_folded_down_to_half_the_budget():
+    summarizer = Summarizer()
+    #15 tokens per message, 90 tokens left for the history after the summary and the question
+    memory = ConversationMemory(token_budget=201, summary_tokens=100)
+    messages = turns(11)
+    inputs = asyncio.run(memory.prepare(messages, summarizer))
+    #half of 90 keeps the last 3 of the 10 history messages
+    assert [message["content"][:2] for message in inputs["chat_context"]] == ["07", "08", "09"]
+    assert summarizer.calls == [("", ["00", "01", "02", "03", "04", "05", "06"], 100)]
+    assert memory.state() == {"summary": "+7", "summarized_count": 7}
+
+
+def test_next_fold_only_sends_the_new_messages():
+    summarizer = Summarizer()
+    memory = ConversationMemory(summary="+7", summarized_count=7, token_budget=201, summary_tokens=100)
+    asyncio.run(memory.prepare(turns(17), summarizer))
+    assert summarizer.calls[0][:2] == ("+7", ["07", "08", "09", "10", "11", "12"])
+    assert memory.summarized_count == 13
+
+
+def test_summary_of_a_longer_context_starts_again():
+    summarizer = Summarizer()
+    memory = ConversationMemory(summary="stale", summarized_count=20, token_budget=1000, summary_tokens=100)
+    inputs = asyncio.run(memory.prepare(turns(3), summarizer))
+    assert inputs["conversation_summary"] == ""
+    assert memory.state() == {"summary": None, "summarized_count": 0}
@@ -0,0 +1,35 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+import models
+
+database_scripts = pytest.importorskip("database_scripts")
+
+
+def test_documents_of_an_upload_are_registered_in_order(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user")
+            docs = [{"user_id": "user", "document_path": f"uploads/user/{name}.pdf"} for name in ("b", "a", "c")]
+            return await database_scripts.register_documents(docs, db)
+
+    registered = pg.run(scenario)
+    assert [doc["document_path"] for doc in registered] == ["uploads/user/b.pdf", "uploads/user/a.pdf", "uploads/user/c.pdf"]
+    assert len({doc["document_id"] for doc in registered}) == 3 and all(doc["user_id"] == "user" for doc in registered)
+
+
+def test_failed_registration_registers_nothing(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user")
+            with pytest.raises(HTTPException) as failed:
+                #the second document belongs to a user that doesn't exist
+                await database_scripts.register_documents([
+                    {"user_id": "user", "document_path": "uploads/user/a.pdf"},
+                    {"user_id": "nobody", "document_path": "uploads/nobody/b.pdf"},
+                ], db)
+            count = (await db.execute(select(func.count()).select_from(models.UserDocuments))).scalar()
+            return failed.value.status_code, count
+
+    assert pg.run(scenario) == (500, 0)
+
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+from utils import db_pool
+from utils.db_pool import TimedNullPool, TimedQueuePool, engine_options, instrument, pool_stats
+
+
+@pytest.fixture
+def queue_mode(monkeypatch):
+    monkeypatch.setattr(db_pool.settings, "DB_POOL_MODE", "queue")
+    monkeypatch.setattr(db_pool.settings, "DB_MAX_OVERFLOW", 1)
+
+
+def test_queue_mode_options(queue_mode):
+    options = engine_options()
+    assert options["poolclass"] is TimedQueuePool and options["max_overflow"] == 1
+    assert engine_options(is_async=True)["poolclass"] is db_pool.TimedAsyncQueuePool
+
+
+def test_transaction_pooler_mode_turns_off_prepared_statements(monkeypatch):
+    monkeypatch.setattr(db_pool.settings, "DB_POOL_MODE", "transaction_pooler")
+    assert engine_options() == {"poolclass": TimedNullPool}
+    assert engine_options(is_async=True)["connect_args"] == {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+
+
+@pytest.fixture
+def engine(queue_mode):
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.05)
+    instrument(engine, "test")
+    yield engine
+    engine.dispose()
+
+
+def test_checkouts_overflow_and_timeouts_are_counted(engine):
+    first, second = engine.connect(), engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    first.execute(text("SELECT 1"))
+    first.close()
+    second.close()
+    stats = pool_stats({"test": engine})["test"]
+    assert (stats["checkouts"], stats["in_use"], stats["peak_in_use"]) == (2, 0, 2)
+    assert (stats["overflow_opened"], stats["timeouts"]) == (1, 1)
+    assert stats["size"] == 1 and stats["max_overflow"] == 1
+    assert stats["wait_ms"]["p50"] is not None and stats["wait_ms"]["max"] >= stats["wait_ms"]["p50"]
+
+
+def test_metrics_survive_a_pool_recreate(engine):
+    metrics = engine.pool.metrics
+    engine.dispose()
+    with engine.connect():
+        pass
+    assert engine.pool.metrics is metrics and metrics.checkouts == 1
+
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from utils import db_router
+from utils.db_router import ReadRouter
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def __aenter__(self):
+        if self.engine.down:
+            raise OSError("connection refused")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement):
+        self.engine.checks += 1
+        return FakeResult(self.engine.lag)
+
+
+class FakeEngine:
+    """replica engine answering the lag query with `lag`, refusing connections while `down`"""
+    def __init__(self, lag=0.0):
+        self.lag = lag
+        self.down = False
+        self.checks = 0
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FailingRedis:
+    async def set(self, *args, **kwargs):
+        raise ConnectionError("redis unavailable")
+
+    async def exists(self, *keys):
+        raise ConnectionError("redis unavailable")
+
+
+@pytest.fixture(autouse=True)
+def windows(monkeypatch):
+    monkeypatch.setattr(db_router.settings, "REPLICA_MAX_LAG_SECONDS", 5)
+    #every pick checks the lag again
+    monkeypatch.setattr(db_router.settings, "REPLICA_LAG_CHECK_SECONDS", 0)
+    monkeypatch.setattr(db_router.settings, "READ_YOUR_WRITES_SECONDS", 10)
+
+
+def pick(router, user_id=None):
+    return asyncio.run(router.pick(user_id))
+
+
+def test_without_replicas_everything_reads_from_the_primary():
+    router = ReadRouter([])
+    asyncio.run(router.record_write("user"))
+    assert pick(router, "user") is None
+    assert len(router._writes) == 0
+
+
+def test_healthy_replicas_take_reads_round_robin():
+    engines = [FakeEngine(), FakeEngine(lag=1)]
+    router = ReadRouter(engines)
+    picked = [pick(router).engine for _ in range(4)]
+    assert picked == [engines[1], engines[0], engines[1], engines[0]]
+
+
+def test_lagging_replica_is_out_of_rotation_until_it_catches_up():
+    engines = [FakeEngine(), FakeEngine(lag=30)]
+    router = ReadRouter(engines)
+    assert {pick(router).engine for _ in range(3)} == {engines[0]}
+    assert router.replicas[1].lag == 30 and not router.replicas[1].healthy
+    engines[1].lag = 0
+    assert {pick(router).engine for _ in range(3)} == set(engines)
+
+
+def test_reads_go_to_the_primary_when_no_replica_qualifies():
+    engines = [FakeEngine(lag=30), FakeEngine()]
+    engines[1].down = True
+    router = ReadRouter(engines)
+    assert pick(router) is None
+    assert router.replicas[1].lag is None
+    assert [replica["healthy"] for replica in router.stats()["replicas"]] == [False, False]
+
+
+def test_lag_is_checked_at_most_every_check_interval(monkeypatch):
+    monkeypatch.setattr(db_router.settings, "REPLICA_LAG_CHECK_SECONDS", 60)
+    engine = FakeEngine()
+    router = ReadRouter([engine])
+    for _ in range(3):
+        pick(router)
+    assert engine.checks == 1
+
+
+def test_failed_replica_waits_for_the_next_check(monkeypatch):
+    monkeypatch.setattr(db_router.settings, "REPLICA_LAG_CHECK_SECONDS", 60)
+    router = ReadRouter([FakeEngine()])
+    assert pick(router) is router.replicas[0]
+    router.replicas[0].fail()
+    assert pick(router) is None
+
+
+def test_reads_of_a_recent_writer_stay_on_the_primary():
+    router = ReadRouter([FakeEngine()])
+    asyncio.run(router.record_write("user"))
+    assert pick(router, "user") is None
+    assert pick(router, "other") is router.replicas[0]
+    assert router.sticky_reads == 1
+
+
+def test_write_is_shared_with_the_other_workers(redis):
+    writer, reader = ReadRouter([FakeEngine()]), ReadRouter([FakeEngine()])
+    writer.attach(redis)
+    reader.attach(redis)
+    asyncio.run(writer.record_write("user"))
+    assert redis.values == {"db_router:wrote:user": 1}
+    assert pick(reader, "user") is None
+    assert pick(reader, "other") is reader.replicas[0]
+
+
+def test_unreachable_redis_keeps_the_reads_on_the_primary():
+    router = ReadRouter([FakeEngine()])
+    router.attach(FailingRedis())
+    #the local marker is still set when redis rejects the write
+    asyncio.run(router.record_write("user"))
+    assert "user" in router._writes
+    assert pick(router, "other") is None
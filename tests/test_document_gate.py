@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from agents import document_gate
+from agents.document_gate import classify_document, heuristic_classify, sample_excerpt
+from utils.prompts_response import DocumentGate
+
+INVOICE = """ACME Supplies
+Invoice #4411
+Bill to: Example Corp
+Payment terms: net 30, due date 2025-04-01
+Subtotal 1,200.00
+Amount due 1,440.00
+Remit to: ACME Supplies, PO box 12
+"""
+
+RFP = """Request for Proposal: Field Service Platform
+Scope of work: we want to build a platform for our technicians.
+Requirements: the system shall integrate with SAP through an API, and must support offline mode.
+Deliverables and milestones are listed below together with the acceptance criteria.
+"""
+
+AMBIGUOUS = """Quarterly notes
+The team met on Tuesday to discuss the timeline of the office move.
+"""
+
+
+class FakeChains:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = []
+
+    async def ainvoke(self, name, inputs):
+        self.calls.append((name, inputs))
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_heuristic_rejects_an_invoice():
+    gate = heuristic_classify(INVOICE)
+    assert gate is not None and not gate.is_technical_document
+    assert gate.document_type == "invoice"
+    assert gate.title == "ACME Supplies"
+
+
+def test_heuristic_accepts_an_rfp():
+    gate = heuristic_classify(RFP)
+    assert gate is not None and gate.is_technical_document
+    assert gate.title == "Request for Proposal: Field Service Platform"
+
+
+def test_heuristic_leaves_unclear_documents_to_the_model():
+    assert heuristic_classify(AMBIGUOUS) is None
+
+
+def test_repeated_markers_count_once():
+    assert heuristic_classify("invoice\n" * 50) is None
+
+
+def test_markers_match_whole_words():
+    #three technical markers, "api" inside "capital" would make it the fourth
+    assert heuristic_classify("architecture database workflow capital") is None
+    assert heuristic_classify("architecture database workflow api").is_technical_document
+
+
+def test_mixed_markers_are_unclear():
+    assert heuristic_classify(INVOICE + RFP) is None
+
+
+def test_sample_excerpt_keeps_head_middle_and_tail():
+    text = "H" * 100 + "M" * 100 + "T" * 100
+    excerpt = sample_excerpt(text, max_chars=30)
+    head, middle, tail = excerpt.split("\n...\n")
+    assert (head, middle, tail) == ("H" * 10, "M" * 10, "T" * 10)
+    assert sample_excerpt("short", max_chars=30) == "short"
+
+
+@pytest.fixture
+def mode(monkeypatch):
+    def set_mode(value):
+        monkeypatch.setattr(document_gate.settings, "DOCUMENT_GATE_MODE", value)
+    return set_mode
+
+
+def test_hybrid_skips_the_model_for_clear_documents(mode):
+    mode("hybrid")
+    chains = FakeChains()
+    assert not asyncio.run(classify_document(INVOICE, chains)).is_technical_document
+    assert chains.calls == []
+
+
+def test_hybrid_asks_the_model_for_unclear_documents(mode):
+    mode("hybrid")
+    answer = DocumentGate(is_technical_document=False, document_type="notes", document_analysis="meeting notes", title="Quarterly notes")
+    chains = FakeChains(result=answer)
+    assert asyncio.run(classify_document(AMBIGUOUS, chains)) == answer
+    assert [name for name, _ in chains.calls] == ["document_gate"]
+
+
+def test_heuristic_mode_passes_unclear_documents_through(mode):
+    mode("heuristic")
+    chains = FakeChains()
+    gate = asyncio.run(classify_document(AMBIGUOUS, chains))
+    assert gate.is_technical_document and gate.document_type == "unknown"
+    assert chains.calls == []
+
+
+def test_gate_fails_open_when_the_model_errors(mode):
+    mode("llm")
+    gate = asyncio.run(classify_document(INVOICE, FakeChains(error=RuntimeError("model down"))))
+    assert gate.is_technical_document
+
+
+def test_off_mode_classifies_nothing(mode):
+    mode("off")
+    chains = FakeChains()
+    assert asyncio.run(classify_document(INVOICE, chains)).is_technical_document
+    assert chains.calls == []
@@ -0,0 +1,68 @@
+import asyncio
+import random
+import pytest
+from langchain_core.messages import HumanMessage
+from agents import llm_backend
+from agents.llm_backend import StubChatModel, StubLLMError, get_chat_model
+from utils.partial_output import IncrementalFieldParser
+from utils.prompts_response import DocumentGate, ProjectDefinition
+
+
+def stub(**values):
+    return StubChatModel(**{"latency_ms": 0, "latency_jitter_ms": 0, "latency_distribution": "fixed", "completion_tokens": 20, **values})
+
+
+PROMPT = [HumanMessage(content="scope the field service platform")]
+
+
+def test_same_prompt_same_answer():
+    first, second = stub().invoke(PROMPT), stub().invoke(PROMPT)
+    assert first.content == second.content
+    assert first.usage_metadata == second.usage_metadata
+    assert first.usage_metadata["output_tokens"] == 20
+    assert stub(seed=1).invoke(PROMPT).content != first.content
+
+
+def test_structured_output_is_schema_valid():
+    gate = stub().with_structured_output(DocumentGate).invoke(PROMPT)
+    assert isinstance(gate, DocumentGate)
+
+
+def test_streamed_tool_call_parses_into_the_schema():
+    parser = IncrementalFieldParser(lambda field, value: None)
+
+    async def scenario():
+        async for chunk in stub().bind_tools([ProjectDefinition], tool_choice="ProjectDefinition").astream(PROMPT):
+            for tool_chunk in chunk.tool_call_chunks:
+                parser.feed(tool_chunk["args"] or "")
+
+    asyncio.run(scenario())
+    ProjectDefinition.model_validate(parser.finish())
+
+
+def test_streamed_text_adds_up_to_the_answer():
+    model = stub()
+    chunks = list(model.stream(PROMPT))
+    assert "".join(chunk.content for chunk in chunks) == model.invoke(PROMPT).content
+    assert chunks[-1].usage_metadata["output_tokens"] == 20
+
+
+def test_injected_errors_carry_a_status_code():
+    model = stub(error_rate=1.0, rate_limit_share=1.0)
+    with pytest.raises(StubLLMError) as error:
+        model.invoke(PROMPT)
+    assert error.value.status_code == 429
+
+
+@pytest.mark.parametrize("distribution", ["fixed", "uniform", "normal", "lognormal"])
+def test_latency_is_never_negative(distribution):
+    model = stub(latency_ms=5, latency_jitter_ms=50, latency_distribution=distribution)
+    assert all(model._latency(random.Random(seed)) >= 0 for seed in range(50))
+
+
+def test_stub_backend_is_selected_by_setting(monkeypatch):
+    monkeypatch.setattr(llm_backend.settings, "LLM_BACKEND", "stub")
+    assert isinstance(get_chat_model(model="gpt-4o-mini"), StubChatModel)
+    monkeypatch.setattr(llm_backend.settings, "LLM_BACKEND", "other")
+    with pytest.raises(ValueError, match="unsupported LLM_BACKEND"):
+        get_chat_model()
@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils.llm_governor import FairLimiter, LLMGovernor, TokenBucket, is_retryable, retry_after_seconds
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code:int, headers:dict=None):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def test_limiter_grants_up_to_the_limit():
+    async def scenario():
+        limiter = FairLimiter(2.5)
+        await limiter.acquire("a")
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("a"))
+        await asyncio.sleep(0)
+        assert not waiter.done() and limiter.active == 2
+        limiter.release()
+        await waiter
+        assert limiter.active == 2
+
+    asyncio.run(scenario())
+
+
+def test_limiter_serves_keys_round_robin():
+    async def scenario():
+        limiter = FairLimiter(1)
+        await limiter.acquire("holder")
+        order = []
+
+        async def call(key):
+            await limiter.acquire(key)
+            order.append(key)
+
+        #one key queues three calls before the other key queues one
+        tasks = [asyncio.create_task(call(key)) for key in ("heavy", "heavy", "heavy", "light")]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["heavy", "light", "heavy", "heavy"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = FairLimiter(1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter._waiting() == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_after_grant_gives_the_slot_back():
+    async def scenario():
+        limiter = FairLimiter(1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        limiter.release()
+        #the slot is handed over, the waiter is cancelled before it resumes
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.active == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def governor():
+    governor = LLMGovernor()
+    governor.limiter.limit = 4
+    governor.min_concurrency = 1
+    governor.max_concurrency = 8
+    governor.target_latency = 1.0
+    return governor
+
+
+def test_aimd_additive_increase(governor):
+    governor._on_success(0.5)
+    assert governor.limiter.limit == pytest.approx(4.25)
+
+
+def test_aimd_slow_call_shrinks_by_ten_percent(governor):
+    governor._on_success(2.0)
+    assert governor.limiter.limit == pytest.approx(3.6)
+
+
+def test_aimd_rate_limit_halves(governor):
+    governor._on_rate_limited()
+    assert governor.limiter.limit == pytest.approx(2)
+
+
+def test_aimd_stays_within_bounds(governor):
+    for _ in range(10):
+        governor._on_rate_limited()
+    assert governor.limiter.limit == governor.min_concurrency
+    for _ in range(1000):
+        governor._on_success(0.1)
+    assert governor.limiter.limit == governor.max_concurrency
+
+
+def test_rate_limited_call_lowers_the_limit(governor):
+    async def scenario():
+        with pytest.raises(HTTPError):
+            async with governor.limit():
+                raise HTTPError(429)
+
+    asyncio.run(scenario())
+    assert governor.limiter.limit == pytest.approx(2)
+    assert governor.limiter.active == 0
+
+
+def test_local_token_bucket():
+    bucket = TokenBucket("test", capacity=10, period=10)
+    assert bucket._take_local(6) == 0
+    wait = bucket._take_local(6)
+    assert 1.9 < wait <= 2.0
+    #nothing is taken when the caller has to wait
+    assert bucket._tokens == pytest.approx(4, abs=0.1)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (HTTPError(429), True),
+    (HTTPError(503), True),
+    (HTTPError(400), False),
+    #a conflict is an answer about the request, repeating it gets the same one
+    (HTTPError(409), False),
+    (asyncio.TimeoutError(), True),
+    (ValueError(), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) is retryable
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(HTTPError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(HTTPError(429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(HTTPError(429)) is None
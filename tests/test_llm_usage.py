@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from utils import llm_usage
+from utils.llm_context import llm_call_context, set_llm_context
+from utils.llm_usage import UsageCallbackHandler, UsageRecorder, get_usage_summary, usage_cost
+
+
+def test_usage_cost_uses_the_longest_matching_model_price():
+    #gpt-4o-mini, not gpt-4o
+    assert usage_cost("gpt-4o-mini-2024-07-18", 1_000_000, 1_000_000, 0) == pytest.approx(0.15 + 0.60)
+    assert usage_cost("gpt-4o", 1_000_000, 0, 500_000) == pytest.approx(1.25 + 0.625)
+    assert usage_cost("unknown", 1000, 1000, 0) == 0
+    assert usage_cost(None, 1000, 1000, 0) == 0
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    recorder = UsageRecorder()
+    monkeypatch.setattr(llm_usage, "usage_recorder", recorder)
+    return recorder
+
+
+def test_handler_records_tokens_model_and_tags(recorded):
+    token = llm_call_context.set({})
+    try:
+        set_llm_context(user_id="user", document_id="document", task_id="task")
+        handler = UsageCallbackHandler(stage="chat_with_doc")
+    finally:
+        llm_call_context.reset(token)
+    run_id = uuid4()
+    message = AIMessage(
+        content="answer",
+        usage_metadata={"input_tokens": 1000, "output_tokens": 200, "total_tokens": 1200, "input_token_details": {"cache_read": 400}},
+        response_metadata={"model_name": "gpt-4o-mini"},
+    )
+
+    async def scenario():
+        await handler.on_chat_model_start({}, [[]], run_id=run_id)
+        await handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=run_id)
+        await handler.on_chat_model_start({}, [[]], run_id=run_id)
+        await handler.on_llm_error(RuntimeError("failed"), run_id=run_id)
+
+    asyncio.run(scenario())
+    ok, error = recorded._buffer
+    assert (ok["user_id"], ok["document_id"], ok["task_id"], ok["stage"]) == ("user", "document", "task", "chat_with_doc")
+    assert (ok["model"], ok["status"], ok["prompt_tokens"], ok["completion_tokens"], ok["cached_tokens"], ok["cache_status"]) == ("gpt-4o-mini", "ok", 1000, 200, 400, "hit")
+    assert ok["cost_usd"] == pytest.approx(usage_cost("gpt-4o-mini", 1000, 200, 400))
+    assert (error["status"], error["prompt_tokens"], error["cache_status"]) == ("error", 0, "miss")
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    state = SimpleNamespace(written=[], failing=False, delay=0)
+
+    async def write(records):
+        await asyncio.sleep(state.delay)
+        if state.failing:
+            raise RuntimeError("database unavailable")
+        state.written += records
+
+    monkeypatch.setattr(UsageRecorder, "_write", staticmethod(write))
+    return state
+
+
+def test_failed_records_go_back_into_the_buffer(writes):
+    recorder = UsageRecorder()
+    recorder.record(stage="a")
+    writes.failing = True
+    asyncio.run(recorder.flush())
+    recorder.record(stage="b")
+    writes.failing = False
+    asyncio.run(recorder.flush())
+    assert [record["stage"] for record in writes.written] == ["a", "b"]
+
+
+def test_records_are_dropped_after_the_retries(writes, monkeypatch, caplog):
+    monkeypatch.setattr(llm_usage.settings, "LLM_USAGE_MAX_RETRIES", 1)
+    recorder = UsageRecorder()
+    recorder.record(stage="a")
+    writes.failing = True
+    asyncio.run(recorder.stop())
+    assert recorder._buffer == []
+    assert "dropping 1 llm usage records after 2 failed flushes" in caplog.text
+
+
+def test_stop_waits_for_a_running_flush(writes):
+    writes.delay = 0.05
+
+    async def scenario():
+        recorder = UsageRecorder()
+        recorder.start()
+        recorder.record(stage="a")
+        recorder._wakeup.set()
+        await asyncio.sleep(0.01)
+        recorder.record(stage="b")
+        await recorder.stop()
+
+    asyncio.run(scenario())
+    assert [record["stage"] for record in writes.written] == ["a", "b"]
+
+
+def usage(**values):
+    return dict({
+        "user_id": "user", "document_id": "document", "task_id": None, "stage": "analyze_input", "model": "gpt-4o-mini",
+        "status": "ok", "prompt_tokens": 100, "completion_tokens": 10, "cached_tokens": 0, "cache_status": "miss",
+        "latency_ms": 100, "cost_usd": 0.01,
+    }, **values)
+
+
+def test_usage_summary_rolls_up_per_group(pg):
+    async def scenario(sessions):
+        await UsageRecorder._write([
+            usage(),
+            usage(stage="chat_with_doc", latency_ms=300, cost_usd=0.05, status="error"),
+            usage(stage="chat_with_doc", latency_ms=100, cost_usd=0.05, cached_tokens=50),
+            usage(user_id="other", cost_usd=1.0),
+        ])
+        async with sessions() as db:
+            by_stage = await get_usage_summary(db=db, group_by="stage", user_id="user")
+            since = await get_usage_summary(db=db, group_by="model", since=datetime.now(timezone.utc) + timedelta(minutes=1))
+        return by_stage, since
+
+    by_stage, since = pg.run(scenario)
+    assert [row["stage"] for row in by_stage] == ["chat_with_doc", "analyze_input"]
+    chat = by_stage[0]
+    assert (chat["calls"], chat["errors"], chat["prompt_tokens"], chat["cached_tokens"], chat["cost_usd"]) == (2, 1, 200, 50, 0.1)
+    assert chat["avg_latency_ms"] == 200.0
+    assert since == []
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+import migrations
+import models
+from migrations import create_index_concurrently
+
+
+def _type(column_type, dialect) -> str:
+    #Float is double precision in Postgres, reflection names it that way
+    return {"FLOAT": "DOUBLE PRECISION"}.get(column_type.compile(dialect=dialect), column_type.compile(dialect=dialect))
+
+
+def test_migrated_schema_matches_the_models(migrated_database):
+    engine = create_engine(migrated_database, poolclass=NullPool)
+    try:
+        inspector = inspect(engine)
+        assert set(inspector.get_table_names()) == set(models.Base.metadata.tables) | {"schema_migrations"}
+        for name, table in models.Base.metadata.tables.items():
+            columns = {column["name"]: (_type(column["type"], engine.dialect), column["nullable"]) for column in inspector.get_columns(name)}
+            assert columns == {column.name: (_type(column.type, engine.dialect), column.nullable) for column in table.columns}, name
+            assert {index["name"] for index in inspector.get_indexes(name)} == {index.name for index in table.indexes}, name
+            foreign_keys = {(tuple(key["constrained_columns"]), key["referred_table"]) for key in inspector.get_foreign_keys(name)}
+            assert foreign_keys == {(tuple(key.column_keys), key.referred_table.name) for key in table.foreign_key_constraints}, name
+    finally:
+        engine.dispose()
+
+
+def test_upgrade_is_idempotent(migrated_database, monkeypatch):
+    monkeypatch.setattr(migrations.settings, "MIGRATION_DATABASE_URL", migrated_database)
+    assert migrations.upgrade() == []
+    assert all(migration["applied_at"] is not None for migration in migrations.status())
+
+
+@pytest.fixture
+def empty_database(migrated_database, monkeypatch):
+    """a database of its own, the migrations of the shared one are applied already"""
+    url = make_url(migrated_database)
+    name = f"{url.database}_migrations"
+    admin = create_engine(url, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    with admin.connect() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+        connection.execute(text(f"CREATE DATABASE {name}"))
+    empty = url.set(database=name).render_as_string(hide_password=False)
+    monkeypatch.setattr(migrations.settings, "MIGRATION_DATABASE_URL", empty)
+    yield empty
+    with admin.connect() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+    admin.dispose()
+
+
+def test_upgrade_stops_at_the_target_version(empty_database):
+    versions = [migration.version for migration in migrations.migrations()]
+    assert migrations.upgrade(target=versions[2]) == versions[:3]
+    assert [migration["applied_at"] is not None for migration in migrations.status()] == [version <= versions[2] for version in versions]
+    assert migrations.upgrade() == versions[3:]
+    assert versions[-1] == migrations.head()
+
+
+def test_invalid_index_is_rebuilt(empty_database):
+    engine = create_engine(empty_database, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("CREATE TABLE items (id INTEGER)"))
+            connection.execute(text("CREATE INDEX ix_items_id ON items (id)"))
+            #what an interrupted CREATE INDEX CONCURRENTLY leaves behind
+            connection.execute(text("UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'ix_items_id'::regclass"))
+            create_index_concurrently(connection, "ix_items_id", "ON items (id)")
+            valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = 'ix_items_id'::regclass")).scalar()
+    finally:
+        engine.dispose()
+    assert valid is True
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from agents import workflow
+from utils import partial_output
+from utils.partial_output import IncrementalFieldParser
+from utils.prompts_response import ProjectDefinition
+
+
+def _chunks(text:str, size:int):
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+
+OBJECT = {
+    "project_definition": {"summary": "Build a \"portal\", {not} a key", "goals": ["a", "b"]},
+    "technology_stack": ["python", "postgres"],
+    "risk_analysis": "none",
+}
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 1000])
+def test_fields_are_reported_once_in_generation_order(size):
+    reported = []
+    parser = IncrementalFieldParser(lambda field, value: reported.append((field, value)))
+    for chunk in _chunks(json.dumps(OBJECT), size):
+        parser.feed(chunk)
+    assert parser.finish() == OBJECT
+    assert reported == list(OBJECT.items())
+
+
+def test_field_is_final_once_the_next_key_appears():
+    reported = []
+    parser = IncrementalFieldParser(lambda field, value: reported.append(field))
+    assert parser.feed('{"project_definition": {"summary": "x"}') == []
+    assert parser.feed(', "technology_stack": ["py') == [("project_definition", {"summary": "x"})]
+    assert reported == ["project_definition"]
+    #the last field waits for finish
+    assert parser.feed('thon"]}') == []
+    parser.finish()
+    assert reported == ["project_definition", "technology_stack"]
+
+
+def test_feed_ignores_empty_and_unparsable_input():
+    parser = IncrementalFieldParser(lambda field, value: None)
+    assert parser.feed("") == []
+    assert parser.feed('"not an object') == []
+    assert parser.published == {}
+
+
+def test_finish_raises_on_incomplete_json():
+    parser = IncrementalFieldParser(lambda field, value: None)
+    parser.feed('{"a": 1, "b": ')
+    with pytest.raises(json.JSONDecodeError):
+        parser.finish()
+
+
+def test_each_field_is_parsed_once(monkeypatch):
+    parsed = []
+    loads = json.loads
+    monkeypatch.setattr(partial_output.json, "loads", lambda text: parsed.append(text) or loads(text))
+    parser = IncrementalFieldParser(lambda field, value: None)
+    for chunk in _chunks(json.dumps(OBJECT), 1):
+        parser.feed(chunk)
+    parser.finish()
+    #one parse per completed field and one of the whole object, however many chunks arrived
+    assert len(parsed) == len(OBJECT)
+
+
+@pytest.mark.parametrize("streamed", ["", "  \n"])
+def test_finish_without_output_raises_a_clear_error(streamed):
+    parser = IncrementalFieldParser(lambda field, value: None)
+    parser.feed(streamed)
+    with pytest.raises(ValueError, match="no output was streamed"):
+        parser.finish()
+
+
+def test_finish_rejects_a_non_object():
+    parser = IncrementalFieldParser(lambda field, value: None)
+    parser.feed('["a", "b"]')
+    with pytest.raises(ValueError, match="not a JSON object"):
+        parser.finish()
+
+
+def test_stream_without_tool_call_falls_back_to_the_plain_call(monkeypatch):
+    answer = ProjectDefinition(
+        title="portal", is_technical_document=True, document_analysis="rfp",
+        **{field: None for field in ProjectDefinition.model_fields if field not in ("title", "is_technical_document", "document_analysis")},
+    )
+
+    class Chains:
+        async def astream(self, name, inputs):
+            yield SimpleNamespace(content="I can't call tools", tool_call_chunks=[])
+
+        async def ainvoke(self, name, inputs):
+            assert name == "analyze_input"
+            return answer
+
+    monkeypatch.setattr(workflow, "chains", Chains())
+    reported = {}
+    result = asyncio.run(workflow.ProjectScopingAgent._stream_project_definition("document", reported.__setitem__))
+    assert result == answer
+    assert reported == answer.model_dump()
@@ -0,0 +1,145 @@
+import asyncio
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+import docx
+import pytest
+from agents import report
+from agents.report import ReportRenderer, analysis_hash, render_markdown, report_key
+
+REPORT = {
+    "requirements": {"project_definition": "portal", "technology_stack": ["python"]},
+    "tech_stack": {"backend": "fastapi"},
+    "ambiguities": {"items": []},
+}
+
+
+def test_hash_ignores_key_order():
+    reordered = {"ambiguities": {"items": []}, "tech_stack": {"backend": "fastapi"}, "requirements": {"technology_stack": ["python"], "project_definition": "portal"}}
+    assert analysis_hash(reordered) == analysis_hash(REPORT)
+
+
+def test_hash_changes_with_content():
+    changed = dict(REPORT, tech_stack={"backend": "django"})
+    assert analysis_hash(changed) != analysis_hash(REPORT)
+
+
+def test_hash_changes_with_template_version(monkeypatch):
+    before = analysis_hash(REPORT)
+    monkeypatch.setattr(report, "REPORT_TEMPLATE_VERSION", "test")
+    assert analysis_hash(REPORT) != before
+
+
+def test_hash_accepts_values_json_doesnt_know():
+    stamped = dict(REPORT, generated_at=datetime(2025, 1, 1))
+    assert analysis_hash(stamped) == analysis_hash(dict(REPORT, generated_at=str(datetime(2025, 1, 1))))
+
+
+def test_report_key():
+    digest = analysis_hash(REPORT)
+    assert len(digest) == 64
+    assert report_key(digest) == f"reports/{digest}.pdf"
+    assert report_key(digest, "docx") == f"reports/{digest}.docx"
+
+
+class FakeS3:
+    """the calls ReportRenderer makes, with the errors boto3 raises"""
+
+    def __init__(self, objects=None):
+        from botocore.exceptions import ClientError
+        self.objects = dict(objects or {})
+        self.calls = []
+        self.exceptions = SimpleNamespace(ClientError=ClientError, NoSuchKey=KeyError)
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(("head_object", Key))
+        if Key not in self.objects:
+            raise self.exceptions.ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ContentLength": len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key):
+        self.calls.append(("get_object", Key))
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def upload_fileobj(self, file_obj, bucket, key, ExtraArgs=None):
+        self.calls.append(("upload_fileobj", key))
+        self.objects[key] = file_obj.read()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setattr(report, "get_s3_client", lambda: client)
+    return client
+
+
+def test_ensure_checks_a_stored_rendering_without_downloading_it(s3):
+    digest = analysis_hash(REPORT)
+    s3.objects[report_key(digest, "md")] = b"stored"
+    assert asyncio.run(ReportRenderer().ensure(REPORT, digest, "md")) is None
+    assert s3.calls == [("head_object", report_key(digest, "md"))]
+
+
+def test_ensure_renders_and_uploads_a_missing_rendering(s3):
+    digest = analysis_hash(REPORT)
+    content = asyncio.run(ReportRenderer().ensure(REPORT, digest, "md"))
+    assert content == render_markdown(REPORT) == s3.objects[report_key(digest, "md")]
+    assert [name for name, _ in s3.calls] == ["head_object", "upload_fileobj"]
+
+
+def test_concurrent_ensures_render_once(s3):
+    renderer = ReportRenderer()
+
+    async def scenario():
+        return await asyncio.gather(*(renderer.ensure(REPORT, export_format="md") for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert sum(result is not None for result in results) == 1
+    assert [name for name, _ in s3.calls].count("upload_fileobj") == 1
+
+
+EXPORT = {
+    "requirements": {"title": "Field Service Platform", "is_technical_document": True, "scope_of_work": {"included": ["mobile app"]}},
+    "tech_stack": {"backend": "fastapi"},
+    "ambiguities": {"questions": ["Which ERP version?"]},
+}
+
+
+def test_sections_skip_the_title_and_flags():
+    assert [heading for heading, _ in report.report_sections(EXPORT)] == ["Scope Of Work", "Technology Stack", "Open Questions"]
+
+
+def test_markdown_export():
+    markdown = render_markdown(EXPORT).decode("utf-8")
+    assert markdown.startswith("# Field Service Platform\n")
+    assert "## Technology Stack" in markdown and "- **backend**:" in markdown
+    assert "## Open Questions\n- Which ERP version?" in markdown
+
+
+def test_json_export_round_trips():
+    assert json.loads(report.render_json(dict(EXPORT, generated_at=datetime(2025, 1, 1)))) == dict(EXPORT, generated_at="2025-01-01 00:00:00")
+
+
+def test_docx_export_has_the_title_and_sections():
+    document = docx.Document(io.BytesIO(report.render_docx(EXPORT)))
+    texts = [paragraph.text for paragraph in document.paragraphs]
+    assert texts[0] == "Field Service Platform"
+    assert {"Scope Of Work", "Technology Stack", "Open Questions", "Which ERP version?"} <= set(texts)
+
+
+def test_pdf_export_is_a_pdf():
+    assert report.render_report(EXPORT).startswith(b"%PDF")
+
+
+def test_iter_content_chunks_bytes_and_closes_bodies():
+    assert collect(report.iter_content(b"abcde", chunk_size=2)) == [b"ab", b"cd", b"e"]
+    body = io.BytesIO(b"abcde")
+    assert collect(report.iter_content(body, chunk_size=4)) == [b"abcd", b"e"]
+    assert body.closed
+
+
+def collect(iterator):
+    async def scenario():
+        return [chunk async for chunk in iterator]
+    return asyncio.run(scenario())
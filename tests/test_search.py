@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+import models
+from utils.search import _chunks, chat_message_entries, chat_title_entry, index_analysis, index_document_text, index_entries, remove_chat_entries, search
+
+
+def test_chunks_split_on_whitespace_and_keep_every_character():
+    text = "alpha beta gamma delta epsilon zeta"
+    chunks = _chunks(text, 12)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 12 for chunk in chunks)
+    #no word is cut in two
+    assert all(set(chunk.split()) <= set(text.split()) for chunk in chunks)
+
+
+def test_message_entries_are_numbered_by_seq():
+    messages = [{"content": "hello"}, {"content": ""}, {"content": {"message": "structured"}}]
+    entries = chat_message_entries("user", "document", "chat", 4, messages)
+    assert [(entry["part"], entry["body"]) for entry in entries] == [(4, "hello"), (6, '{"message": "structured"}')]
+
+
+@pytest.mark.parametrize("query, sources", [("  ", None), ("kafka", ["emails"])])
+def test_invalid_searches_are_rejected(query, sources):
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(search("user", query, db=None, sources=sources))
+    assert rejected.value.status_code == 400
+
+
+@pytest.fixture
+def indexed(pg):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await pg.add_user(db, "user", ["document"])
+            await pg.add_user(db, "other", ["other document"])
+            db.add(models.ChatHistory(chat_history_id="chat", user_id="user", document_id="document", title="Kafka migration"))
+            await db.flush()
+            await index_entries([chat_title_entry("user", "document", "chat", "Kafka migration")], db)
+            await index_entries(chat_message_entries("user", "document", "chat", 0, [
+                {"content": "How do we move the event bus to kafka?"},
+                {"content": "Run both brokers side by side and switch consumers one by one."},
+            ]), db)
+            await index_document_text("user", "document", "RFP", "The platform publishes events to Kafka topics. " * 3, db)
+            await index_analysis("user", "document", "analysis", "Field Service Platform", {"tech_stack": {"queue": "kafka"}}, db)
+            await index_entries([chat_title_entry("other", "other document", "other chat", "kafka for someone else")], db)
+            await db.commit()
+    pg.run(scenario)
+    return pg
+
+
+def run_search(pg, *args, **kwargs):
+    async def scenario(sessions):
+        async with sessions() as db:
+            return await search(*args, db=db, **kwargs)
+    return pg.run(scenario)
+
+
+def test_search_finds_every_source_of_the_user_only(indexed):
+    results = run_search(indexed, "user", "kafka")["results"]
+    assert {result["source"] for result in results} == {"chat_title", "chat_message", "document", "analysis"}
+    assert "other chat" not in {result["source_id"] for result in results}
+    #a message result carries the title of its chat, snippets highlight the match
+    message = next(result for result in results if result["source"] == "chat_message")
+    assert message["title"] == "Kafka migration" and "<b>kafka</b>" in message["snippet"].lower()
+    #the document chunks take the analysis title
+    assert next(result for result in results if result["source"] == "document")["title"] == "Field Service Platform"
+
+
+def test_titles_rank_above_bodies(indexed):
+    assert run_search(indexed, "user", "kafka migration")["results"][0]["source"] == "chat_title"
+
+
+def test_sources_filter(indexed):
+    results = run_search(indexed, "user", "kafka", sources=["analysis"])["results"]
+    assert [result["source_id"] for result in results] == ["analysis"]
+
+
+def test_pages_cover_every_result_once(indexed):
+    everything = [(result["source"], result["source_id"], result["part"]) for result in run_search(indexed, "user", "kafka")["results"]]
+    paged, cursor = [], None
+    while True:
+        page = run_search(indexed, "user", "kafka", limit=1, cursor=cursor)
+        paged += [(result["source"], result["source_id"], result["part"]) for result in page["results"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert paged == everything
+
+
+def test_removed_chat_is_no_longer_found(indexed):
+    async def scenario(sessions):
+        async with sessions() as db:
+            await remove_chat_entries("chat", db)
+            await db.commit()
+            return await search("user", "kafka", db=db)
+    assert {result["source"] for result in indexed.run(scenario)["results"]} == {"document", "analysis"}
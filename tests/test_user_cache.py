@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from utils import user_cache as user_cache_module
+from utils.user_cache import UserCache, profile_key, user_key
+
+
+PROFILE = {
+    "user_id": "user", "oauth_id": None, "email_address": "user@example.com", "full_name": "A B", "first_name": "A",
+    "last_name": "B", "verified_email": False, "picture": None, "provider": "Local",
+}
+
+
+@pytest.fixture
+def cache(monkeypatch, redis):
+    monkeypatch.setattr(user_cache_module.settings, "USER_CACHE_TTL_SECONDS", 900)
+    cache = UserCache()
+    cache.attach(redis)
+    return cache
+
+
+def load(value, calls):
+    async def loader():
+        calls.append(value)
+        return value
+    return loader
+
+
+def test_loaded_profile_is_cached_under_every_key(cache):
+    calls = []
+    aliases = lambda profile: [user_key(profile["user_id"])]
+    key = profile_key("user@example.com", "Local")
+    assert asyncio.run(cache.get_or_load(key, load(PROFILE, calls), aliases)) == PROFILE
+    assert asyncio.run(cache.get_or_load(key, load(PROFILE, calls), aliases)) == PROFILE
+    assert calls == [PROFILE]
+    assert set(cache.redis.values) == {key, user_key("user")}
+
+
+def test_redis_entry_fills_another_workers_local_tier(cache):
+    key = profile_key("user@example.com", "Local")
+    asyncio.run(cache.set([key], PROFILE))
+    other = UserCache()
+    other.attach(cache.redis)
+    assert asyncio.run(other.get(key)) == PROFILE
+    assert key in other._local
+
+
+def test_missing_users_are_not_cached(cache):
+    calls = []
+    key = profile_key("nobody@example.com", "Local")
+    asyncio.run(cache.get_or_load(key, load(None, calls)))
+    asyncio.run(cache.get_or_load(key, load(None, calls)))
+    assert calls == [None, None]
+    assert cache.redis.values == {}
+
+
+def test_invalidate_by_user_id_drops_the_profile_keys(cache):
+    keys = [profile_key("user@example.com", "Local"), user_key("user")]
+    asyncio.run(cache.set(keys, PROFILE))
+    asyncio.run(cache.invalidate(user_id="user"))
+    assert cache.redis.values == {} and len(cache._local) == 0
+
+
+def test_load_racing_an_invalidation_is_not_stored(cache):
+    key = profile_key("user@example.com", "Local")
+
+    async def stale_loader():
+        #the user changes while the database read is in flight
+        await cache.invalidate(user_id="user", email_address="user@example.com", provider="Local")
+        return PROFILE
+
+    assert asyncio.run(cache.get_or_load(key, stale_loader)) == PROFILE
+    assert asyncio.run(cache.get(key)) is None
+
+
+def test_disabled_cache_always_loads(cache, monkeypatch):
+    monkeypatch.setattr(user_cache_module.settings, "USER_CACHE_TTL_SECONDS", 0)
+    calls = []
+    key = profile_key("user@example.com", "Local")
+    asyncio.run(cache.get_or_load(key, load(PROFILE, calls)))
+    asyncio.run(cache.get_or_load(key, load(PROFILE, calls)))
+    assert len(calls) == 2 and cache.redis.values == {}
+
+
+def test_login_reads_the_current_hash_and_never_caches_it(pg, cache, monkeypatch):
+    pytest.importorskip("easyocr")
+    import models
+    import database_scripts
+    from sqlalchemy import update
+
+    monkeypatch.setattr(database_scripts, "user_cache", cache)
+
+    async def scenario(sessions):
+        async with sessions() as db:
+            db.add(models.User(user_id="user", email_address="user@example.com", full_name="A B", first_name="A", last_name="B", verified_email=False, provider="Local"))
+            await db.flush()
+            db.add(models.LoginDetails(user_id="user", hashed_password="old-hash"))
+            await db.commit()
+            first = await database_scripts.get_user_details("user@example.com", db)
+            await db.execute(update(models.LoginDetails).where(models.LoginDetails.user_id == "user").values(hashed_password="new-hash"))
+            await db.commit()
+            second = await database_scripts.get_user_details("user@example.com", db)
+        return first, second
+
+    first, second = pg.run(scenario)
+    assert (first.hashed_password, second.hashed_password) == ("old-hash", "new-hash")
+    assert second.user_id == "user" and second.first_name == "A"
+    cached = list(cache.redis.values.values()) + list(cache._local.values())
+    assert cached and not any("hash" in value for value in cached)
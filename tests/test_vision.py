@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from PIL import Image
+from agents import vision
+from agents.vision import BatchImageSummarizer, estimate_image_tokens, DEFAULT_IMAGE_TOKENS, RESPONSE_TOKENS_PER_IMAGE
+
+
+def _image(tmp_path, name, size):
+    path = tmp_path / f"{name}.png"
+    Image.new("RGB", size).save(path)
+    return str(path)
+
+
+def _blocks(paths):
+    return [{"type": "image", "data": path, "content": None} for path in paths]
+
+
+@pytest.mark.parametrize("size, tokens", [
+    ((512, 512), 170 + 85),
+    ((1024, 1024), 170 * 4 + 85),
+    ((4096, 2048), 170 * 6 + 85),
+])
+def test_estimate_image_tokens(tmp_path, size, tokens):
+    assert estimate_image_tokens(_image(tmp_path, "image", size)) == tokens
+
+
+def test_estimate_image_tokens_unreadable(tmp_path):
+    assert estimate_image_tokens(str(tmp_path / "missing.png")) == DEFAULT_IMAGE_TOKENS
+
+
+def test_batches_respect_max_images(tmp_path):
+    paths = [_image(tmp_path, f"image{index}", (512, 512)) for index in range(5)]
+    batches = BatchImageSummarizer(max_images=2, token_budget=100_000)._batches(_blocks(paths))
+    assert [[block["data"] for block in batch] for batch, _ in batches] == [paths[0:2], paths[2:4], paths[4:5]]
+    assert [tokens for _, tokens in batches] == [2 * (255 + RESPONSE_TOKENS_PER_IMAGE), 2 * (255 + RESPONSE_TOKENS_PER_IMAGE), 255 + RESPONSE_TOKENS_PER_IMAGE]
+
+
+def test_batches_respect_token_budget(tmp_path):
+    small = 255 + RESPONSE_TOKENS_PER_IMAGE
+    large = 765 + RESPONSE_TOKENS_PER_IMAGE
+    paths = [_image(tmp_path, "small0", (512, 512)), _image(tmp_path, "large", (1024, 1024)), _image(tmp_path, "small1", (512, 512))]
+    batches = BatchImageSummarizer(max_images=10, token_budget=small + large)._batches(_blocks(paths))
+    assert [len(batch) for batch, _ in batches] == [2, 1]
+    assert [tokens for _, tokens in batches] == [small + large, small]
+
+
+def test_image_over_budget_gets_its_own_batch(tmp_path):
+    paths = [_image(tmp_path, "small", (512, 512)), _image(tmp_path, "large", (1024, 1024))]
+    batches = BatchImageSummarizer(max_images=10, token_budget=100)._batches(_blocks(paths))
+    assert [len(batch) for batch, _ in batches] == [1, 1]
+
+
+def test_summarize_falls_back_for_missing_images(tmp_path, monkeypatch):
+    paths = [_image(tmp_path, f"image{index}", (512, 512)) for index in range(3)]
+    single = []
+
+    async def ainvoke(name, message, estimated_tokens=None):
+        assert name == "summarize_images"
+        #the response skips the second image
+        return SimpleNamespace(images=[SimpleNamespace(image_index=1, summary="first"), SimpleNamespace(image_index=3, summary="third")])
+
+    async def summarize_image(image_path):
+        single.append(image_path)
+        return "single"
+
+    monkeypatch.setattr(vision.chains, "ainvoke", ainvoke)
+    monkeypatch.setattr(vision.ProjectScopingAgent, "summarize_image", summarize_image)
+    monkeypatch.setattr(vision.ProjectScopingAgent, "image_url", lambda image_path: f"data:{image_path}")
+
+    content = [{"type": "text", "data": "text", "content": None}] + _blocks(paths)
+    asyncio.run(BatchImageSummarizer(max_images=3, token_budget=100_000).summarize(content))
+    assert [block["content"] for block in content] == [None, "first", "single", "third"]
+    assert single == [paths[1]]
+
+
+def test_summarize_skips_images_with_a_summary(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no request expected")
+
+    monkeypatch.setattr(vision.chains, "ainvoke", fail)
+    monkeypatch.setattr(vision.ProjectScopingAgent, "summarize_image", fail)
+    content = [{"type": "image", "data": "image.png", "content": "done"}]
+    assert asyncio.run(BatchImageSummarizer().summarize(content)) == content